@@ -0,0 +1,409 @@
+#!/usr/bin/python3
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from pathlib import Path as path
+import time
+import Terminal
+import Settings
+import ChangeCache
+import DependencyIndex
+import LargeFiles
+import ObjectCache
+import RepoStatus
+import Restore
+import SharedFetch
+import Workspace
+import Trace
+
+def dependency_graph(cwd: path, roots: list):
+    """
+    Builds the dependency graph of the workspace repositories reachable from a list of root repositories.
+    Only dependencies that are also cloned under the workspace roots become nodes of the graph.
+    param: cwd [path] The GitHub current working directory
+    param: roots [list] Names of the root repositories
+    returns: dict mapping a repository name to the set of workspace repositories it depends on
+    """
+    repo_dirs = Workspace.repository_dirs(cwd)
+    DependencyIndex.refresh(cwd, list(repo_dirs.values()))
+    graph = {}
+    to_visit = [root for root in roots if root in repo_dirs]
+    while len(to_visit) > 0:
+        repo_name = to_visit.pop()
+        if repo_name in graph:
+            continue
+        deps = DependencyIndex.get_dependency_names(repo_dir=repo_dirs[repo_name], refresh_entry=False)
+        graph[repo_name] = set([dep for dep in deps if dep in repo_dirs])
+        to_visit.extend(graph[repo_name])
+    return graph
+
+def topological_levels(graph: dict):
+    """
+    Sorts a dependency graph into levels, leaves first. Repositories in the same level do not depend on each other.
+    param: graph [dict] Maps a repository name to the set of repositories it depends on
+    returns: (list of levels, each a sorted list of names; sorted list of names caught in a dependency cycle)
+    """
+    remaining = {repo_name: set(deps) for repo_name, deps in graph.items()}
+    levels = []
+    while len(remaining) > 0:
+        # repos whose deps were all placed in earlier levels
+        level = sorted([repo_name for repo_name, deps in remaining.items() if len(deps) == 0])
+        if len(level) == 0:
+            break # everything left is part of, or depends on, a cycle
+        levels.append(level)
+        for repo_name in level:
+            del remaining[repo_name]
+        for deps in remaining.values():
+            deps.difference_update(level)
+    return (levels, sorted(remaining.keys()))
+
+def pinned_sha(repo_dir: path, dep_path: str):
+    """
+    Gets the commit a parent repository has pinned for one of its dependencies, or None if it is not committed yet.
+    param: repo_dir [path] Directory of the parent repository
+    param: dep_path [str] Path of the dependency inside the parent
+    """
+    result = Terminal.run_bash_cmd(["git", "ls-tree", "HEAD", dep_path], cwd=repo_dir, verbose=False)
+    if result is None or result.returncode != 0 or len(result.stdout.split()) < 3:
+        return None
+    return result.stdout.split()[2]
+
+def remote_sha(repo_dir: path, url: str, branch: str=None):
+    """
+    Gets the latest commit of a dependency's remote branch, or its default branch, without fetching. Each remote is
+    only asked once per fetch session, however many parents share it.
+    param: repo_dir [path] Directory to run from
+    param: url [str] The remote URL of the dependency
+    param: branch [str] Optional branch of the dependency; the remote HEAD is used if None
+    """
+    # "." tracks the parent's branch, which submodule update --remote reads from the remote HEAD as well
+    ref = f"refs/heads/{branch}" if branch not in (None, ".") else "HEAD"
+    return SharedFetch.ls_remote(repo_dir, url, ref)
+
+def outdated_dependencies(repo_dir: path):
+    """
+    Gets the dependencies of a repository whose pinned commit is not the latest one on their remote.
+    param: repo_dir [path] Directory of the parent repository
+    returns: list of submodule dicts (name, path, url, branch, repo)
+    """
+    outdated = []
+    for dep in DependencyIndex.get_dependencies(repo_dir=repo_dir, refresh_entry=False):
+        if dep["path"] is None or dep["url"] is None:
+            continue
+        latest = remote_sha(repo_dir, dep["url"], dep["branch"])
+        if latest is None or pinned_sha(repo_dir, dep["path"]) != latest:
+            outdated.append(dep)
+    return outdated
+
+def update_preview(repo_dirs: list, max_workers: int=None):
+    """
+    Finds which dependencies of many repositories an update would change, without checking out or fetching anything.
+    Pinned commits are read from each repository's index and the latest commits from one query per distinct remote.
+    param: repo_dirs [list] Directories of the parent repositories
+    param: max_workers [int] Optional max number of remotes queried at once; defaults to the pool_workers setting
+    returns: list of dicts of parent repo, dependency repo, path, pinned SHA, latest SHA and status ("outdated",
+    "current", or "unknown" if the remote could not be read), sorted by parent and path
+    """
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    rows = []
+    for repo_dir in repo_dirs:
+        pinned = Restore.pinned_dependencies(repo_dir)
+        for dep in DependencyIndex.get_dependencies(repo_dir=repo_dir):
+            if dep["path"] is not None and dep["url"] is not None and dep["path"] in pinned:
+                rows.append({"repo": repo_dir.name, "dependency": dep["repo"], "path": dep["path"], "pinned": pinned[dep["path"]],
+                             "latest": None, "status": "unknown", "url": dep["url"], "branch": dep["branch"], "cwd": repo_dir})
+    # every remote is asked once, however many parents share it
+    urls = sorted(set([row["url"] for row in rows]))
+    cwds = dict([(row["url"], row["cwd"]) for row in rows])
+    with SharedFetch.session(), ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        list(executor.map(lambda url: SharedFetch.remote_refs(cwds[url], url), urls))
+        for row in rows:
+            row["latest"] = remote_sha(row.pop("cwd"), row.pop("url"), row.pop("branch"))
+            if row["latest"] is not None:
+                row["status"] = "current" if row["latest"] == row["pinned"] else "outdated"
+    rows.sort(key=lambda row: (row["repo"], row["path"]))
+    return rows
+
+def format_preview_row(row: dict, widths: tuple):
+    """
+    Formats a row of an update preview as one colored table line.
+    param: row [dict] A row from update_preview
+    param: widths [tuple] Widths of the parent and dependency columns
+    """
+    colors = {"outdated": Terminal.Text.YELLOW, "current": Terminal.Text.GREEN, "unknown": Terminal.Text.RED}
+    latest = row["latest"][:7] if row["latest"] is not None else "?"
+    return f"{row['repo']:<{widths[0]}}  {row['dependency']:<{widths[1]}}  {row['pinned'][:7]} -> {latest}  {colors[row['status']]}{row['status']}{Terminal.Text.RESET}"
+
+def update_repository_dependencies(repo_dir: path, should_stop: any=None, on_progress: any=None):
+    """
+    Updates the outdated dependencies of one repository to their latest versions, then commits and pushes the change.
+    Repositories whose dependencies are all current are skipped.
+    This runs quietly so it can be used from a worker pool.
+    param: repo_dir [path] Directory of the parent repository
+    param: should_stop [any] Optional function returning True to stop, i.e. a cancelled job; checked before anything is
+    changed, since stopping between the commit and the push would leave the update half done
+    param: on_progress [any] Optional function called with a short text of the step running
+    returns: (repo name, status, detail, seconds taken) where status is "updated", "current", "failed" or "cancelled"
+    """
+    should_stop = should_stop if should_stop is not None else lambda: False
+    on_progress = on_progress if on_progress is not None else lambda text: None
+    start_time = time.perf_counter()
+    on_progress("finding outdated dependencies")
+    outdated = outdated_dependencies(repo_dir)
+    if len(outdated) == 0:
+        return (repo_dir.name, "current", "", time.perf_counter() - start_time)
+    if should_stop():
+        return (repo_dir.name, "cancelled", "", time.perf_counter() - start_time)
+    on_progress(f"fetching {', '.join([dep['repo'] for dep in outdated])}")
+    dep_paths = [dep["path"] for dep in outdated]
+    # fetch outdated deps through the store so deps shared by many parents are fetched once; only skip git's own fetch
+    # if every one of them could
+    fetched = all([SharedFetch.fetch_dependency(repo_dir / dep["path"]) for dep in outdated if (repo_dir / dep["path"] / ".git").exists()])
+    bash_cmds = [
+        # get latest versions of outdated deps and push these changes to github
+        ["git"] + LargeFiles.config_args() + ["submodule", "update", "--init", "--remote"] + (["--no-fetch"] if fetched else []) + ObjectCache.reference_args() + ["--"] + dep_paths,
+        ["git", "add", "--"] + dep_paths,
+        ["git", "commit", "-m", f"Updated submodules/dependencies {', '.join([dep['repo'] for dep in outdated])}"],
+        ["git", "push"]
+    ]
+    if should_stop():
+        return (repo_dir.name, "cancelled", "", time.perf_counter() - start_time)
+    for cmd in bash_cmds:
+        on_progress(Trace.command_name(cmd))
+        result = Terminal.run_bash_cmd(cmd, cwd=repo_dir, verbose=False)
+        if result is None or result.returncode != 0:
+            err_text = result.stderr.strip() if result is not None else ""
+            err_line = err_text.splitlines()[-1] if len(err_text) > 0 else ""
+            return (repo_dir.name, "failed", f"{' '.join(cmd)}: {err_line}", time.perf_counter() - start_time)
+    # the remote of this repo changed; parents of it must see the new commit
+    result = Terminal.run_bash_cmd(["git", "config", "--get", "remote.origin.url"], cwd=repo_dir, verbose=False)
+    if result is not None and result.returncode == 0:
+        SharedFetch.forget_url(result.stdout.strip())
+    # bring nested deps to the versions the updated deps pin
+    on_progress("restoring nested dependencies")
+    repo_name, succeeded, failed_cmd, err_text, elapsed, changes = Restore.restore_repository(repo_dir, max_workers=1, should_stop=should_stop)
+    if failed_cmd == "cancelled":
+        return (repo_dir.name, "cancelled", f"pushed, but nested dependencies of {', '.join([dep['repo'] for dep in outdated])} were not restored", time.perf_counter() - start_time)
+    if not succeeded:
+        return (repo_dir.name, "failed", f"{failed_cmd}: {err_text.splitlines()[-1] if len(err_text) > 0 else ''}", time.perf_counter() - start_time)
+    return (repo_dir.name, "updated", ", ".join([dep["repo"] for dep in outdated]), time.perf_counter() - start_time)
+
+def update_assembly(cwd: path, roots: list, max_workers: int=None, verbose: bool=True):
+    """
+    Updates dependencies to their latest versions across whole assembly trees. Repositories are updated leaves first,
+    one dependency level at a time, with independent repositories of the same level updated in parallel.
+    Repositories in a dependency cycle, or that depend on a repository that failed, are skipped.
+    param: cwd [path] The GitHub current working directory
+    param: roots [list] Names of the top-level assembly repositories
+    param: max_workers [int] Optional max number of repositories updated at once; defaults to the pool_workers setting
+    param: verbose [bool] Optional to indicate if progress should be printed
+    returns: list of (repo name, status, detail, seconds taken) where status is "updated", "current", "failed", "blocked" or "cycle"
+    """
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    margin = " " * 4
+    graph = dependency_graph(cwd, roots)
+    repo_dirs = Workspace.repository_dirs(cwd)
+    levels, cycle = topological_levels(graph)
+    results = [(repo_name, "cycle", "part of or depends on a dependency cycle", 0.0) for repo_name in cycle]
+    failed = set(cycle)
+    with SharedFetch.session(), ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        for level_number, level in enumerate(levels):
+            # repos without deps have nothing to update
+            level = [repo_name for repo_name in level if len(DependencyIndex.get_dependencies(repo_dirs[repo_name], refresh_entry=False)) > 0]
+            if len(level) == 0:
+                continue
+            if verbose:
+                print(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.UNDERLINE}Level {level_number}:{Terminal.Text.RESET} {', '.join(level)}")
+            blocked = [repo_name for repo_name in level if len(graph[repo_name] & failed) > 0]
+            for repo_name in blocked:
+                results.append((repo_name, "blocked", f"depends on failed {', '.join(sorted(graph[repo_name] & failed))}", 0.0))
+                failed.add(repo_name)
+            runnable = [repo_name for repo_name in level if repo_name not in blocked]
+            futures = [executor.submit(update_repository_dependencies, repo_dirs[repo_name]) for repo_name in runnable]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                repo_name, status, detail, elapsed = result
+                if status == "failed":
+                    failed.add(repo_name)
+                if not verbose:
+                    continue
+                color = Terminal.Text.RED if status == "failed" else Terminal.Text.GREEN
+                print(f"{margin}  {color}{status}{Terminal.Text.RESET} {repo_name} {Terminal.Text.GREY}({elapsed:.1f}s){Terminal.Text.RESET} {detail}")
+    return results
+
+def checkout_tree(repo_dir: path):
+    """
+    Gets a repository and every dependency checked out inside it, including nested ones.
+    param: repo_dir [path] Directory of the repository
+    returns: dict mapping each checkout directory to (directory of its parent, path inside the parent); both are None
+    for the repository itself
+    """
+    tree = {repo_dir: (None, None)}
+    to_visit = [repo_dir]
+    while len(to_visit) > 0:
+        parent_dir = to_visit.pop()
+        for dep_path in Restore.pinned_dependencies(parent_dir):
+            if RepoStatus.git_dir(parent_dir / dep_path) is not None:
+                tree[parent_dir / dep_path] = (parent_dir, dep_path)
+                to_visit.append(parent_dir / dep_path)
+    return tree
+
+def checkout_name(repo_dir: path, checkout: path):
+    """
+    Gets the name of a checkout as shown to people, i.e. Main/dep/Enclosure/dep/StandardCAD.
+    param: repo_dir [path] Directory of the repository the checkout is in
+    param: checkout [path] Directory of the checkout
+    """
+    return "/".join((repo_dir.name,) + checkout.relative_to(repo_dir).parts)
+
+def dependency_branch(parent_dir: path, dep_path: str):
+    """
+    Gets the branch a dependency checkout pushes to: the branch its parent's .gitmodules tracks, or else its remote's
+    default branch.
+    param: parent_dir [path] Directory of the parent
+    param: dep_path [str] Path of the dependency inside the parent
+    """
+    for dep in DependencyIndex.get_dependencies(repo_dir=parent_dir):
+        if dep["path"] == dep_path and dep["branch"] not in (None, "."):
+            return dep["branch"]
+    result = Terminal.run_bash_cmd(["git", "symbolic-ref", "--short", "refs/remotes/origin/HEAD"], cwd=parent_dir / dep_path, verbose=False)
+    if result is not None and result.returncode == 0 and result.stdout.strip().startswith("origin/"):
+        return result.stdout.strip()[len("origin/"):]
+    return "main"
+
+def unpushed(checkout: path, branch: str):
+    """
+    Checks if a dependency checkout has commits that are not on its remote branch yet.
+    param: checkout [path] Directory of the checkout
+    param: branch [str] The remote branch
+    """
+    result = Terminal.run_bash_cmd(["git", "rev-list", "--count", f"refs/remotes/origin/{branch}..HEAD"], cwd=checkout, verbose=False)
+    return result is None or result.returncode != 0 or result.stdout.strip() != "0"
+
+def assembly_changes(repo_dir: path, max_workers: int=None):
+    """
+    Finds the checkouts of an assembly that need pushing: the repository and dependency checkouts with changed files,
+    dependency checkouts with commits not on their remote yet, and every parent of those.
+    param: repo_dir [path] Directory of the top-level assembly repository
+    param: max_workers [int] Optional max number of checkouts checked at once; defaults to the pool_workers setting
+    returns: (the checkout tree from checkout_tree, dict mapping each checkout to push to its changes from
+    ChangeCache.changed_files, without changes of dependency versions)
+    """
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    tree = checkout_tree(repo_dir)
+    with ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        list(executor.map(LargeFiles.track, tree)) # new CAD extensions are tracked before changes are found
+        all_changes = dict(zip(tree, executor.map(lambda checkout: ChangeCache.changed_files(checkout)[0], tree)))
+    # a moved dependency shows as a change of its parent; it needs pushing if its new commits are not on its remote
+    moved = [parent_dir / change[1] for parent_dir, changes in all_changes.items() for change in changes if change[0] == "S"]
+    moved = [checkout for checkout in moved if checkout in tree and unpushed(checkout, dependency_branch(*tree[checkout]))]
+    involved = set([checkout for checkout, changes in all_changes.items() if len([change for change in changes if change[0] != "S"]) > 0] + moved)
+    # parents have to commit their dependencies' new versions
+    for checkout in list(involved):
+        parent_dir = tree[checkout][0]
+        while parent_dir is not None:
+            involved.add(parent_dir)
+            parent_dir = tree[parent_dir][0]
+    return (tree, dict([(checkout, [change for change in all_changes[checkout] if change[0] != "S"]) for checkout in tree if checkout in involved]))
+
+def push_checkout(repo_dir: path, checkout: path, tree: dict, commit_message: str):
+    """
+    Commits the changes of one checkout of an assembly, including new versions of its dependencies, and pushes it.
+    Dependency checkouts are pushed to their remote branch; they are not on a branch themselves.
+    This runs quietly so it can be used from a worker pool.
+    param: repo_dir [path] Directory of the top-level assembly repository
+    param: checkout [path] Directory of the checkout
+    param: tree [dict] The checkout tree from checkout_tree
+    param: commit_message [str] The commit message
+    returns: (checkout name, status, detail, seconds taken, failed command, error output) where status is "pushed" or
+    "failed"
+    """
+    start_time = time.perf_counter()
+    name = checkout_name(repo_dir, checkout)
+    parent_dir, dep_path = tree[checkout]
+    # dependencies were pushed first, so their new versions show up here as changes too
+    changes = ChangeCache.changed_files(checkout)[0]
+    bash_cmds = []
+    if len(changes) > 0:
+        bash_cmds += ChangeCache.stage_bash_cmds(changes) + [["git", "commit", "--quiet", "-m", commit_message]]
+    branch = dependency_branch(parent_dir, dep_path) if parent_dir is not None else None
+    if parent_dir is None:
+        bash_cmds.append(["git", "push", "--quiet"])
+    else:
+        bash_cmds.append(["git", "push", "--quiet", "origin", f"HEAD:refs/heads/{branch}"])
+    for cmd in bash_cmds:
+        result = Terminal.run_bash_cmd(cmd, cwd=checkout, verbose=False)
+        if result is None or result.returncode != 0:
+            err_text = result.stderr.strip() if result is not None else ""
+            # a rejected ref says why; otherwise the last line that is not a hint does
+            err_lines = [line for line in err_text.splitlines() if not line.startswith("hint:")]
+            rejected = [" ".join(line.split()) for line in err_lines if "[rejected]" in line or "[remote rejected]" in line]
+            detail = f"{' '.join(cmd[:2])}: {(rejected + err_lines[-1:] + [''])[0]}"
+            if len(rejected) > 0 and parent_dir is not None:
+                detail += f"; update or rebase {name} onto {branch} first"
+            if cmd[1] == "push" and len(changes) > 0:
+                # the commit was made but not pushed; dependencies are detached, so it is only reachable from HEAD
+                detail += f"; its new commit was kept at {'the detached HEAD' if parent_dir is not None else 'HEAD'} of {name}, not pushed"
+            return (name, "failed", detail, time.perf_counter() - start_time, " ".join(cmd), err_text)
+    # the remote of this checkout changed; forget what was read from it
+    result = Terminal.run_bash_cmd(["git", "config", "--get", "remote.origin.url"], cwd=checkout, verbose=False)
+    if result is not None and result.returncode == 0:
+        SharedFetch.forget_url(result.stdout.strip())
+    detail = ", ".join([change[1] for change in changes]) if len(changes) <= 3 else f"{len(changes)} changes"
+    return (name, "pushed", detail, time.perf_counter() - start_time, None, "")
+
+def push_assembly(repo_dir: path, commit_message: str, max_workers: int=None, verbose: bool=True):
+    """
+    Pushes every changed checkout of an assembly, dependencies before the parents that use them, so each parent
+    commits the versions its dependencies were just pushed at. A checkout is pushed as soon as its own dependencies
+    are, so independent branches of the tree are pushed in parallel. Parents of a checkout that failed are skipped.
+    param: repo_dir [path] Directory of the top-level assembly repository
+    param: commit_message [str] The commit message of every commit made
+    param: max_workers [int] Optional max number of checkouts pushed at once; defaults to the pool_workers setting
+    param: verbose [bool] Optional to indicate if progress should be printed
+    returns: list of (checkout name, status, detail, seconds taken, failed command, error output) in the order checkouts
+    finished, where status is "pushed", "failed" or "blocked"; empty if nothing changed
+    """
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    margin = " " * 4
+    tree, involved = assembly_changes(repo_dir, max_workers)
+    children = dict([(checkout, [child for child in involved if tree[child][0] == checkout]) for checkout in involved])
+    results = []
+    statuses = {}
+    pending = {}
+    with ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        def finish(checkout: path, result: tuple):
+            """
+            Records a finished checkout and starts its parent once all of the parent's dependencies are done.
+            """
+            results.append(result)
+            statuses[checkout] = result[1]
+            if verbose:
+                name, status, detail, elapsed, failed_cmd, err_text = result
+                color = Terminal.Text.GREEN if status == "pushed" else Terminal.Text.RED
+                print(f"{margin}  {color}{status}{Terminal.Text.RESET} {name} {Terminal.Text.GREY}({elapsed:.1f}s){Terminal.Text.RESET} {detail}")
+            parent_dir = tree[checkout][0]
+            if parent_dir is not None and all([child in statuses for child in children[parent_dir]]):
+                start(parent_dir)
+
+        def start(checkout: path):
+            """
+            Starts pushing a checkout, or skips it if one of its dependencies failed.
+            """
+            failed = [checkout_name(repo_dir, child) for child in children[checkout] if statuses[child] != "pushed"]
+            if len(failed) > 0:
+                finish(checkout, (checkout_name(repo_dir, checkout), "blocked", f"depends on failed {', '.join(failed)}", 0.0, None, ""))
+            else:
+                pending[executor.submit(push_checkout, repo_dir, checkout, tree, commit_message)] = checkout
+
+        for checkout in [checkout for checkout in involved if len(children[checkout]) == 0]:
+            start(checkout)
+        while len(pending) > 0:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                checkout = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e: # the worker itself failed
+                    result = (checkout_name(repo_dir, checkout), "failed", str(e), 0.0, None, str(e))
+                finish(checkout, result)
+    return results
@@ -0,0 +1,488 @@
+#!/usr/bin/python3
+from pathlib import Path as path
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Reproducible benchmarks of GitCAD's main paths on a generated workspace. Remotes are local bare repositories, so no
+# network is needed, and the same seed always generates the same workspace. Run from the src folder:
+#   python3 Benchmark.py --repos 20 --depth 3 --baseline bench_baseline.json
+# Results are printed as JSON and compared with the baseline if one is given; --save-baseline stores them as the new one.
+# --lfs also runs the large file path (track, push, clone, pull, cache prune) against a local stand-in LFS server; it
+# needs git-lfs installed.
+
+def git(args: list, cwd: path):
+    """
+    Runs a git command for the workspace generator, raising if it fails.
+    param: args [list] The git args
+    param: cwd [path] The directory to run in
+    """
+    return subprocess.run(["git"] + args, cwd=cwd, check=True, capture_output=True, text=True)
+
+def isolate_environment(root: path):
+    """
+    Points HOME and the global git config at the benchmark folder so settings, caches and git identity of the user
+    are not touched.
+    param: root [path] The benchmark folder
+    """
+    home = root / "home"
+    home.mkdir(parents=True, exist_ok=True)
+    git_config = root / "gitconfig"
+    git_config.write_text("[user]\n\tname = GitCAD Benchmark\n\temail = bench@gitcad.local\n[init]\n\tdefaultBranch = main\n[protocol \"file\"]\n\tallow = always\n[uploadpack]\n\tallowFilter = true\n")
+    os.environ["HOME"] = str(home)
+    os.environ["USERPROFILE"] = str(home)
+    os.environ["GIT_CONFIG_GLOBAL"] = str(git_config)
+    os.environ["GIT_CONFIG_NOSYSTEM"] = "1"
+    return home
+
+def write_cad_file(file_path: path, rng: random.Random, size_kb: int):
+    """
+    Writes a binary file the size of a CAD part. Random bytes do not compress, like real CAD files.
+    param: file_path [path] The file to write
+    param: rng [Random] The seeded random generator
+    param: size_kb [int] Size of the file in KB
+    """
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    file_path.write_bytes(rng.randbytes(size_kb * 1024))
+
+def generate_workspace(root: path, repos: int, depth: int, deps: int, files: int, file_kb: int, commits: int, seed: int):
+    """
+    Generates a workspace of repositories whose dependencies form a graph depth levels deep, with local bare remotes.
+    param: root [path] The benchmark folder
+    param: repos [int] Number of repositories
+    param: depth [int] Number of dependency levels
+    param: deps [int] Max number of dependencies of each repository on the level below
+    param: files [int] Number of CAD files in each repository
+    param: file_kb [int] Size of each CAD file in KB
+    param: commits [int] Number of commits of history in each repository
+    param: seed [int] Seed of the random generator
+    returns: (workspace directory, remotes directory, dict mapping a level to its repository names)
+    """
+    rng = random.Random(seed)
+    remotes = root / "remotes"
+    seeds = root / "seeds"
+    cwd = root / "home" / "Documents" / "GitHub"
+    for folder in (remotes, seeds, cwd):
+        folder.mkdir(parents=True, exist_ok=True)
+    # spread repos over the levels, leaves at level 0
+    levels = {level: [] for level in range(depth)}
+    for i in range(repos):
+        levels[i % depth].append(f"Part{i:03d}")
+    for level in range(depth):
+        for repo_name in levels[level]:
+            git(["init", "--quiet", "--bare", str(remotes / f"{repo_name}.git")], cwd=root)
+            git(["clone", "--quiet", (remotes / f"{repo_name}.git").as_uri(), str(seeds / repo_name)], cwd=root)
+            # history of CAD files being revised
+            for commit in range(commits):
+                for file_number in range(files):
+                    if commit == 0 or file_number == commit % files or rng.random() < 0.5:
+                        write_cad_file(seeds / repo_name / "cad" / f"part{file_number}.FCStd", rng, file_kb)
+                git(["add", "."], cwd=seeds / repo_name)
+                git(["commit", "--quiet", "-m", f"Revision {commit}"], cwd=seeds / repo_name)
+            # dependencies on the level below
+            if level > 0:
+                for dep_name in rng.sample(levels[level - 1], min(deps, len(levels[level - 1]))):
+                    git(["submodule", "--quiet", "add", (remotes / f"{dep_name}.git").as_uri(), f"dep/{dep_name}"], cwd=seeds / repo_name)
+                git(["commit", "--quiet", "-m", "Added dependencies"], cwd=seeds / repo_name)
+            git(["push", "--quiet", "origin", "main"], cwd=seeds / repo_name)
+    # clone the way GitCAD does, sharing dependency objects through the store
+    import CloneProfile
+    import ObjectCache
+    for level in range(depth):
+        for repo_name in levels[level]:
+            cwd_cmds, repo_cmds = CloneProfile.clone_bash_cmds((remotes / f"{repo_name}.git").as_uri(), CloneProfile.FULL)
+            for cmd in cwd_cmds:
+                git(cmd[1:], cwd=cwd)
+            for cmd in repo_cmds:
+                git(cmd[1:], cwd=cwd / repo_name)
+            ObjectCache.absorb_repository(cwd / repo_name)
+    return (cwd, remotes, levels)
+
+def reset_caches():
+    """
+    Forgets every in-memory and on-disk cache so the next measurement starts cold.
+    """
+    import DependencyIndex
+    import RepoStatus
+    import Workspace
+    DependencyIndex._index = None
+    RepoStatus._cache = None
+    Workspace._index = None
+    for cache in (DependencyIndex.index_file(), RepoStatus.cache_file(), Workspace.index_file()):
+        cache.unlink(missing_ok=True)
+
+def timed(function: any, repeat: int=1, setup: any=None):
+    """
+    Times a function, keeping the fastest of a number of runs.
+    param: function [any] The function to time
+    param: repeat [int] Optional number of runs
+    param: setup [any] Optional function called before each run, not timed
+    returns: seconds taken by the fastest run
+    """
+    times = []
+    for i in range(max(1, repeat)):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+def require_ok(results: list, name: str):
+    """
+    Raises if any repository failed during a measured operation, since its timing would be meaningless.
+    param: results [list] Results of handle_parallel_repositories
+    param: name [str] Name of the operation
+    """
+    failed = [f"{result[0]}: {result[2]}: {result[3]}" for result in results if not result[1]]
+    if len(failed) > 0:
+        raise RuntimeError(f"{name} failed for {'; '.join(failed)}")
+
+def run_benchmarks(cwd: path, remotes: path, root: path, levels: dict, repeat: int):
+    """
+    Times the main paths of GitCAD on a generated workspace.
+    param: cwd [path] The workspace directory
+    param: remotes [path] The directory of the bare remotes
+    param: root [path] The benchmark folder
+    param: levels [dict] Maps a level to its repository names
+    param: repeat [int] Number of runs of the read-only measurements
+    returns: dict mapping a measurement to seconds
+    """
+    import Assembly
+    import DependencyIndex
+    import Handler
+    import Restore
+    timings = {}
+    repo_dirs = Handler.handle_local_repositories(cwd)
+    # dependency parsing and menu construction, cold then warm
+    timings["dependency_index_cold"] = timed(lambda: DependencyIndex.refresh(cwd), repeat, setup=reset_caches)
+    timings["dependency_index_warm"] = timed(lambda: DependencyIndex.refresh(cwd), repeat)
+    timings["menu_rows_cold"] = timed(lambda: Handler.handle_repository_rows(cwd), repeat, setup=reset_caches)
+    timings["menu_rows_warm"] = timed(lambda: Handler.handle_repository_rows(cwd), repeat)
+    # workspace-wide operations
+    timings["pull"] = timed(lambda: require_ok(Handler.handle_pull_repositories(repo_dirs, verbose=False), "pull"))
+    timings["restore"] = timed(lambda: require_ok(Restore.restore_repositories(repo_dirs), "restore"))
+    # a new revision of every leaf rolls up through every level
+    scratch = root / "scratch"
+    for repo_name in levels[0]:
+        git(["clone", "--quiet", (remotes / f"{repo_name}.git").as_uri(), str(scratch / repo_name)], cwd=root)
+        (scratch / repo_name / "cad" / "part0.FCStd").write_bytes(os.urandom(1024))
+        git(["commit", "--quiet", "-am", "New revision"], cwd=scratch / repo_name)
+        git(["push", "--quiet"], cwd=scratch / repo_name)
+    def update_all():
+        results = Assembly.update_assembly(cwd, [repo_dir.name for repo_dir in repo_dirs], verbose=False)
+        failed = [f"{result[0]}: {result[2]}" for result in results if result[1] not in ("updated", "current")]
+        if len(failed) > 0:
+            raise RuntimeError(f"update failed for {'; '.join(failed)}")
+    timings["update_to_latest"] = timed(update_all)
+    # a changed CAD file in every repository, starting from the latest commits
+    require_ok(Handler.handle_pull_repositories(repo_dirs, verbose=False), "pull")
+    for repo_dir in repo_dirs:
+        (repo_dir / "cad" / "part0.FCStd").write_bytes(os.urandom(1024))
+    timings["push"] = timed(lambda: require_ok(Handler.handle_parallel_repositories(repo_dirs, Handler.push_bash_cmds("Benchmark change"), verbose=False), "push"))
+    # CAD files saved again without changes in every checkout of an assembly; the second scan reuses their hashes
+    import ChangeCache
+    top_dir = cwd / levels[max(levels)][0]
+    tree = Assembly.checkout_tree(top_dir)
+    cad_files = [file_path for checkout in tree for file_path in sorted((checkout / "cad").glob("*.FCStd"))]
+    saved_time = time.time() + 60
+    for file_path in cad_files:
+        os.utime(file_path, (saved_time, saved_time))
+    def scan():
+        changes = Assembly.assembly_changes(top_dir)[1]
+        if len(changes) > 0:
+            raise RuntimeError(f"change scan found changes in {', '.join([checkout.name for checkout in changes])}")
+    timings["change_scan_cold"] = timed(scan)
+    dropped = [str(file_path) for file_path in cad_files if str(file_path.absolute()) not in ChangeCache.load_cache()]
+    if len(dropped) > 0:
+        raise RuntimeError(f"change scan dropped the cached hashes of {', '.join(dropped)}")
+    timings["change_scan_warm"] = timed(scan, repeat)
+    return timings
+
+class StandInLFSHandler(http.server.BaseHTTPRequestHandler):
+    """
+    A local stand-in for an LFS server: the batch API with the basic transfer adapter, storing objects in a folder.
+    Just enough for git-lfs to push and pull; there is no authentication and no locking.
+    """
+    storage = None # folder objects are stored in, set by start_lfs_server
+
+    def send_json(self, status: int, body: dict):
+        """
+        Sends a JSON response.
+        param: status [int] The HTTP status
+        param: body [dict] The response body
+        """
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/vnd.git-lfs+json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def object_file(self, oid: str):
+        """
+        Gets the file an object is stored in, or None if the object id is not a SHA-256.
+        param: oid [str] The object id
+        """
+        return self.storage / oid if len(oid) == 64 and all([char in "0123456789abcdef" for char in oid]) else None
+
+    def do_POST(self):
+        """
+        Answers a batch request with where to upload objects not stored yet, or download stored ones.
+        """
+        if not self.path.endswith("/objects/batch"):
+            return self.send_json(404, {"message": "not found"})
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        href = f"http://{self.headers['Host']}{self.path[:-len('/batch')]}"
+        objects = []
+        for item in request.get("objects", []):
+            object_file = self.object_file(item["oid"])
+            entry = {"oid": item["oid"], "size": item["size"], "authenticated": True}
+            if object_file is None:
+                entry["error"] = {"code": 422, "message": "invalid object id"}
+            elif request.get("operation") == "upload":
+                if not object_file.exists(): # objects already stored are not sent again
+                    entry["actions"] = {"upload": {"href": f"{href}/{item['oid']}"}}
+            elif object_file.exists():
+                entry["actions"] = {"download": {"href": f"{href}/{item['oid']}"}}
+            else:
+                entry["error"] = {"code": 404, "message": "object does not exist"}
+            objects.append(entry)
+        self.send_json(200, {"transfer": "basic", "objects": objects})
+
+    def do_PUT(self):
+        """
+        Stores an uploaded object, if its content matches its object id.
+        """
+        object_file = self.object_file(self.path.rsplit("/", 1)[-1])
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if object_file is None or hashlib.sha256(data).hexdigest() != object_file.name:
+            return self.send_json(422, {"message": "content does not match its object id"})
+        object_file.write_bytes(data)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        """
+        Sends a stored object.
+        """
+        object_file = self.object_file(self.path.rsplit("/", 1)[-1])
+        if object_file is None or not object_file.exists():
+            return self.send_json(404, {"message": "object does not exist"})
+        data = object_file.read_bytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args):
+        pass # keep the benchmark output JSON only
+
+def start_lfs_server(storage: path):
+    """
+    Starts the stand-in LFS server on a free local port, on a background thread.
+    param: storage [path] Folder objects are stored in
+    returns: (the server, its LFS URL)
+    """
+    storage.mkdir(parents=True, exist_ok=True)
+    handler = type("BenchmarkLFSHandler", (StandInLFSHandler,), {"storage": storage})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return (server, f"http://127.0.0.1:{server.server_address[1]}/lfs")
+
+def lfs_object_file(oid: str):
+    """
+    Gets where the shared LFS cache keeps an object.
+    param: oid [str] The object id
+    """
+    import LargeFiles
+    return LargeFiles.cache_dir() / "objects" / oid[0:2] / oid[2:4] / oid
+
+def run_lfs_benchmarks(cwd: path, remotes: path, root: path, files: int, file_kb: int, seed: int):
+    """
+    Times the large file path against a local stand-in LFS server: tracking and pushing CAD files, cloning an
+    assembly whose dependency uses LFS, downloading its large files, and pruning the shared cache. Checks that the
+    files checked out are the real ones, and that pruning keeps the files checked out and the ones of an unpushed commit
+    in the detached dependency while dropping older versions.
+    param: cwd [path] The workspace directory
+    param: remotes [path] The directory of the bare remotes
+    param: root [path] The benchmark folder
+    param: files [int] Number of CAD files in each repository
+    param: file_kb [int] Size of each CAD file in KB
+    param: seed [int] Seed of the random generator
+    returns: (dict mapping a measurement to seconds, dict of what the checks found)
+    """
+    import CloneProfile
+    import LargeFiles
+    import ObjectCache
+    import Settings
+    if not LargeFiles.installed():
+        raise RuntimeError("--lfs needs git-lfs installed")
+    rng = random.Random(seed)
+    server, lfs_url = start_lfs_server(root / "lfs-server")
+    timings = {}
+    try:
+        Settings.set("lfs", True)
+        Settings.set("lfs_url", lfs_url)
+        git(["lfs", "install", "--skip-repo"], cwd=root)
+        git(["config", "--global", "lfs.locksverify", "false"], cwd=root) # the stand-in has no locking API
+        seeds = root / "lfs-seeds"
+        # a dependency and an assembly using it, each with two revisions of its CAD files
+        for repo_name, dep_name in (("LfsPart", None), ("LfsAssembly", "LfsPart")):
+            git(["init", "--quiet", "--bare", str(remotes / f"{repo_name}.git")], cwd=root)
+            git(["clone", "--quiet", (remotes / f"{repo_name}.git").as_uri(), str(seeds / repo_name)], cwd=root)
+            LargeFiles.track(seeds / repo_name)
+            git(["config", "--local", "--unset", "lfs.storage"], cwd=seeds / repo_name) # seeds keep their own copies, so pulls must download
+            for revision in range(2):
+                for file_number in range(files):
+                    write_cad_file(seeds / repo_name / "cad" / f"part{file_number}.FCStd", rng, file_kb)
+                git(["add", "."], cwd=seeds / repo_name)
+                git(["commit", "--quiet", "-m", f"Revision {revision}"], cwd=seeds / repo_name)
+            if dep_name is not None:
+                git(["submodule", "--quiet", "add", (remotes / f"{dep_name}.git").as_uri(), f"dep/{dep_name}"], cwd=seeds / repo_name)
+                git(["commit", "--quiet", "-m", "Added dependencies"], cwd=seeds / repo_name)
+            timings[f"lfs_push_{repo_name}"] = timed(lambda: git(["-c", f"lfs.url={lfs_url}", "push", "--quiet", "origin", "main"], cwd=seeds / repo_name))
+        # clone the way GitCAD does: pointer files first, then every checkout's large files at once
+        repo_dir = cwd / "LfsAssembly"
+        def clone():
+            cwd_cmds, repo_cmds = CloneProfile.clone_bash_cmds((remotes / "LfsAssembly.git").as_uri(), CloneProfile.FULL)
+            for cmd in cwd_cmds:
+                git(cmd[1:], cwd=cwd)
+            for cmd in repo_cmds:
+                git(cmd[1:], cwd=repo_dir)
+            ObjectCache.absorb_repository(repo_dir)
+        timings["lfs_clone"] = timed(clone)
+        timings["lfs_pull"] = timed(lambda: require_ok(LargeFiles.pull_repositories([repo_dir]), "lfs pull"))
+        for checkout, seed_dir in ((repo_dir, seeds / "LfsAssembly"), (repo_dir / "dep" / "LfsPart", seeds / "LfsPart")):
+            for file_number in range(files):
+                part = f"cad/part{file_number}.FCStd"
+                if (checkout / part).read_bytes() != (seed_dir / part).read_bytes():
+                    raise RuntimeError(f"{checkout.name}/{part} was not downloaded from the LFS server")
+        # an unpushed commit in the detached dependency, and the older versions of every file in the cache
+        dep_dir = repo_dir / "dep" / "LfsPart"
+        unpushed = rng.randbytes(file_kb * 1024)
+        (dep_dir / "cad" / "part0.FCStd").write_bytes(unpushed)
+        git(["commit", "--quiet", "-am", "Unpushed revision"], cwd=dep_dir)
+        (dep_dir / "cad" / "part0.FCStd").write_bytes(rng.randbytes(file_kb * 1024))
+        git(["commit", "--quiet", "-am", "Later unpushed revision"], cwd=dep_dir)
+        # a revision staged in the assembly but not committed; its only copy is in the cache
+        staged = rng.randbytes(file_kb * 1024)
+        (repo_dir / "cad" / "part0.FCStd").write_bytes(staged)
+        git(LargeFiles.config_args() + ["add", "cad/part0.FCStd"], cwd=repo_dir)
+        for checkout in (repo_dir, dep_dir):
+            git(LargeFiles.config_args() + ["lfs", "fetch", "origin", "HEAD~2" if checkout == repo_dir else "origin/main~1"], cwd=checkout)
+        keep = LargeFiles.checkout_objects(repo_dir) | LargeFiles.checkout_objects(dep_dir)
+        cached = len(LargeFiles.cache_objects())
+        dropped, freed, left = [0, 0, 0]
+        def prune():
+            nonlocal dropped, freed, left
+            dropped, freed, left = LargeFiles.prune_cache(max_mb=0)
+        timings["lfs_prune"] = timed(prune)
+        if not lfs_object_file(hashlib.sha256(unpushed).hexdigest()).exists():
+            raise RuntimeError("pruning dropped a large file of an unpushed commit in a detached dependency")
+        if not lfs_object_file(hashlib.sha256(staged).hexdigest()).exists():
+            raise RuntimeError("pruning dropped a large file staged but not committed")
+        missing = [oid for oid in keep if not lfs_object_file(oid).exists()]
+        if len(missing) > 0 or dropped == 0:
+            raise RuntimeError(f"pruning dropped {len(missing)} large files in use and {dropped} unused ones")
+        checks = {"cached": cached, "kept": len(keep), "dropped": dropped, "freed_bytes": freed}
+    finally:
+        server.shutdown()
+    return (timings, checks)
+
+def compare(timings: dict, baseline: dict, tolerance: float, min_seconds: float):
+    """
+    Compares timings with a baseline.
+    param: timings [dict] Maps a measurement to seconds
+    param: baseline [dict] The baseline results
+    param: tolerance [float] Allowed slowdown as a fraction, i.e. 0.25 for 25%
+    param: min_seconds [float] Slowdowns smaller than this many seconds are treated as noise
+    returns: dict mapping a measurement to its comparison
+    """
+    comparison = {}
+    for name, seconds in timings.items():
+        base = baseline.get("timings", {}).get(name)
+        if base is None:
+            continue
+        regressed = seconds > base * (1 + tolerance) and seconds - base > min_seconds
+        comparison[name] = {"baseline": base, "seconds": seconds, "ratio": round(seconds / base, 3) if base > 0 else None, "regressed": regressed}
+    return comparison
+
+def main(argv: list):
+    """
+    Generates a workspace, runs the benchmarks and prints the results as JSON.
+    param: argv [list] The command line args, without the program name
+    returns: the exit code; 1 if any measurement regressed against the baseline
+    """
+    parser = argparse.ArgumentParser(description="Benchmark GitCAD on a generated workspace with local remotes.")
+    parser.add_argument("--repos", type=int, default=20, help="number of repositories")
+    parser.add_argument("--depth", type=int, default=3, help="number of dependency levels")
+    parser.add_argument("--deps", type=int, default=2, help="max dependencies of each repository on the level below")
+    parser.add_argument("--files", type=int, default=3, help="CAD files in each repository")
+    parser.add_argument("--file-kb", type=int, default=256, help="size of each CAD file in KB")
+    parser.add_argument("--commits", type=int, default=3, help="commits of history in each repository")
+    parser.add_argument("--workers", type=int, default=8, help="pool_workers setting used")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of the read-only measurements; the fastest is kept")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the workspace generator")
+    parser.add_argument("--baseline", help="baseline JSON file to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline (0.25 = 25%%)")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="slowdowns smaller than this are noise")
+    parser.add_argument("--keep", action="store_true", help="keep the generated workspace")
+    parser.add_argument("--lfs", action="store_true", help="also time the large file path against a local stand-in LFS server; needs git-lfs")
+    args = parser.parse_args(argv)
+    baseline_file = path(args.baseline).absolute() if args.baseline is not None else None
+
+    root = path(tempfile.mkdtemp(prefix="gitcad-bench-"))
+    try:
+        isolate_environment(root)
+        import Settings
+        Settings.set("pool_workers", args.workers)
+        start_time = time.perf_counter()
+        cwd, remotes, levels = generate_workspace(root, args.repos, args.depth, args.deps, args.files, args.file_kb, args.commits, args.seed)
+        generate_seconds = time.perf_counter() - start_time
+        timings = run_benchmarks(cwd, remotes, root, levels, args.repeat)
+        if args.lfs:
+            lfs_timings, lfs_checks = run_lfs_benchmarks(cwd, remotes, root, args.files, args.file_kb, args.seed)
+            timings.update(lfs_timings)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    output = {
+        "config": {key: value for key, value in vars(args).items() if key in ("repos", "depth", "deps", "files", "file_kb", "commits", "workers", "repeat", "seed")},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "git": git(["--version"], cwd=path.cwd()).stdout.strip()},
+        "generate_seconds": round(generate_seconds, 3),
+        "timings": {name: round(seconds, 4) for name, seconds in timings.items()},
+    }
+    if args.lfs:
+        output["lfs_checks"] = lfs_checks
+    if args.keep:
+        output["workspace"] = str(root)
+    regressed = False
+    if baseline_file is not None and baseline_file.exists():
+        baseline = json.loads(baseline_file.read_text())
+        if baseline.get("config") != output["config"]:
+            output["baseline_warning"] = "baseline was recorded with a different config"
+        output["comparison"] = compare(output["timings"], baseline, args.tolerance, args.min_seconds)
+        regressed = any([entry["regressed"] for entry in output["comparison"].values()])
+    if baseline_file is not None and args.save_baseline:
+        baseline_file.write_text(json.dumps(output, indent=2))
+    output["regressed"] = regressed
+    print(json.dumps(output, indent=2))
+    return 1 if regressed else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,313 @@
+#!/usr/bin/python3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path as path
+import json
+import threading
+import time
+import Terminal
+import Settings
+import RepoStatus
+import ObjectCache
+import SharedFetch
+import Trace
+
+# Moves an assembly and every dependency checked out inside it to machines without GitHub access as git bundles.
+# Each export is a folder holding one bundle per repository (a dependency used in many places is bundled once) and a
+# manifest.json describing them. A bundle carries each repository's GitHub branches and tags as of the last pull, plus
+# the commits dependencies are pinned at.
+#
+# What was exported to each target (a name for the offline machine) is recorded in ~/.gitcad/bundles.json, and later
+# exports to the same target only carry commits made since, so their size grows with the change and not the
+# repository. Importing fetches the bundles into existing clones, dependencies through the shared object store, then
+# fast-forwards the assembly and restores its dependencies to their pinned versions, all without the network.
+
+_lock = threading.Lock() # guards the bundles file
+MANIFEST = "manifest.json" # name of the file describing an export
+
+def bundles_dir():
+    """
+    Gets the folder exports are written to, from the bundle_dir setting or else ~/.gitcad/bundles.
+    """
+    configured = Settings.get("bundle_dir")
+    return path(configured).expanduser() if configured else Settings.settings_dir() / "bundles"
+
+def state_file():
+    """
+    Gets the path of the file recording what was exported to each target.
+    """
+    return Settings.settings_dir() / "bundles.json"
+
+def load_state():
+    """
+    Loads what was exported to each target.
+    """
+    try:
+        with open(state_file(), "r") as file:
+            return json.load(file)
+    except Exception as e:
+        return {}
+
+def save_state(state: dict):
+    """
+    Saves what was exported to each target.
+    param: state [dict] Maps a target to the refs and pinned commits exported of each repository
+    """
+    with open(state_file(), "w") as file:
+        json.dump(state, file, indent=4)
+
+def origin_url(checkout: path):
+    """
+    Gets the remote URL of a repository or dependency checkout.
+    param: checkout [path] Directory of the checkout
+    returns: the URL, or None if it has no remote
+    """
+    result = Terminal.run_bash_cmd(["git", "config", "--get", "remote.origin.url"], cwd=checkout, verbose=False)
+    return result.stdout.strip() if result is not None and result.returncode == 0 else None
+
+def repository_name(checkout: path, url: str):
+    """
+    Gets the name of the repository a checkout is of, from its remote URL, so every checkout of a dependency is
+    bundled once.
+    param: checkout [path] Directory of the checkout
+    param: url [str] Its remote URL, or None
+    """
+    if url is None:
+        return checkout.name
+    return url.rstrip("/").split("/")[-1].split(":")[-1].removesuffix(".git")
+
+def exported_refs(checkout: path):
+    """
+    Gets the GitHub branches and the tags of a checkout, as they were last fetched.
+    param: checkout [path] Directory of the checkout
+    returns: dict mapping each ref to its object SHA
+    """
+    result = Terminal.run_bash_cmd(["git", "for-each-ref", "--format=%(objectname) %(refname)", "refs/remotes/origin", "refs/tags"], cwd=checkout, verbose=False)
+    if result is None or result.returncode != 0:
+        return {}
+    refs = {}
+    for line in result.stdout.splitlines():
+        sha, _, ref = line.partition(" ")
+        if ref != "refs/remotes/origin/HEAD":
+            refs[ref] = sha
+    return refs
+
+def assembly_repositories(repo_dir: path):
+    """
+    Groups an assembly and every dependency checked out inside it by repository.
+    param: repo_dir [path] Directory of the assembly
+    returns: dict mapping a repository name to a dict of its remote URL, checkouts (closest to the top first) and the
+    commits its parents pin it at
+    """
+    import Assembly
+    import Restore
+    tree = Assembly.checkout_tree(repo_dir)
+    pins = {}
+    repositories = {}
+    for checkout in sorted(tree, key=lambda checkout: (len(checkout.parts), str(checkout))):
+        url = origin_url(checkout)
+        name = repo_dir.name if checkout == repo_dir else repository_name(checkout, url)
+        repository = repositories.setdefault(name, {"url": url, "checkouts": [], "pins": set()})
+        repository["checkouts"].append(checkout)
+        parent_dir, dep_path = tree[checkout]
+        if parent_dir is not None:
+            if parent_dir not in pins:
+                pins[parent_dir] = Restore.pinned_dependencies(parent_dir)
+            if dep_path in pins[parent_dir]:
+                repository["pins"].add(pins[parent_dir][dep_path])
+    return repositories
+
+def export_repository(name: str, repository: dict, previous: dict, bundle_file: path):
+    """
+    Bundles one repository of an assembly: its GitHub branches, tags and pinned commits, leaving out everything
+    already exported to the target. This runs quietly so it can be used from a worker pool.
+    param: name [str] Name of the repository
+    param: repository [dict] Its remote URL, checkouts and pinned commits, from assembly_repositories
+    param: previous [dict] The refs and pinned commits exported to the target last time, or None for a full export
+    param: bundle_file [path] The bundle to write
+    returns: dict of repository name, status ("exported", "current" or "failed"), bundle file name, size in bytes,
+    refs and pinned commits exported, number of commits the target must already have, error text and seconds taken
+    """
+    import Restore
+    start_time = time.perf_counter()
+    source = repository["checkouts"][0]
+    refs = exported_refs(source)
+    pins = sorted([pin for pin in repository["pins"] if Restore.has_commit(source, pin)])
+    row = {"repo": name, "status": "current", "file": None, "size": 0, "refs": refs, "pins": pins, "prerequisites": 0, "error": "", "seconds": 0.0}
+    previous = previous or {"refs": {}, "pins": []}
+    new_pins = [pin for pin in pins if pin not in previous["pins"]]
+    if previous["refs"] == refs and len(new_pins) == 0:
+        row["seconds"] = time.perf_counter() - start_time
+        return row
+    # the target has these already; commits reachable from them are left out
+    exclude = sorted(set([sha for sha in list(previous["refs"].values()) + previous["pins"] if Restore.has_commit(source, sha)]))
+    positive = sorted(refs.keys()) if len(refs) > 0 else ["HEAD"]
+    cmd = ["git", "bundle", "create", "--quiet", str(bundle_file)] + positive + new_pins + (["--not"] + exclude if len(exclude) > 0 else [])
+    result = Terminal.run_bash_cmd(cmd, cwd=source, verbose=False)
+    if result is None or result.returncode != 0:
+        err_text = result.stderr.strip() if result is not None else ""
+        if "empty bundle" not in err_text:
+            row.update({"status": "failed", "error": err_text})
+    else:
+        row.update({"status": "exported", "file": bundle_file.name, "size": bundle_file.stat().st_size, "prerequisites": len(exclude)})
+    row["seconds"] = time.perf_counter() - start_time
+    return row
+
+def export_assembly(repo_dir: path, target: str, out_dir: path=None, full: bool=False, max_workers: int=None):
+    """
+    Exports an assembly and every dependency checked out inside it into a new folder of bundles. Only commits made
+    since the last export to the same target are included, unless a full export is asked for.
+    param: repo_dir [path] Directory of the assembly
+    param: target [str] Name of the offline machine the export is for
+    param: out_dir [path] Optional folder the export's folder is made in; defaults to bundles_dir()
+    param: full [bool] Optional to export everything, i.e. for a new target or one that lost earlier exports
+    param: max_workers [int] Optional max number of repositories bundled at once; defaults to the pool_workers setting
+    returns: (folder of the export, or None if nothing changed; list of rows from export_repository)
+    """
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    repositories = assembly_repositories(repo_dir)
+    previous = {} if full else load_state().get(target, {})
+    export_dir = path(out_dir).expanduser() if out_dir is not None else bundles_dir()
+    export_name = f"{repo_dir.name}-{target}-{time.strftime('%Y%m%d-%H%M%S')}"
+    count = 1
+    while (export_dir / export_name).exists(): # exported twice in one second
+        count += 1
+        export_name = f"{repo_dir.name}-{target}-{time.strftime('%Y%m%d-%H%M%S')}-{count}"
+    export_dir = export_dir / export_name
+    export_dir.mkdir(parents=True)
+    with ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        rows = list(executor.map(lambda name: export_repository(name, repositories[name], previous.get(name), export_dir / f"{name}.bundle"), repositories))
+    exported = [row for row in rows if row["status"] == "exported"]
+    if len(exported) == 0:
+        export_dir.rmdir()
+        export_dir = None
+    else:
+        manifest = {"assembly": repo_dir.name, "target": target, "created": time.time(),
+                    "repositories": [{"repo": row["repo"], "url": repositories[row["repo"]]["url"], "file": row["file"], "refs": row["refs"],
+                                      "pins": row["pins"], "prerequisites": row["prerequisites"]} for row in exported]}
+        with open(export_dir / MANIFEST, "w") as file:
+            json.dump(manifest, file, indent=4)
+    # remember what the target has now; failed repositories are exported in full next time they are asked for
+    with _lock:
+        state = load_state()
+        target_state = {} if full else state.get(target, {})
+        for row in rows:
+            if row["status"] == "exported":
+                target_state[row["repo"]] = {"refs": row["refs"], "pins": sorted(set(row["pins"] + target_state.get(row["repo"], {}).get("pins", [])))}
+        state[target] = target_state
+        save_state(state)
+    return (export_dir, rows)
+
+def export_dirs(folder: path):
+    """
+    Finds the exports in a folder: the folder itself if it is one, or else every export inside it, oldest first.
+    param: folder [path] The folder, i.e. a USB drive
+    """
+    folder = path(folder).expanduser()
+    if (folder / MANIFEST).is_file():
+        return [folder]
+    found = []
+    for export_dir in [child for child in folder.iterdir() if (child / MANIFEST).is_file()] if folder.is_dir() else []:
+        try:
+            with open(export_dir / MANIFEST, "r") as file:
+                found.append((json.load(file)["created"], export_dir))
+        except Exception as e:
+            pass # unreadable manifest; not an export
+    return [export_dir for created, export_dir in sorted(found)]
+
+def export_assembly_name(export_dir: path):
+    """
+    Gets the name of the assembly an export is of, from its manifest.
+    param: export_dir [path] Folder of the export
+    """
+    with open(export_dir / MANIFEST, "r") as file:
+        return json.load(file)["assembly"]
+
+def import_repository(entry: dict, export_dir: path, checkouts: list):
+    """
+    Fetches one repository's bundle into every checkout of it, through the shared object store for dependency
+    checkouts that borrow from it. Branches and files are not changed.
+    param: entry [dict] The repository's entry in the manifest
+    param: export_dir [path] Folder of the export
+    param: checkouts [list] Directories of the checkouts of the repository
+    returns: dict of repository name, status ("imported", "skipped" or "failed"), checkouts fetched into, failed command,
+    error text and seconds taken
+    """
+    start_time = time.perf_counter()
+    row = {"repo": entry["repo"], "status": "imported", "checkouts": len(checkouts), "failed_cmd": None, "error": "", "seconds": 0.0}
+    bundle_file = str(export_dir / entry["file"])
+    if len(checkouts) == 0:
+        row.update({"status": "skipped", "error": "no checkout of it in the assembly"})
+        return row
+    bash_cmds = [(["git", "bundle", "verify", "--quiet", bundle_file], checkouts[0])]
+    linked = [checkout for checkout in checkouts if ObjectCache.enabled() and ObjectCache.is_linked(RepoStatus.git_dir(checkout))]
+    if len(linked) > 0:
+        # the store takes the objects once; its borrowers then fetch without copying them
+        store = ObjectCache.store_dir()
+        url = origin_url(linked[0]) or entry["url"]
+        bash_cmds.append((["git", "--git-dir", str(store), "fetch", "--quiet", "--no-tags", "--no-write-fetch-head", bundle_file, f"+refs/remotes/origin/*:{SharedFetch.mirror_refs(url)}/*"], store))
+    for checkout in checkouts:
+        bash_cmds.append((["git", "fetch", "--quiet", "--no-write-fetch-head", "--no-recurse-submodules", bundle_file, "+refs/remotes/origin/*:refs/remotes/origin/*", "+refs/tags/*:refs/tags/*"], checkout))
+    for cmd, cwd in bash_cmds:
+        result = Terminal.run_bash_cmd(cmd, cwd=cwd, verbose=False)
+        if result is None or result.returncode != 0:
+            err_text = result.stderr.strip() if result is not None else ""
+            if cmd[1] == "bundle":
+                err_text = f"{err_text}\nimport the earlier exports for this target first".strip()
+            row.update({"status": "failed", "failed_cmd": " ".join(cmd), "error": err_text})
+            break
+    row["seconds"] = time.perf_counter() - start_time
+    return row
+
+def import_export(export_dir: path, cwd: path, max_workers: int=None):
+    """
+    Imports an export into an existing clone of its assembly: fetches every bundle, fast-forwards the assembly's
+    branch to the imported one if it can, and restores its dependencies to their pinned versions.
+    param: export_dir [path] Folder of the export
+    param: cwd [path] The GitHub current working directory
+    param: max_workers [int] Optional max number of repositories imported at once; defaults to the pool_workers setting
+    returns: (name of the assembly, list of rows from import_repository, result of restoring the assembly or None)
+    """
+    import Restore
+    import Workspace
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    with open(export_dir / MANIFEST, "r") as file:
+        manifest = json.load(file)
+    repo_dir = Workspace.repo_dir(cwd, manifest["assembly"])
+    if RepoStatus.git_dir(repo_dir) is None:
+        return (manifest["assembly"], [{"repo": manifest["assembly"], "status": "failed", "checkouts": 0, "failed_cmd": None,
+                                        "error": f"{manifest['assembly']} is not cloned here; copy it once, then import", "seconds": 0.0}], None)
+    checkouts = {}
+    for name, repository in assembly_repositories(repo_dir).items():
+        checkouts[name] = repository["checkouts"]
+    with ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        rows = list(executor.map(lambda entry: import_repository(entry, export_dir, checkouts.get(entry["repo"], [])), manifest["repositories"]))
+    if any([row["status"] == "failed" for row in rows]):
+        return (manifest["assembly"], rows, None)
+    # bring the assembly to what was exported; local commits or changes in the way are left alone
+    result = Terminal.run_bash_cmd(["git", "merge", "--ff-only", "--quiet", "@{upstream}"], cwd=repo_dir, verbose=False)
+    if result is None or result.returncode != 0:
+        for row in rows:
+            if row["repo"] == manifest["assembly"]:
+                row.update({"status": "fetched", "error": "branch not fast-forwarded; merge it by hand"})
+    return (manifest["assembly"], rows, Restore.restore_repository(repo_dir, max_workers))
+
+def format_export_row(row: dict):
+    """
+    Formats the export of one repository as one colored line.
+    param: row [dict] A row from export_repository
+    """
+    import ChangeCache
+    if row["status"] == "exported":
+        return f"{Terminal.Text.GREEN}exported{Terminal.Text.RESET} {row['repo']} {Terminal.Text.GREY}{ChangeCache.format_size(row['size'])}, {row['seconds']:.1f}s{Terminal.Text.RESET}"
+    if row["status"] == "current":
+        return f"{Terminal.Text.GREY}current  {row['repo']} nothing new since the last export{Terminal.Text.RESET}"
+    return f"{Terminal.Text.RED}failed{Terminal.Text.RESET}   {row['repo']} {Terminal.Text.GREY}{row['error']}{Terminal.Text.RESET}"
+
+def format_import_row(row: dict):
+    """
+    Formats the import of one repository as one colored line.
+    param: row [dict] A row from import_repository
+    """
+    colors = {"imported": Terminal.Text.GREEN, "fetched": Terminal.Text.YELLOW, "skipped": Terminal.Text.GREY, "failed": Terminal.Text.RED}
+    detail = f"into {row['checkouts']} checkouts, {row['seconds']:.1f}s" if row["status"] == "imported" else row["error"]
+    return f"{colors.get(row['status'], Terminal.Text.GREY)}{row['status']:<9}{Terminal.Text.RESET}{row['repo']} {Terminal.Text.GREY}{detail}{Terminal.Text.RESET}"
@@ -0,0 +1,307 @@
+#!/usr/bin/python3
+from pathlib import Path as path
+import hashlib
+import json
+import os
+import threading
+import Terminal
+import Settings
+
+# Finds the files of a repository whose content really changed, without git rehashing every CAD file a tool rewrote
+# with a new mtime but the same content. git lists the files whose stat no longer matches its index; their content
+# hashes are computed the way git hashes blobs and cached on disk, keyed on (size, mtime, inode), so each file
+# version is only read once. A file is a real change if its hash differs from the one in the index.
+#
+# Files git converts when staging them (line endings with core.autocrlf or the text and eol attributes, ident, or a
+# filter other than LFS) are hashed by git hash-object instead, which applies the same conversions, and cached alike.
+#
+# Cache entries are only needed while a file looks modified to git, so entries of files that no longer do are
+# dropped whenever their repository is scanned. Files of dependencies checked out inside it are left to their own
+# scans.
+
+_lock = threading.Lock() # guards the in-memory cache
+_cache = None # in-memory copy of the hash cache
+HASH_CHUNK = 1024 * 1024 # bytes read at a time while hashing
+
+def cache_file():
+    """
+    Gets the path of the content hash cache file.
+    """
+    return Settings.settings_dir() / "hash_cache.json"
+
+def load_cache():
+    """
+    Loads the content hash cache, from memory if already loaded or else from disk.
+    """
+    global _cache
+    with _lock:
+        if _cache is None:
+            try:
+                with open(cache_file(), "r") as file:
+                    _cache = json.load(file)
+            except Exception as e:
+                _cache = {}
+        return _cache
+
+def save_cache():
+    """
+    Saves the content hash cache to disk.
+    """
+    with _lock:
+        with open(cache_file(), "w") as file:
+            json.dump(_cache, file)
+
+def blob_hash(file_path: path, size: int, algorithm: str="sha1"):
+    """
+    Hashes a file the way git hashes a blob, so it can be compared with the index.
+    param: file_path [path] The file
+    param: size [int] Size of the file in bytes
+    param: algorithm [str] Optional "sha1" or "sha256", the object format of the repository
+    """
+    digest = hashlib.new(algorithm)
+    digest.update(f"blob {size}\0".encode())
+    with open(file_path, "rb") as file:
+        while True:
+            chunk = file.read(HASH_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def lfs_pointer_hash(file_path: path, size: int, algorithm: str="sha1"):
+    """
+    Hashes the LFS pointer git stores for a file tracked with LFS, so it can be compared with the index.
+    param: file_path [path] The file
+    param: size [int] Size of the file in bytes
+    param: algorithm [str] Optional "sha1" or "sha256", the object format of the repository
+    """
+    import LargeFiles
+    if size == 0: # LFS leaves empty files as they are
+        return hashlib.new(algorithm, b"blob 0\0").hexdigest()
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while True:
+            chunk = file.read(HASH_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+    text = LargeFiles.pointer(digest.hexdigest(), size).encode()
+    return hashlib.new(algorithm, f"blob {len(text)}\0".encode() + text).hexdigest()
+
+def hash_key(stat: os.stat_result, kind: str):
+    """
+    Gets the cache key of a file's hash.
+    param: stat [stat_result] The stat of the file
+    param: kind [str] How it is hashed: "blob", "lfs" or "git"
+    """
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino] + ([kind] if kind != "blob" else [])
+
+def cached_hash(file_path: path, key: list):
+    """
+    Gets the cached hash of a file, or None if the file changed since it was hashed.
+    param: file_path [path] The file
+    param: key [list] The cache key from hash_key
+    """
+    entry = load_cache().get(str(file_path))
+    return entry[-1] if entry is not None and entry[:-1] == key else None
+
+def content_hash(file_path: path, stat: os.stat_result, algorithm: str="sha1", lfs: bool=False):
+    """
+    Gets the git blob hash of a file, from the cache if its size, mtime and inode did not change.
+    param: file_path [path] The file
+    param: stat [stat_result] The stat of the file
+    param: algorithm [str] Optional "sha1" or "sha256", the object format of the repository
+    param: lfs [bool] Optional to hash the LFS pointer git stores instead, for files tracked with LFS
+    returns: the hash, or None if the file can not be read
+    """
+    key = hash_key(stat, "lfs" if lfs else "blob")
+    sha = cached_hash(file_path, key)
+    if sha is not None:
+        return sha
+    try:
+        sha = lfs_pointer_hash(file_path, stat.st_size, algorithm) if lfs else blob_hash(file_path, stat.st_size, algorithm)
+    except OSError as e:
+        return None
+    cache = load_cache()
+    with _lock:
+        cache[str(file_path)] = key + [sha]
+    return sha
+
+def git_hashes(repo_dir: path, files: list, batch: int=200):
+    """
+    Gets the blob hashes of files git converts when staging them, with git hash-object, which converts them the same
+    way; from the cache if their size, mtime and inode did not change.
+    param: repo_dir [path] Directory of the repository
+    param: files [list] (path inside the repository, stat) of each file
+    param: batch [int] Optional max number of paths per command, to stay under command line limits
+    returns: dict mapping a path to its hash; paths git could not hash are left out
+    """
+    hashes = {}
+    to_hash = []
+    for file_name, stat in files:
+        sha = cached_hash(repo_dir / file_name, hash_key(stat, "git"))
+        if sha is not None:
+            hashes[file_name] = sha
+        else:
+            to_hash.append((file_name, stat))
+    for i in range(0, len(to_hash), batch):
+        result = Terminal.run_bash_cmd(["git", "hash-object", "--"] + [file_name for file_name, stat in to_hash[i:i+batch]], cwd=repo_dir, verbose=False)
+        if result is None or result.returncode != 0 or len(result.stdout.split()) != len(to_hash[i:i+batch]):
+            continue
+        cache = load_cache()
+        with _lock:
+            for (file_name, stat), sha in zip(to_hash[i:i+batch], result.stdout.split()):
+                hashes[file_name] = sha
+                cache[str(repo_dir / file_name)] = hash_key(stat, "git") + [sha]
+    return hashes
+
+def hash_kinds(repo_dir: path, file_names: list, batch: int=200):
+    """
+    Gets how each file of a repository has to be hashed to compare it with the index: its pointer if it is tracked with
+    LFS, by git if git converts it when staging it, or else as it is.
+    param: repo_dir [path] Directory of the repository
+    param: file_names [list] Paths of the files inside the repository
+    param: batch [int] Optional max number of paths per command, to stay under command line limits
+    returns: dict mapping a path to "lfs" or "git"; paths hashed as they are are left out
+    """
+    import LargeFiles
+    kinds = {}
+    if len(file_names) == 0:
+        return kinds
+    # core.autocrlf converts every file git detects as text that the attributes do not mark otherwise
+    result = Terminal.run_bash_cmd(["git", "config", "--get", "core.autocrlf"], cwd=repo_dir, verbose=False)
+    autocrlf = result is not None and result.stdout.strip().lower() in ("true", "input")
+    lfs = LargeFiles.available() and LargeFiles.uses_lfs(repo_dir)
+    unset = ("unspecified", "unset")
+    for i in range(0, len(file_names), batch):
+        result = Terminal.run_bash_cmd(["git", "check-attr", "-z", "filter", "text", "eol", "crlf", "ident", "--"] + file_names[i:i+batch], cwd=repo_dir, verbose=False)
+        if result is None or result.returncode != 0:
+            kinds.update([(file_name, "git") for file_name in file_names[i:i+batch]]) # let git decide
+            continue
+        fields = result.stdout.split("\0")
+        attributes = {}
+        for j in range(0, len(fields) - 2, 3):
+            attributes.setdefault(fields[j], {})[fields[j+1]] = fields[j+2]
+        for file_name, values in attributes.items():
+            if values.get("filter") == "lfs" and lfs:
+                kinds[file_name] = "lfs"
+            elif values.get("filter") not in unset or values.get("ident") == "set" or any([values.get(name) not in unset for name in ("text", "eol", "crlf")]) or (autocrlf and values.get("text") != "unset"):
+                kinds[file_name] = "git"
+    return kinds
+
+def changed_files(repo_dir: path):
+    """
+    Gets the files of a repository whose content differs from the last commit: modified, deleted and new files, and
+    changes already staged. Files git sees as modified only because their mtime or inode changed are left out.
+    param: repo_dir [path] Directory of the repository
+    returns: (list of (status, path, size in bytes) of real changes, sorted by path; number of files left out)
+    where status is "M" modified, "D" deleted, "A" new, or "S" a dependency at a new version
+    """
+    repo_dir = repo_dir.absolute()
+    changes = []
+    unchanged = 0
+    # changes already staged by hand
+    result = Terminal.run_bash_cmd(["git", "diff-index", "--cached", "-z", "--name-status", "--ignore-submodules=dirty", "HEAD"], cwd=repo_dir, verbose=False)
+    staged = {}
+    if result is not None and result.returncode == 0:
+        fields = result.stdout.split("\0")
+        for i in range(0, len(fields) - 1, 2):
+            staged[fields[i+1]] = fields[i][:1]
+    # tracked files whose stat does not match the index; git does not read their content for this
+    result = Terminal.run_bash_cmd(["git", "diff-files", "-z", "--raw", "--ignore-submodules=dirty"], cwd=repo_dir, verbose=False)
+    if result is None or result.returncode != 0:
+        return (changes, unchanged)
+    fields = result.stdout.split("\0")
+    kinds = hash_kinds(repo_dir, [fields[i+1] for i in range(0, len(fields) - 1, 2) if len(fields[i].split()) >= 5 and fields[i].split()[4][0] != "D"])
+    candidates = set()
+    to_compare = [] # (path, stat, hash in the index) of files whose content has to be compared
+    for i in range(0, len(fields) - 1, 2):
+        info, file_name = fields[i].split(), fields[i+1]
+        if len(info) < 5:
+            continue
+        old_mode, new_mode, index_sha, status = info[0].lstrip(":"), info[1], info[2], info[4][0]
+        file_path = repo_dir / file_name
+        if status == "D":
+            changes.append(("D", file_name, 0))
+        elif old_mode == "160000" or new_mode == "160000":
+            changes.append(("S", file_name, 0))
+        elif old_mode != new_mode:
+            changes.append(("M", file_name, file_path.stat().st_size if file_path.exists() else 0))
+        else:
+            candidates.add(str(file_path))
+            try:
+                stat = file_path.stat()
+            except OSError as e:
+                changes.append(("D", file_name, 0))
+                continue
+            to_compare.append((file_name, stat, index_sha))
+    # files git converts are hashed by git, the rest here
+    converted = git_hashes(repo_dir, [(file_name, stat) for file_name, stat, index_sha in to_compare if kinds.get(file_name) == "git"])
+    for file_name, stat, index_sha in to_compare:
+        if kinds.get(file_name) == "git":
+            sha = converted.get(file_name)
+        else:
+            sha = content_hash(repo_dir / file_name, stat, "sha256" if len(index_sha) == 64 else "sha1", kinds.get(file_name) == "lfs")
+        if sha == index_sha:
+            unchanged += 1
+        else:
+            changes.append(("M", file_name, stat.st_size))
+    # new files
+    result = Terminal.run_bash_cmd(["git", "ls-files", "-z", "--others", "--exclude-standard"], cwd=repo_dir, verbose=False)
+    if result is not None and result.returncode == 0:
+        for file_name in [name for name in result.stdout.split("\0") if len(name) > 0]:
+            file_path = repo_dir / file_name
+            changes.append(("A", file_name, file_path.stat().st_size if file_path.is_file() else 0))
+    # forget files of this repository that no longer look modified, leaving those of dependencies checked out inside it
+    import RepoStatus
+    git_path = RepoStatus.git_dir(repo_dir)
+    try:
+        gitlinks = RepoStatus.read_gitlinks(git_path) if git_path is not None else None
+    except Exception as e:
+        gitlinks = None
+    if gitlinks is not None:
+        prefix = str(repo_dir / "_")[:-1]
+        nested = tuple([str(repo_dir / dep_path / "_")[:-1] for dep_path in gitlinks])
+        cache = load_cache()
+        with _lock:
+            for file_name in [file_name for file_name in cache if file_name.startswith(prefix) and not file_name.startswith(nested) and file_name not in candidates]:
+                del cache[file_name]
+    save_cache()
+    # staged changes not changed again since
+    changed_names = set([change[1] for change in changes])
+    for file_name, status in staged.items():
+        if file_name not in changed_names:
+            file_path = repo_dir / file_name
+            changes.append((status if status in ("M", "D", "A") else "M", file_name, file_path.stat().st_size if file_path.is_file() else 0))
+    changes.sort(key=lambda change: change[1])
+    return (changes, unchanged)
+
+def stage_bash_cmds(changes: list, batch: int=200):
+    """
+    Gets the bash commands that stage only the real changes of a repository.
+    param: changes [list] The changes from changed_files
+    param: batch [int] Optional max number of paths per command, to stay under command line limits
+    """
+    paths = [change[1] for change in changes]
+    return [["git", "add", "--all", "--"] + paths[i:i+batch] for i in range(0, len(paths), batch)]
+
+def format_size(size: int):
+    """
+    Formats a size in bytes for people to read.
+    param: size [int] The size in bytes
+    """
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def format_change(change: tuple):
+    """
+    Formats a change as one colored line.
+    param: change [tuple] A change from changed_files
+    """
+    status, file_name, size = change
+    labels = {"M": (Terminal.Text.YELLOW, "modified"), "D": (Terminal.Text.RED, "deleted"), "A": (Terminal.Text.GREEN, "new"), "S": (Terminal.Text.CYAN, "dependency")}
+    color, label = labels.get(status, (Terminal.Text.GREY, status))
+    size_text = format_size(size) if status in ("M", "A") else ""
+    return f"{color}{label:<10}{Terminal.Text.RESET} {file_name} {Terminal.Text.GREY}{size_text}{Terminal.Text.RESET}"
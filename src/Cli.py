@@ -0,0 +1,502 @@
+#!/usr/bin/python3
+from pathlib import Path as path
+import argparse
+import fnmatch
+import json
+import sys
+import time
+
+# Non-interactive commands for scripts, cron and CI. Every command prints its results as JSON and exits with 0 if
+# everything succeeded, 1 if anything failed, and 2 for bad arguments. Modules are imported inside each command so
+# only what a command needs is loaded.
+
+def workspace_dir(args: argparse.Namespace):
+    """
+    Gets the GitHub current working directory, from --cwd if given.
+    param: args [Namespace] The parsed command line args
+    """
+    if args.cwd is not None:
+        return path(args.cwd).expanduser()
+    import Handler
+    return Handler.handle_github_current_working_directory()
+
+def select_repositories(cwd: path, patterns: list):
+    """
+    Gets the local repositories matching names or glob patterns. Every local repository is selected if there are none.
+    param: cwd [path] The GitHub current working directory
+    param: patterns [list] Repository names or glob patterns, i.e. "Enclosure*"
+    returns: (list of repository directories, list of patterns that matched nothing)
+    """
+    import Workspace
+    repo_dirs = Workspace.repositories(cwd)
+    if len(patterns) == 0:
+        return (repo_dirs, [])
+    selected = [repo_dir for repo_dir in repo_dirs if any([fnmatch.fnmatch(repo_dir.name, pattern) for pattern in patterns])]
+    unmatched = [pattern for pattern in patterns if not any([fnmatch.fnmatch(repo_dir.name, pattern) for repo_dir in repo_dirs])]
+    return (selected, unmatched)
+
+def command_result(repo: str, ok: bool, failed_cmd: str=None, error: str="", seconds: float=0.0, **details):
+    """
+    Formats the result of a command on one repository for JSON output.
+    param: repo [str] Name of the repository
+    param: ok [bool] If the command succeeded
+    param: failed_cmd [str] Optional command that failed
+    param: error [str] Optional error output
+    param: seconds [float] Optional time taken
+    """
+    result = {"repo": repo, "ok": ok, "failed_cmd": failed_cmd, "error": error.strip(), "seconds": round(seconds, 3)}
+    result.update(details)
+    return result
+
+def run_cmds(repo_dir: path, bash_cmds: list):
+    """
+    Runs bash commands on one repository, stopping at the first that fails.
+    param: repo_dir [path] Directory of the repository
+    param: bash_cmds [list] The list of bash commands
+    returns: the JSON result
+    """
+    import Handler
+    repo_name, succeeded, failed_cmd, err_text, elapsed = Handler.handle_repository_bash_cmds(repo_dir, bash_cmds)
+    return command_result(repo_name, succeeded, failed_cmd, err_text, elapsed)
+
+def run_parallel(args: argparse.Namespace, repo_dirs: list, bash_cmds: any):
+    """
+    Runs bash commands on many repositories at once on the worker pool.
+    param: args [Namespace] The parsed command line args
+    param: repo_dirs [list] Directories of the repositories
+    param: bash_cmds [any] The list of bash commands, or a function of the repository directory that returns it
+    returns: list of JSON results, sorted by repository
+    """
+    import Handler
+    results = Handler.handle_parallel_repositories(repo_dirs, bash_cmds, max_workers=args.workers, verbose=False)
+    return sorted([command_result(*result) for result in results], key=lambda result: result["repo"])
+
+def clone_locks(args: argparse.Namespace, cwd: path):
+    """
+    Gets the directories locked while cloning: the folders the repositories are cloned into.
+    """
+    return [cwd / repo_url.split(sep="/").pop().replace(".git", "") for repo_url in args.urls]
+
+def cmd_clone(args: argparse.Namespace, cwd: path):
+    """
+    Clones repositories and their dependencies with a clone profile.
+    """
+    import CloneProfile
+    import LargeFiles
+    import ObjectCache
+    import Settings
+    profile = args.profile if args.profile is not None else Settings.get("clone_profile")
+    depth = args.depth if args.depth is not None else Settings.get("clone_depth")
+    sparse_paths = args.sparse.split(",") if args.sparse is not None else Settings.get("clone_sparse_paths")
+    results = []
+    for repo_url in args.urls:
+        repo_name = repo_url.split(sep="/").pop().replace(".git", "")
+        cwd_cmds, repo_cmds = CloneProfile.clone_bash_cmds(repo_url, profile, depth, sparse_paths)
+        result = run_cmds(cwd, cwd_cmds)
+        result["repo"] = repo_name
+        if result["ok"]:
+            result = run_cmds(cwd / repo_name, repo_cmds)
+            ObjectCache.absorb_repository(cwd / repo_name)
+        if result["ok"]:
+            failed = [lfs_result for lfs_result in LargeFiles.pull_repositories([cwd / repo_name], args.workers) if not lfs_result[1]]
+            if len(failed) > 0:
+                result = command_result(*failed[0])
+        results.append(result)
+    return results
+
+def cmd_pull(args: argparse.Namespace, cwd: path):
+    """
+    Pulls repositories from GitHub, keeping their clone profiles. Dependencies shared by many repositories are only
+    fetched once.
+    """
+    import Handler
+    results = Handler.handle_pull_repositories(args.repo_dirs, max_workers=args.workers, verbose=False)
+    return sorted([command_result(*result) for result in results], key=lambda result: result["repo"])
+
+def cmd_push(args: argparse.Namespace, cwd: path):
+    """
+    Commits every change of repositories and pushes them to GitHub; with --recursive, also every changed dependency
+    checked out inside them, dependencies first, committing their new versions in their parents.
+    """
+    import Handler
+    if not args.recursive:
+        return run_parallel(args, args.repo_dirs, Handler.push_bash_cmds(args.message))
+    import Assembly
+    results = []
+    for repo_dir in args.repo_dirs:
+        results += [command_result(name, status == "pushed", failed_cmd, err_text, elapsed, status=status, detail=detail)
+                    for name, status, detail, elapsed, failed_cmd, err_text in Assembly.push_assembly(repo_dir, args.message, max_workers=args.workers, verbose=False)]
+    return results
+
+def cmd_restore(args: argparse.Namespace, cwd: path):
+    """
+    Restores the dependencies of repositories to the versions they have pinned, only touching dependencies that are
+    missing, at another version or have local changes.
+    """
+    import Restore
+    results = Restore.restore_repositories(args.repo_dirs, max_workers=args.workers)
+    return [command_result(repo_name, succeeded, failed_cmd, err_text, elapsed, changes=changes)
+            for repo_name, succeeded, failed_cmd, err_text, elapsed, changes in results]
+
+def cmd_update(args: argparse.Namespace, cwd: path):
+    """
+    Updates the dependencies of repositories to their latest versions and pushes them; with --recursive, through
+    their whole assembly trees, leaves first. With --dry-run, only lists which dependencies are behind.
+    """
+    import Assembly
+    if args.dry_run:
+        return [command_result(row["repo"], row["status"] != "unknown", None if row["status"] != "unknown" else "git ls-remote", "", 0.0,
+                               dependency=row["dependency"], path=row["path"], pinned=row["pinned"], latest=row["latest"], status=row["status"])
+                for row in Assembly.update_preview(args.repo_dirs, max_workers=args.workers)]
+    if args.recursive:
+        results = Assembly.update_assembly(cwd, [repo_dir.name for repo_dir in args.repo_dirs], max_workers=args.workers, verbose=False)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+        import DependencyIndex
+        import Settings
+        import SharedFetch
+        import Trace
+        DependencyIndex.refresh(cwd)
+        with SharedFetch.session(), ThreadPoolExecutor(max_workers=max(1, int(args.workers or Settings.get("pool_workers"))), **Trace.pool_args()) as executor:
+            results = list(executor.map(Assembly.update_repository_dependencies, args.repo_dirs))
+    return [command_result(repo_name, status in ("updated", "current"), None if status in ("updated", "current") else detail, "", elapsed, status=status)
+            for repo_name, status, detail, elapsed in results]
+
+def cmd_dep_add(args: argparse.Namespace, cwd: path):
+    """
+    Adds a dependency to repositories and pushes them to GitHub.
+    """
+    import Handler
+    import ObjectCache
+    import Terminal
+    import Workspace
+    result = Terminal.run_bash_cmd(["git", "remote", "get-url", "origin"], cwd=Workspace.repo_dir(cwd, args.dep), verbose=False)
+    if result is None or result.returncode != 0:
+        return [command_result(args.dep, False, "git remote get-url origin", result.stderr if result is not None else "")]
+    dep_repo_url = result.stdout.strip()
+    results = []
+    for repo_dir in args.repo_dirs:
+        results.append(run_cmds(repo_dir, Handler.create_dependency_bash_cmds(dep_repo_url, args.dep, repo_dir.name)))
+        ObjectCache.absorb_repository(repo_dir)
+    return results
+
+def cmd_dep_rm(args: argparse.Namespace, cwd: path):
+    """
+    Removes a dependency from repositories and pushes them to GitHub.
+    """
+    import shutil
+    results = []
+    dep_path = f"{path('dep') / path(args.dep)}"
+    for repo_dir in args.repo_dirs:
+        result = run_cmds(repo_dir, [["git", "submodule", "deinit", "-f", dep_path], ["git", "rm", "-f", dep_path]])
+        if result["ok"]:
+            # clean up metadata left over
+            shutil.rmtree(repo_dir / ".git" / "modules" / "dep" / args.dep, ignore_errors=True)
+            shutil.rmtree(repo_dir / "dep" / args.dep, ignore_errors=True)
+            result = run_cmds(repo_dir, [["git", "commit", "-m", f"Deleted submodule/dependency {args.dep} from {repo_dir.name}"], ["git", "push"]])
+        results.append(result)
+    return results
+
+def cmd_prefetch(args: argparse.Namespace, cwd: path):
+    """
+    Fetches every repository and dependency remote that is due into refs that do not change branches or files, so
+    later pulls and status checks need less from the network. Meant to be run from cron or a scheduled task.
+    """
+    import Prefetch
+    return [command_result(remote, ok, None if ok else "git fetch", err_text) for remote, ok, err_text in Prefetch.run_once(cwd, force=args.force)]
+
+def cmd_maintenance(args: argparse.Namespace, cwd: path):
+    """
+    Packs loose objects and small packs, writes the commit-graph and drops old stashes of repositories that need it,
+    reporting the space saved and how much faster their history is to walk.
+    """
+    import Maintenance
+    reports = Maintenance.run_once(args.repo_dirs, force=args.force, max_workers=args.workers)
+    return [command_result(report["repo"], report["ok"], report["failed_cmd"], report["error"], report["seconds"],
+                           tasks=report["tasks"], saved_kb=report["saved_kb"], walk_before=report["walk_before"], walk_after=report["walk_after"],
+                           before=report["before"], after=report["after"]) for report in reports]
+
+def worktree_checkout(args: argparse.Namespace, cwd: path):
+    """
+    Gets the repository or dependency checkout a version is opened from.
+    """
+    import Workspace
+    repo_dir = Workspace.repo_dir(cwd, args.repo)
+    return repo_dir / args.dep if args.dep else repo_dir
+
+def cmd_worktree_open(args: argparse.Namespace, cwd: path):
+    """
+    Opens a repository, or a dependency checked out inside it, at a commit, tag or branch as a worktree sharing its
+    objects.
+    """
+    import Worktree
+    checkout = worktree_checkout(args, cwd)
+    name = f"{args.repo}/{args.dep}" if args.dep else args.repo
+    if not checkout.is_dir():
+        return [command_result(name, False, None, f"{checkout} does not exist")]
+    start_time = time.time()
+    worktree, sha, failed_cmd, err_text = Worktree.open_version(checkout, name, args.rev, label=args.label, with_dependencies=not args.no_deps)
+    return [command_result(name, failed_cmd is None, failed_cmd, err_text, time.time() - start_time, path=str(worktree), rev=args.rev, sha=sha)]
+
+def cmd_worktree_list(args: argparse.Namespace, cwd: path):
+    """
+    Lists the versions opened as worktrees.
+    """
+    import Worktree
+    return [command_result(entry["name"], True, path=entry["path"], rev=entry["rev"], sha=entry["sha"], source=entry["source"], opened=entry["opened"])
+            for entry in Worktree.list_versions()]
+
+def selected_worktrees(args: argparse.Namespace):
+    """
+    Gets the folders of the versions to remove, every opened version for "all".
+    """
+    import Worktree
+    return [entry["path"] for entry in Worktree.list_versions()] if args.paths == ["all"] else [str(path(worktree).expanduser().absolute()) for worktree in args.paths]
+
+def worktree_locks(args: argparse.Namespace, cwd: path):
+    """
+    Gets the directories locked while removing versions: the checkouts they were opened from.
+    """
+    import Worktree
+    return Worktree.sources(selected_worktrees(args) if hasattr(args, "paths") else None)
+
+def cmd_worktree_rm(args: argparse.Namespace, cwd: path):
+    """
+    Removes versions opened as worktrees, losing any changes made in them.
+    """
+    import Worktree
+    worktrees = selected_worktrees(args)
+    return [command_result(worktree, Worktree.remove_version(path(worktree)), None, "") for worktree in worktrees]
+
+def cmd_worktree_prune(args: argparse.Namespace, cwd: path):
+    """
+    Forgets versions whose folder or checkout was deleted and removes ones older than --days.
+    """
+    import Worktree
+    return [command_result(worktree, True) for worktree in Worktree.prune(args.days)]
+
+def cmd_bundle_export(args: argparse.Namespace, cwd: path):
+    """
+    Exports assemblies and every dependency checked out inside them as bundles for a machine without GitHub access,
+    with only the commits made since the last export to that machine.
+    """
+    import Bundle
+    results = []
+    for repo_dir in args.repo_dirs:
+        export_dir, rows = Bundle.export_assembly(repo_dir, args.target, args.out, full=args.full, max_workers=args.workers)
+        results += [command_result(row["repo"], row["status"] != "failed", None if row["status"] != "failed" else "git bundle create", row["error"], row["seconds"],
+                                   assembly=repo_dir.name, status=row["status"], export=str(export_dir) if export_dir is not None else None, size=row["size"],
+                                   prerequisites=row["prerequisites"]) for row in rows]
+    return results
+
+def bundle_import_locks(args: argparse.Namespace, cwd: path):
+    """
+    Gets the directories locked while importing: the clones of the assemblies exported.
+    """
+    import Bundle
+    import Workspace
+    return [Workspace.repo_dir(cwd, Bundle.export_assembly_name(export_dir)) for folder in args.paths for export_dir in Bundle.export_dirs(path(folder))]
+
+def cmd_bundle_import(args: argparse.Namespace, cwd: path):
+    """
+    Imports exports into existing clones of their assemblies, oldest first, without the network.
+    """
+    import Bundle
+    results = []
+    for export_dir in [export_dir for folder in args.paths for export_dir in Bundle.export_dirs(path(folder))]:
+        assembly, rows, restored = Bundle.import_export(export_dir, cwd, max_workers=args.workers)
+        results += [command_result(row["repo"], row["status"] != "failed", row["failed_cmd"], row["error"], row["seconds"],
+                                   assembly=assembly, export=str(export_dir), status=row["status"]) for row in rows]
+        if restored is not None:
+            repo_name, succeeded, failed_cmd, err_text, elapsed, changes = restored
+            results.append(command_result(repo_name, succeeded, failed_cmd, err_text, elapsed, assembly=assembly, export=str(export_dir), status="restored", changes=changes))
+    if len(results) == 0:
+        return [command_result(", ".join(args.paths), False, None, "no exports found")]
+    return results
+
+def cmd_lfs_pull(args: argparse.Namespace, cwd: path):
+    """
+    Downloads the large files of repositories and every dependency checked out inside them at once, into the shared
+    LFS cache.
+    """
+    import LargeFiles
+    if not LargeFiles.available():
+        return [command_result("lfs", False, "git lfs version", "git-lfs is not installed or the lfs setting is off")]
+    return [command_result(*result) for result in LargeFiles.pull_repositories(args.repo_dirs, args.workers)]
+
+def cmd_lfs_track(args: argparse.Namespace, cwd: path):
+    """
+    Tracks the CAD extensions of the lfs_extensions setting with LFS in repositories' .gitattributes. The change is
+    pushed with the next push.
+    """
+    import LargeFiles
+    if not LargeFiles.available():
+        return [command_result("lfs", False, "git lfs version", "git-lfs is not installed or the lfs setting is off")]
+    return [command_result(repo_dir.name, True, changed=LargeFiles.track(repo_dir)) for repo_dir in args.repo_dirs]
+
+def cmd_lfs_prune(args: argparse.Namespace, cwd: path):
+    """
+    Drops the least recently used large files from the shared LFS cache until it is under its size limit.
+    """
+    import LargeFiles
+    dropped, freed, left = LargeFiles.prune_cache(args.max_mb, args.workers)
+    return [command_result(str(LargeFiles.cache_dir()), True, dropped=dropped, freed_bytes=freed, size_bytes=left)]
+
+def cmd_usage(args: argparse.Namespace, cwd: path):
+    """
+    Reports the disk space of repositories and every dependency checked out inside them, objects stored more than once
+    across them, the largest files in their history and how much space dedup and pruning would reclaim.
+    """
+    import DiskUsage
+    start_time = time.time()
+    report = DiskUsage.analyze(args.repo_dirs, top=args.top, max_workers=args.workers)
+    results = [command_result(row["name"], True, path=str(row["path"]), kind=row["kind"], worktree_bytes=row["worktree_bytes"],
+                              objects_bytes=row["objects_bytes"], duplicated_bytes=row["duplicated_bytes"], prunable_bytes=row["prunable_bytes"],
+                              linked=row["linked"]) for row in report["checkouts"]]
+    results.append(command_result("workspace", True, None, "", time.time() - start_time, repos=report["repos"], store_bytes=report["store_bytes"],
+                                  lfs_cache_bytes=report["lfs_cache_bytes"], versions_bytes=report["versions_bytes"], duplicates=report["duplicates"],
+                                  largest_files=report["largest_files"], reclaimable=report["reclaimable"]))
+    return results
+
+def build_parser():
+    """
+    Builds the command line parser.
+    """
+    parser = argparse.ArgumentParser(prog="gitcad", description="Run GitCAD operations without the interactive menu. Results are printed as JSON.")
+    parser.add_argument("--cwd", help="folder searched for local repositories (default every workspace_roots setting)")
+    parser.add_argument("--workers", type=int, help="max number of repositories worked on at once (default pool_workers setting)")
+    parser.add_argument("--cprofile", action="store_true", default=None, help="run the command under cProfile, saving stats to ~/.gitcad/profiles")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    clone = commands.add_parser("clone", help="clone repositories and their dependencies")
+    clone.add_argument("urls", nargs="+", help="GitHub repository URLs")
+    clone.add_argument("--profile", choices=["full", "blobless", "shallow", "sparse"], help="clone profile (default clone_profile setting)")
+    clone.add_argument("--depth", type=int, help="number of commits kept by shallow clones")
+    clone.add_argument("--sparse", help="comma separated folders checked out by sparse clones")
+    clone.set_defaults(handler=cmd_clone, select=False, locks=clone_locks)
+
+    for name, handler, help_text in [("pull", cmd_pull, "pull repositories from GitHub"), ("restore", cmd_restore, "restore dependencies to their pinned versions")]:
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("repos", nargs="*", help="repository names or glob patterns (default all)")
+        command.set_defaults(handler=handler, select=True)
+
+    push = commands.add_parser("push", help="commit all changes and push repositories to GitHub")
+    push.add_argument("repos", nargs="+", help="repository names or glob patterns")
+    push.add_argument("-m", "--message", required=True, help="commit message")
+    push.add_argument("--recursive", action="store_true", help="also push changed dependencies checked out inside them, dependencies first")
+    push.set_defaults(handler=cmd_push, select=True)
+
+    update = commands.add_parser("update", help="update dependencies to their latest versions and push")
+    update.add_argument("repos", nargs="*", help="repository names or glob patterns (default all)")
+    update.add_argument("--recursive", action="store_true", help="update whole assembly trees, leaves first")
+    update.add_argument("--dry-run", action="store_true", help="only list each dependency's pinned and latest versions; nothing is fetched or changed")
+    update.set_defaults(handler=cmd_update, select=True)
+
+    prefetch = commands.add_parser("prefetch", help="fetch repositories and dependencies that are due in the background refs")
+    prefetch.add_argument("--force", action="store_true", help="fetch everything now, ignoring the schedule and backoff")
+    prefetch.set_defaults(handler=cmd_prefetch, select=False)
+
+    maintenance = commands.add_parser("maintenance", help="pack objects, write the commit-graph and drop old stashes of repositories that need it")
+    maintenance.add_argument("repos", nargs="*", help="repository names or glob patterns (default all)")
+    maintenance.add_argument("--force", action="store_true", help="run every task, whatever the repositories' stats")
+    maintenance.set_defaults(handler=cmd_maintenance, select=True)
+
+    trace = commands.add_parser("trace", help="summarize recorded command timings: slowest repositories and commands per operation")
+    trace.add_argument("--operation", help="only summarize this operation, i.e. \"pull\" or \"pull_repository\"")
+    trace.add_argument("--top", type=int, default=5, help="number of repositories and commands listed per operation")
+    trace.set_defaults(handler=None, select=False)
+
+    usage = commands.add_parser("usage", help="report disk usage, duplicate objects across repositories and the largest files in history")
+    usage.add_argument("repos", nargs="*", help="repository names or glob patterns (default all)")
+    usage.add_argument("--top", type=int, default=10, help="number of duplicate objects and largest files listed")
+    usage.set_defaults(handler=cmd_usage, select=True, lock=False)
+
+    worktree = commands.add_parser("worktree", help="open repositories and dependencies at other versions, sharing their objects")
+    worktree_commands = worktree.add_subparsers(dest="worktree_command", required=True)
+    command = worktree_commands.add_parser("open", help="open a repository or dependency at a commit, tag or branch")
+    command.add_argument("repo", help="name of the repository")
+    command.add_argument("rev", help="commit, tag or branch to open")
+    command.add_argument("--dep", help="path of a dependency checked out inside the repository, i.e. dep/StandardCAD")
+    command.add_argument("--label", help="name of the version's folder (default the rev); an open version with the same label is switched")
+    command.add_argument("--no-deps", action="store_true", help="do not check out the dependencies the version pins")
+    command.set_defaults(handler=cmd_worktree_open, select=False, locks=lambda args, cwd: [worktree_checkout(args, cwd)])
+    command = worktree_commands.add_parser("list", help="list opened versions")
+    command.set_defaults(handler=cmd_worktree_list, select=False)
+    command = worktree_commands.add_parser("rm", help="remove opened versions")
+    command.add_argument("paths", nargs="+", help="folders of the versions, or \"all\"")
+    command.set_defaults(handler=cmd_worktree_rm, select=False, locks=worktree_locks)
+    command = worktree_commands.add_parser("prune", help="forget versions deleted by hand and remove old ones")
+    command.add_argument("--days", type=float, help="also remove versions opened more than this many days ago")
+    command.set_defaults(handler=cmd_worktree_prune, select=False, locks=worktree_locks)
+
+    bundle = commands.add_parser("bundle", help="move assemblies to machines without GitHub access as git bundles")
+    bundle_commands = bundle.add_subparsers(dest="bundle_command", required=True)
+    command = bundle_commands.add_parser("export", help="export assemblies with every dependency, only what changed since the last export to the target")
+    command.add_argument("repos", nargs="+", help="assembly names or glob patterns")
+    command.add_argument("--target", default="offline", help="name of the machine the export is for (default offline)")
+    command.add_argument("--out", help="folder the export is written to (default bundle_dir setting)")
+    command.add_argument("--full", action="store_true", help="export everything, i.e. for a machine that lost earlier exports")
+    command.set_defaults(handler=cmd_bundle_export, select=True)
+    command = bundle_commands.add_parser("import", help="import exports into existing clones of their assemblies")
+    command.add_argument("paths", nargs="+", help="export folders, or folders holding them")
+    command.set_defaults(handler=cmd_bundle_import, select=False, locks=bundle_import_locks)
+
+    lfs = commands.add_parser("lfs", help="store CAD files with Git LFS in a shared cache")
+    lfs_commands = lfs.add_subparsers(dest="lfs_command", required=True)
+    for name, handler, help_text in [("pull", cmd_lfs_pull, "download the large files of repositories and their dependencies"),
+                                     ("track", cmd_lfs_track, "track the lfs_extensions setting with LFS in repositories")]:
+        command = lfs_commands.add_parser(name, help=help_text)
+        command.add_argument("repos", nargs="*", help="repository names or glob patterns (default all)")
+        command.set_defaults(handler=handler, select=True)
+    command = lfs_commands.add_parser("prune", help="drop least recently used large files from the shared cache")
+    command.add_argument("--max-mb", type=float, help="size limit of the cache (default lfs_cache_mb setting)")
+    command.set_defaults(handler=cmd_lfs_prune, select=False)
+
+    dep = commands.add_parser("dep", help="add or remove dependencies")
+    dep_commands = dep.add_subparsers(dest="dep_command", required=True)
+    for name, handler, help_text in [("add", cmd_dep_add, "add a dependency to repositories"), ("rm", cmd_dep_rm, "remove a dependency from repositories")]:
+        command = dep_commands.add_parser(name, help=help_text)
+        command.add_argument("dep", help="name of the dependency repository")
+        command.add_argument("repos", nargs="+", help="parent repository names or glob patterns")
+        command.set_defaults(handler=handler, select=True)
+    return parser
+
+def main(argv: list):
+    """
+    Runs a command from command line args and prints its results as JSON.
+    param: argv [list] The command line args, without the program name
+    returns: the exit code
+    """
+    args = build_parser().parse_args(argv)
+    if args.command == "trace":
+        import Trace
+        print(json.dumps(Trace.summary(args.operation, args.top), indent=2))
+        return 0
+    cwd = workspace_dir(args)
+    output = {"command": " ".join([args.command] + ([args.dep_command] if args.command == "dep" else [args.worktree_command] if args.command == "worktree" else [args.bundle_command] if args.command == "bundle" else [args.lfs_command] if args.command == "lfs" else [])), "cwd": str(cwd)}
+    if args.select:
+        args.repo_dirs, unmatched = select_repositories(cwd, args.repos)
+        if len(unmatched) > 0:
+            output.update({"ok": False, "error": f"no repositories match {', '.join(unmatched)}", "results": []})
+            print(json.dumps(output, indent=2))
+            return 1
+    import RepoLock
+    import Trace
+    waited = [] # holders of locks waited on, to only say so once
+
+    def on_wait(holder: str):
+        if len(waited) == 0:
+            print(f"waiting for {holder} to finish", file=sys.stderr)
+        waited.append(holder)
+
+    # wait for menu jobs and other batch commands working on the same repositories; dry runs and reports change nothing
+    if args.select:
+        lock_dirs = args.repo_dirs if getattr(args, "lock", True) and not getattr(args, "dry_run", False) else []
+    else:
+        lock_dirs = args.locks(args, cwd) if hasattr(args, "locks") else []
+    with RepoLock.repositories(lock_dirs, output["command"], on_wait=on_wait):
+        with Trace.operation(output["command"], profile=args.cprofile):
+            results = args.handler(args, cwd)
+    output.update({"ok": all([result["ok"] for result in results]), "results": results})
+    print(json.dumps(output, indent=2))
+    return 0 if output["ok"] else 1
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+from pathlib import Path as path
+import Terminal
+import ObjectCache
+import LargeFiles
+
+# ways a repository can be cloned
+FULL = "full" # every revision of every file
+BLOBLESS = "blobless" # every commit, but file contents are only downloaded when checked out
+SHALLOW = "shallow" # only the most recent commits, up to a depth
+SPARSE = "sparse" # blobless, and only selected folders are checked out
+PROFILES = (FULL, BLOBLESS, SHALLOW, SPARSE)
+SUBMODULE_FILTER_VERSION = (2, 36) # first git with git submodule update --filter
+
+_git_version = None # version of git, read once
+
+def git_version():
+    """
+    Gets the version of the installed git, running git only the first time.
+    returns: tuple of version numbers, i.e. (2, 39, 2), or () if it could not be read
+    """
+    global _git_version
+    if _git_version is None:
+        result = Terminal.run_bash_cmd(["git", "--version"], verbose=False)
+        numbers = []
+        if result is not None and result.returncode == 0 and len(result.stdout.split()) >= 3:
+            # i.e. "git version 2.39.2" or "git version 2.39.2.windows.1"
+            for part in result.stdout.split()[2].split("."):
+                if not part.isdigit():
+                    break
+                numbers.append(int(part))
+        _git_version = tuple(numbers)
+    return _git_version
+
+def submodule_filter_args():
+    """
+    Gets the git submodule update args that leave out file contents until they are checked out, or none if git is too
+    old to support them; dependencies are then cloned in full instead of failing.
+    """
+    version = git_version()
+    if len(version) > 0 and version < SUBMODULE_FILTER_VERSION:
+        return []
+    return ["--filter=blob:none"]
+
+def clone_args(profile: str, depth: int=1):
+    """
+    Gets the extra git clone args for a clone profile.
+    param: profile [str] The clone profile
+    param: depth [int] Optional number of commits to keep for shallow clones
+    """
+    if profile == BLOBLESS:
+        return ["--filter=blob:none"]
+    elif profile == SHALLOW:
+        return ["--depth", str(depth)]
+    elif profile == SPARSE:
+        return ["--filter=blob:none", "--sparse"]
+    return []
+
+def submodule_update_args(profile: str, depth: int=1):
+    """
+    Gets the extra git submodule update args so dependencies are cloned with the same profile as their parent and
+    borrow from the shared object store. Blobless and sparse dependencies are cloned in full with git older than 2.36.
+    param: profile [str] The clone profile
+    param: depth [int] Optional number of commits to keep for shallow clones
+    """
+    if profile in (BLOBLESS, SPARSE):
+        return submodule_filter_args() + ObjectCache.reference_args()
+    elif profile == SHALLOW:
+        return ["--depth", str(depth)] + ObjectCache.reference_args()
+    return ObjectCache.reference_args()
+
+def clone_bash_cmds(repo_url: str, profile: str, depth: int=1, sparse_paths: list=None):
+    """
+    Gets the bash commands that clone a repository and its dependencies with a clone profile.
+    param: repo_url [str] The GitHub repository URL
+    param: profile [str] The clone profile
+    param: depth [int] Optional number of commits to keep for shallow clones
+    param: sparse_paths [list] Optional folders to check out for sparse clones; dependencies (dep/) are always checked out
+    returns: (commands to run in the GitHub current working directory, commands to run in the cloned repository)
+    """
+    # large files are downloaded for every checkout at once afterwards, see LargeFiles.pull_repositories
+    cwd_cmds = [["git"] + LargeFiles.config_args(skip_smudge=True) + ["clone"] + clone_args(profile, depth) + [repo_url]]
+    repo_cmds = []
+    if profile == SPARSE:
+        repo_cmds.append(["git", "sparse-checkout", "set", "--cone"] + list(sparse_paths or []) + ["dep"])
+    # remember the profile so later pulls keep it
+    repo_cmds.append(["git", "config", "gitcad.profile", profile])
+    repo_cmds.append(["git", "config", "gitcad.depth", str(depth)])
+    repo_cmds.append(["git"] + LargeFiles.config_args(skip_smudge=True) + ["submodule", "update", "--init", "--recursive"] + submodule_update_args(profile, depth))
+    return (cwd_cmds, repo_cmds)
+
+def load_profile(repo_dir: path):
+    """
+    Gets the clone profile a repository was cloned with. Repositories cloned before profiles existed are full clones.
+    param: repo_dir [path] Directory of the repository
+    returns: (profile, depth)
+    """
+    profile = FULL
+    depth = 1
+    result = Terminal.run_bash_cmd(["git", "config", "--get-regexp", r"^gitcad\.(profile|depth)$"], cwd=repo_dir, verbose=False)
+    if result is not None and result.returncode == 0:
+        for line in result.stdout.splitlines():
+            key, value = (line.split(maxsplit=1) + [""])[:2]
+            if key == "gitcad.profile" and value in PROFILES:
+                profile = value
+            elif key == "gitcad.depth" and value.isdigit():
+                depth = int(value)
+    return (profile, depth)
+
+def pull_parent_bash_cmds(repo_dir: path):
+    """
+    Gets the bash commands that pull a repository itself, without its dependencies, while keeping the profile it was
+    cloned with.
+    param: repo_dir [path] Directory of the repository
+    """
+    profile, depth = load_profile(repo_dir)
+    fetch_args = ["--depth", str(depth)] if profile == SHALLOW else []
+    return [
+        # stash (keep) local changes and pull from github; dependencies are fetched separately
+        ["git", "stash"],
+        ["git", "fetch", "--no-recurse-submodules"] + fetch_args + ["origin"],
+        ["git"] + LargeFiles.config_args(skip_smudge=True) + ["reset", "--hard", "origin/main"]]
+
+def pull_dependencies_bash_cmds(repo_dir: path):
+    """
+    Gets the bash commands that check out the dependencies of a pulled repository at their pinned versions, cloning
+    new ones with the profile the repository was cloned with.
+    param: repo_dir [path] Directory of the repository
+    """
+    profile, depth = load_profile(repo_dir)
+    return [["git"] + LargeFiles.config_args(skip_smudge=True) + ["submodule", "update", "--init", "--recursive"] + submodule_update_args(profile, depth)]
+
+def pull_bash_cmds(repo_dir: path):
+    """
+    Gets the bash commands that pull a repository and its dependencies while keeping the profile it was cloned with,
+    and then their large files.
+    param: repo_dir [path] Directory of the repository
+    """
+    lfs_cmds = []
+    if LargeFiles.available():
+        lfs_cmds = [["git"] + LargeFiles.config_args() + ["lfs", "pull"],
+                    ["git"] + LargeFiles.config_args() + ["submodule", "foreach", "--recursive", "--quiet", "git lfs pull"]]
+    return pull_parent_bash_cmds(repo_dir) + pull_dependencies_bash_cmds(repo_dir) + lfs_cmds
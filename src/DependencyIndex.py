@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+from pathlib import Path as path
+import json
+import os
+import re
+import threading
+import Settings
+
+INDEX_VERSION = 1 # bump when the layout of the index file changes
+SUBMODULE_SECTION = re.compile(r'^\[\s*submodule\s+"(.*)"\s*\]$')
+
+_lock = threading.RLock() # guards the in-memory index; background jobs and pool threads refresh it too
+_index = None # in-memory copy of the index so repeated menus skip reading it from disk
+
+def index_file():
+    """
+    Gets the path of the dependency index file.
+    """
+    return Settings.settings_dir() / "dependency_index.json"
+
+def load():
+    """
+    Loads the dependency index, from memory if already loaded or else from disk.
+    The index maps a repository directory to the mtime of its .gitmodules file and the dependencies parsed from it.
+    """
+    global _index
+    with _lock:
+        if _index is not None:
+            return _index
+        try:
+            with open(index_file(), "r") as file:
+                _index = json.load(file)
+            if _index.get("version") != INDEX_VERSION:
+                raise ValueError("outdated dependency index")
+        except Exception as e:
+            # no index yet, unreadable, or old; start a new one
+            _index = {"version": INDEX_VERSION, "repos": {}}
+        return _index
+
+def save(index: dict):
+    """
+    Saves the dependency index to disk.
+    param: index [dict] The index to save
+    """
+    with _lock:
+        with open(index_file(), "w") as file:
+            json.dump(index, file)
+
+def repo_name_from_url(url: str):
+    """
+    Gets the name of a repository from its http or ssh URL.
+    param: url [str] The repository URL
+    """
+    name = url.strip().rstrip("/").split("/").pop().split(":").pop()
+    return name[:-len(".git")] if name.endswith(".git") else name
+
+def parse_gitmodules(file_dir: path):
+    """
+    Parses a .gitmodules file into a list of submodules, each a dict of name, path, url, branch and repo.
+    param: file_dir [path] The .gitmodules file
+    """
+    submodules = []
+    current = None # submodule section being read
+    with open(file_dir, "r") as file:
+        for raw_line in file:
+            line = raw_line.strip()
+            # skip blank lines and comments
+            if len(line) == 0 or line[0] in "#;":
+                continue
+            # start of a new section
+            if line.startswith("["):
+                match = SUBMODULE_SECTION.match(line)
+                current = {"name": match.group(1), "path": None, "url": None, "branch": None} if match else None
+                if current is not None:
+                    submodules.append(current)
+                continue
+            if current is None or "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            key = key.strip().lower()
+            if key in ("path", "url", "branch"):
+                current[key] = value.strip().strip('"')
+    # name each dependency by its repository
+    for submodule in submodules:
+        if submodule["url"] is not None:
+            submodule["repo"] = repo_name_from_url(submodule["url"])
+        else:
+            submodule["repo"] = path(submodule["path"] or submodule["name"]).name
+    return submodules
+
+def gitmodules_stamp(repo_dir: path):
+    """
+    Gets a stamp of a repository's .gitmodules file that changes when the file changes, or None if there is no file.
+    param: repo_dir [path] Directory of the repository
+    """
+    try:
+        stat = (repo_dir / ".gitmodules").stat()
+        return [stat.st_mtime_ns, stat.st_size]
+    except OSError as e:
+        return None
+
+def refresh_repository(index: dict, repo_dir: path):
+    """
+    Refreshes the index entry of a repository and of its checked out nested dependencies if their .gitmodules changed.
+    param: index [dict] The index to refresh
+    param: repo_dir [path] Directory of the repository
+    returns: True if the index was changed
+    """
+    key = str(path(repo_dir).absolute())
+    stamp = gitmodules_stamp(repo_dir)
+    entry = index["repos"].get(key)
+    changed = False
+    if entry is None or entry["stamp"] != stamp:
+        try:
+            deps = parse_gitmodules(repo_dir / ".gitmodules") if stamp is not None else []
+        except Exception as e:
+            deps = [] # unreadable .gitmodules; treat as no deps
+        entry = {"stamp": stamp, "deps": deps}
+        index["repos"][key] = entry
+        changed = True
+    # nested dependencies checked out under this repo (dep/<name>) have their own .gitmodules
+    for dep in entry["deps"]:
+        if dep["path"] is not None and (repo_dir / dep["path"]).is_dir():
+            changed = refresh_repository(index, repo_dir / dep["path"]) or changed
+    return changed
+
+def refresh(cwd: path, repo_dirs: list=None):
+    """
+    Refreshes the index for every repository under the workspace roots and saves it if anything changed.
+    Only repositories whose .gitmodules changed are parsed again.
+    param: cwd [path] The GitHub current working directory
+    param: repo_dirs [list] Optional directories of the repositories, if already found
+    returns: the refreshed index
+    """
+    import Workspace
+    repo_dirs = repo_dirs if repo_dirs is not None else Workspace.repositories(cwd)
+    root_keys = [str(root) + os.sep for root in Workspace.workspace_roots(cwd)]
+    with _lock:
+        index = load()
+        changed = False
+        found = set()
+        for item in repo_dirs:
+            changed = refresh_repository(index, item) or changed
+            found.add(str(item.absolute()))
+        # forget repositories under the roots that no longer exist, with their nested dependencies
+        for key in list(index["repos"].keys()):
+            if any([key.startswith(root_key) for root_key in root_keys]) and not any([key == repo_key or key.startswith(repo_key + os.sep) for repo_key in found]):
+                del index["repos"][key]
+                changed = True
+        if changed:
+            save(index)
+        return index
+
+def get_dependencies(repo_dir: path, refresh_entry: bool=True):
+    """
+    Gets the immediate dependencies of a repository from the index.
+    param: repo_dir [path] Directory of the repository
+    param: refresh_entry [bool] Optional to check the repository's .gitmodules for changes first
+    returns: list of submodule dicts (name, path, url, branch, repo)
+    """
+    with _lock:
+        index = load()
+        if refresh_entry and refresh_repository(index, path(repo_dir)):
+            save(index)
+        entry = index["repos"].get(str(path(repo_dir).absolute()))
+        return [dict(dep) for dep in entry["deps"]] if entry is not None else []
+
+def get_dependency_names(repo_dir: path, refresh_entry: bool=True):
+    """
+    Gets the names of the immediate dependencies of a repository from the index.
+    param: repo_dir [path] Directory of the repository
+    param: refresh_entry [bool] Optional to check the repository's .gitmodules for changes first
+    """
+    return [dep["repo"] for dep in get_dependencies(repo_dir, refresh_entry=refresh_entry)]
+
+def get_dependency_tree(repo_dir: path):
+    """
+    Gets the nested dependencies of a repository as a tree, read from the index.
+    param: repo_dir [path] Directory of the repository
+    returns: list of submodule dicts, each with a "deps" list of its own nested dependencies
+    """
+    tree = []
+    for dep in get_dependencies(repo_dir, refresh_entry=False):
+        dep["deps"] = get_dependency_tree(path(repo_dir) / dep["path"]) if dep["path"] is not None else []
+        tree.append(dep)
+    return tree
@@ -0,0 +1,347 @@
+#!/usr/bin/python3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path as path
+import json
+import os
+import threading
+import Terminal
+import Settings
+import RepoStatus
+import Trace
+
+# Shows where disk space goes across the workspace: the checked out files and object store of every repository and
+# every dependency checked out inside it (.git/modules/dep/<name>), the shared object store and the LFS cache. It also
+# finds objects stored more than once, in several object stores, and the largest files in each repository's history,
+# and estimates how much space sharing those objects and pruning would reclaim.
+#
+# Objects are found by reading pack indexes directly rather than asking git, and what each pack holds is cached in
+# ~/.gitcad/disk_usage.json under the pack's name. Packs never change once written, so a repeat scan only reads new
+# packs and loose objects. The largest files in history are cached per repository until its objects or refs change.
+
+_lock = threading.Lock() # guards the in-memory cache
+_cache = None # in-memory copy of the disk usage cache
+PACK_INDEX_SIGNATURE = b"\377tOc" # start of a version 2 pack index
+LARGEST_KEPT = 50 # largest files in history kept per repository
+
+def cache_file():
+    """
+    Gets the path of the disk usage cache file.
+    """
+    return Settings.settings_dir() / "disk_usage.json"
+
+def load_cache():
+    """
+    Loads the disk usage cache, from memory if already loaded or else from disk.
+    The cache maps each pack to the disk size of every object in it, and each git directory to its largest files.
+    """
+    global _cache
+    with _lock:
+        if _cache is None:
+            try:
+                with open(cache_file(), "r") as file:
+                    _cache = json.load(file)
+            except Exception as e:
+                _cache = {}
+            _cache.setdefault("packs", {})
+            _cache.setdefault("largest", {})
+        return _cache
+
+def save_cache(packs_in_use: set):
+    """
+    Saves the disk usage cache, dropping packs that no longer exist.
+    param: packs_in_use [set] Names of every pack found by the scan
+    """
+    with _lock:
+        for pack_name in [pack_name for pack_name in _cache["packs"] if pack_name not in packs_in_use]:
+            del _cache["packs"][pack_name]
+        with open(cache_file(), "w") as file:
+            json.dump(_cache, file)
+
+def folder_size(folder: path, skip: set=None):
+    """
+    Gets the size of every file in a folder and its subfolders, without following links.
+    param: folder [path] The folder
+    param: skip [set] Optional absolute paths of subfolders left out, i.e. dependency checkouts counted on their own
+    returns: size in bytes
+    """
+    total = 0
+    to_visit = [str(folder)]
+    while len(to_visit) > 0:
+        try:
+            entries = list(os.scandir(to_visit.pop()))
+        except OSError as e:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != ".git" and (skip is None or entry.path not in skip):
+                        to_visit.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and entry.name != ".git":
+                    total += entry.stat(follow_symlinks=False).st_size
+            except OSError as e:
+                pass
+    return total
+
+def objects_dir(git_path: path):
+    """
+    Gets the object store of a git directory, following worktrees to the repository they belong to.
+    param: git_path [path] The git directory
+    """
+    try:
+        common = (git_path / "commondir").read_text().strip()
+        git_path = (git_path / common).resolve()
+    except OSError as e:
+        pass
+    return git_path / "objects"
+
+def read_pack_index(index_file: path, pack_size: int):
+    """
+    Reads the objects in a pack from its version 2 index, and the space each takes in the pack.
+    param: index_file [path] The .idx file
+    param: pack_size [int] Size of the .pack file in bytes
+    returns: dict mapping each object id to its size in the pack, or None if the index can not be read
+    """
+    try:
+        data = index_file.read_bytes()
+    except OSError as e:
+        return None
+    if data[:4] != PACK_INDEX_SIGNATURE or int.from_bytes(data[4:8], "big") != 2:
+        return None
+    fanout_end = 8 + 256 * 4
+    count = int.from_bytes(data[fanout_end-4:fanout_end], "big")
+    # SHA-1 or SHA-256 ids; whichever leaves room for only the 64-bit offsets table and two checksums
+    hash_size = None
+    for size in (20, 32):
+        rest = len(data) - fanout_end - count * (size + 8) - 2 * size
+        if rest >= 0 and rest % 8 == 0:
+            hash_size = size
+            break
+    if hash_size is None:
+        return None
+    offsets_start = fanout_end + count * (hash_size + 4)
+    large_start = offsets_start + count * 4
+    oids, offsets = [], []
+    for i in range(count):
+        oids.append(data[fanout_end + i*hash_size:fanout_end + (i+1)*hash_size].hex())
+        offset = int.from_bytes(data[offsets_start + i*4:offsets_start + (i+1)*4], "big")
+        if offset & 0x80000000: # the offset is in the 64-bit table
+            large = offset & 0x7fffffff
+            offset = int.from_bytes(data[large_start + large*8:large_start + (large+1)*8], "big")
+        offsets.append(offset)
+    # an object takes the space up to the next object, or up to the pack's checksum
+    order = sorted(range(count), key=lambda i: offsets[i])
+    sizes = {}
+    for position, i in enumerate(order):
+        end = offsets[order[position+1]] if position + 1 < count else pack_size - hash_size
+        sizes[oids[i]] = end - offsets[i]
+    return sizes
+
+def scan_store(store: path):
+    """
+    Finds every object in an object store and the space it takes, reading only packs not scanned before.
+    Objects borrowed through alternates are not included.
+    param: store [path] The objects folder
+    returns: dict of objects (object id -> bytes), loose (object id -> bytes of its loose file, if not packed), garbage bytes
+    (temporary files and packs without an index), prunable bytes (garbage and loose objects already packed), total
+    bytes and the names of its packs
+    """
+    cache = load_cache()
+    objects, loose, garbage, total, pack_names = {}, {}, 0, 0, []
+    try:
+        pack_entries = list(os.scandir(store / "pack"))
+    except OSError as e:
+        pack_entries = []
+    names = set([entry.name for entry in pack_entries])
+    for entry in pack_entries:
+        try:
+            size = entry.stat().st_size
+        except OSError as e:
+            continue
+        total += size
+        if entry.name.startswith("tmp_") or (entry.name.endswith(".pack") and entry.name[:-5] + ".idx" not in names):
+            garbage += size
+            continue
+        if not entry.name.endswith(".pack") or entry.name[:-5] + ".idx" not in names:
+            continue
+        pack_name = entry.name[:-5]
+        pack_names.append(pack_name)
+        with _lock:
+            sizes = cache["packs"].get(pack_name)
+        if sizes is None:
+            sizes = read_pack_index(store / "pack" / f"{pack_name}.idx", size) or {}
+            with _lock:
+                cache["packs"][pack_name] = sizes
+        objects.update(sizes)
+    # loose objects are few and cheap to list; they are never cached
+    try:
+        fanout = [entry for entry in os.scandir(store) if len(entry.name) == 2 and entry.is_dir(follow_symlinks=False)]
+    except OSError as e:
+        fanout = []
+    for folder in fanout:
+        try:
+            for entry in os.scandir(folder.path):
+                size = entry.stat().st_size
+                total += size
+                if entry.name.startswith("tmp_"):
+                    garbage += size
+                else:
+                    loose[folder.name + entry.name] = size
+        except OSError as e:
+            pass
+    # loose objects already in a pack are removed by git prune-packed
+    packed_loose = sum([size for oid, size in loose.items() if oid in objects])
+    loose = dict([(oid, size) for oid, size in loose.items() if oid not in objects])
+    objects.update(loose)
+    return {"objects": objects, "loose": loose, "garbage": garbage, "prunable": garbage + packed_loose, "total": total, "packs": pack_names}
+
+def largest_files(checkout: path, store_scan: dict):
+    """
+    Gets the largest files in a repository's history, from the cache unless its objects or refs changed.
+    param: checkout [path] Directory of the repository or dependency checkout
+    param: store_scan [dict] Its object store from scan_store
+    returns: list of [object id, size in bytes, path of the file], largest first
+    """
+    git_path = RepoStatus.git_dir(checkout)
+    packed_refs = objects_dir(git_path).parent / "packed-refs"
+    fingerprint = sorted(store_scan["packs"]) + [len(store_scan["loose"]), packed_refs.stat().st_mtime_ns if packed_refs.exists() else 0]
+    cache = load_cache()
+    with _lock:
+        entry = cache["largest"].get(str(git_path))
+    if entry is not None and entry["fingerprint"] == fingerprint:
+        return entry["files"]
+    # every blob reachable from any ref, with the path it was first seen at
+    names = Terminal.run_bash_cmd(["git", "rev-list", "--objects", "--all"], cwd=checkout, verbose=False)
+    sizes = Terminal.run_bash_cmd(["git", "cat-file", "--batch-all-objects", "--batch-check=%(objecttype) %(objectname) %(objectsize)"], cwd=checkout, verbose=False)
+    if names is None or names.returncode != 0 or sizes is None or sizes.returncode != 0:
+        return []
+    paths = {}
+    for line in names.stdout.splitlines():
+        if " " in line:
+            oid, name = line.split(" ", 1)
+            paths.setdefault(oid, name)
+    blobs = []
+    for line in sizes.stdout.splitlines():
+        parts = line.split()
+        if len(parts) == 3 and parts[0] == "blob" and parts[1] in paths:
+            blobs.append([parts[1], int(parts[2]), paths[parts[1]]])
+    blobs.sort(key=lambda blob: -blob[1])
+    files = blobs[:LARGEST_KEPT]
+    with _lock:
+        cache["largest"][str(git_path)] = {"fingerprint": fingerprint, "files": files}
+    return files
+
+def alternates(store: path):
+    """
+    Gets the object stores an object store borrows from.
+    param: store [path] The objects folder
+    """
+    try:
+        lines = (store / "info" / "alternates").read_text().splitlines()
+    except OSError as e:
+        return []
+    return [(store / line.strip()).resolve() for line in lines if len(line.strip()) > 0 and not line.startswith("#")]
+
+def analyze(repo_dirs: list, top: int=10, max_workers: int=None):
+    """
+    Scans the disk usage of many repositories and every dependency checked out inside them at once.
+    param: repo_dirs [list] Directories of the repositories
+    param: top [int] Optional number of duplicate objects and largest files listed
+    param: max_workers [int] Optional max number of checkouts scanned at once; defaults to the pool_workers setting
+    returns: dict of checkouts (a row per repository and dependency), repos (totals per repository, largest first),
+    store_bytes, lfs_cache_bytes, versions_bytes, duplicates, largest_files and reclaimable bytes by how
+    """
+    import Assembly
+    import LargeFiles
+    import ObjectCache
+    import Worktree
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    load_cache()
+    # every checkout, and the object store each keeps its objects in
+    checkouts = []
+    for repo_dir in repo_dirs:
+        tree = Assembly.checkout_tree(repo_dir)
+        for checkout in sorted(tree, key=lambda checkout: Assembly.checkout_name(repo_dir, checkout)):
+            git_path = RepoStatus.git_dir(checkout)
+            if git_path is not None:
+                checkouts.append({"repo": repo_dir.name, "name": Assembly.checkout_name(repo_dir, checkout), "path": checkout,
+                                  "kind": "repository" if checkout == repo_dir else "dependency", "store": objects_dir(git_path).resolve()})
+    stores = {} # object store -> names of the checkouts keeping objects in it
+    for row in checkouts:
+        stores.setdefault(row["store"], []).append(row["name"])
+    shared_store = ObjectCache.store_dir() / "objects" if ObjectCache.enabled() else None
+    if shared_store is not None:
+        stores.setdefault(shared_store.resolve(), []).append("shared store")
+    nested = set([str(row["path"].absolute()) for row in checkouts])
+    versions = [path(entry["path"]) for entry in Worktree.list_versions()]
+
+    with ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        scans = dict(zip(stores, executor.map(scan_store, stores)))
+        worktree_sizes = list(executor.map(lambda row: folder_size(row["path"], nested), checkouts))
+        largest = list(executor.map(lambda row: largest_files(row["path"], scans[row["store"]]), checkouts))
+        versions_bytes = sum(executor.map(folder_size, versions))
+    save_cache(set([pack_name for scan in scans.values() for pack_name in scan["packs"]]))
+
+    # objects kept in more than one store; all but the biggest copy could be shared
+    copies = {}
+    for store, scan in scans.items():
+        for oid, size in scan["objects"].items():
+            copies.setdefault(oid, []).append((store, size))
+    duplicates = dict([(oid, stored) for oid, stored in copies.items() if len(stored) > 1])
+    duplicated_bytes = {}
+    for stored in duplicates.values():
+        for store, size in stored:
+            duplicated_bytes[store] = duplicated_bytes.get(store, 0) + size
+    names = dict([(blob[0], blob[2]) for files in largest for blob in files])
+
+    # loose objects already in a store borrowed from can be pruned too
+    prunable = {}
+    for store, scan in scans.items():
+        borrowed = [scans[alternate]["objects"] for alternate in alternates(store) if alternate in scans]
+        prunable[store] = scan["prunable"] + sum([size for oid, size in scan["loose"].items() if any([oid in objects for objects in borrowed])])
+
+    # each store is counted once, against the first checkout keeping objects in it
+    counted = set()
+    for row, worktree_bytes in zip(checkouts, worktree_sizes):
+        first = row["store"] not in counted
+        counted.add(row["store"])
+        row.update({"worktree_bytes": worktree_bytes, "objects_bytes": scans[row["store"]]["total"] if first else 0,
+                    "duplicated_bytes": duplicated_bytes.get(row["store"], 0) if first else 0, "prunable_bytes": prunable[row["store"]] if first else 0,
+                    "linked": shared_store is not None and shared_store.resolve() in alternates(row["store"])})
+    repos = {}
+    for row in checkouts:
+        repo = repos.setdefault(row["repo"], {"repo": row["repo"], "worktree_bytes": 0, "objects_bytes": 0, "checkouts": 0})
+        repo["worktree_bytes"] += row["worktree_bytes"]
+        repo["objects_bytes"] += row["objects_bytes"]
+        repo["checkouts"] += 1
+    for repo in repos.values():
+        repo["total_bytes"] = repo["worktree_bytes"] + repo["objects_bytes"]
+
+    # the largest files of every repository's history, each listed once
+    files = {}
+    for row, blobs in zip(checkouts, largest):
+        for oid, size, name in blobs:
+            entry = files.setdefault(oid, {"oid": oid, "path": name, "size": size, "stored_bytes": min([stored for store, stored in copies.get(oid, [(None, size)])]), "repos": []})
+            entry["repos"].append(row["name"])
+    lfs_bytes = sum([size for file_path, size, last_used in LargeFiles.cache_objects()]) if LargeFiles.cache_dir().is_dir() else 0
+    dedup_bytes = sum([sum([size for store, size in stored]) - max([size for store, size in stored]) for stored in duplicates.values()])
+    return {
+        "checkouts": checkouts,
+        "repos": sorted(repos.values(), key=lambda repo: -repo["total_bytes"]),
+        "store_bytes": scans[shared_store.resolve()]["total"] if shared_store is not None else 0,
+        "lfs_cache_bytes": lfs_bytes,
+        "versions_bytes": versions_bytes,
+        "duplicates": {
+            "objects": len(duplicates),
+            "bytes": dedup_bytes,
+            "largest": [{"oid": oid, "path": names.get(oid), "bytes": max([size for store, size in stored]), "copies": len(stored),
+                         "stores": sorted(set([name for store, size in stored for name in stores[store][:1]]))}
+                        for oid, stored in sorted(duplicates.items(), key=lambda item: -max([size for store, size in item[1]]))[:top]],
+        },
+        "largest_files": sorted(files.values(), key=lambda entry: -entry["size"])[:top],
+        "reclaimable": {
+            "dedup": dedup_bytes,
+            "prune": sum(prunable.values()),
+            "versions": versions_bytes,
+            "lfs": max(0, lfs_bytes - int(float(Settings.get("lfs_cache_mb")) * 1024 * 1024)),
+        },
+    }
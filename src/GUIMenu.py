@@ -1,64 +1,203 @@
 #!/usr/bin/python3
-import readchar
 import re
+import shutil
+import sys
 import Terminal
+import Trace
+
+ANSI_PATTERN = re.compile(r'\033\[[0-9;]*[A-Za-z]')
+
+def strip_ansi(text: str):
+    """
+    Removes ANSI formatting codes from text.
+    param: text [str] The text to strip
+    """
+    return ANSI_PATTERN.sub('', text)
+
+def truncate_ansi(text: str, width: int):
+    """
+    Shortens text with ANSI formatting codes to a visible width, keeping the codes intact.
+    param: text [str] The text to shorten
+    param: width [int] The max number of visible characters
+    returns: (shortened text, its visible length)
+    """
+    visible = 0
+    out = []
+    last_visible = None # position in out of the last visible character
+    i = 0
+    while i < len(text):
+        match = ANSI_PATTERN.match(text, i)
+        if match: # keep formatting codes; they take no space
+            out.append(match.group(0))
+            i = match.end()
+            continue
+        if visible == width:
+            # mark text that was cut off
+            if last_visible is not None:
+                out[last_visible] = "…"
+            break
+        out.append(text[i])
+        last_visible = len(out) - 1
+        visible += 1
+        i += 1
+    return ("".join(out), visible)
 
 class GUIMenu:
     """
     Creates a text-based menu screen that prompts a user with a title message and options to select from.
-    This menu appears in the command line. 
+    This menu appears in the command line.
+    The menu is drawn as one buffered frame, and only lines that changed since the last frame are redrawn.
+    Options scroll within the height of the terminal, and typing filters them.
     """
     MENU_ORIGIN = (4,2)
     MENU_WIDTH = 70
     MENU_PADDING = 2
     MENU_ARROW = "➤"
 
-    def __init__(self, title_text: str, subtitle_text: str=None, auto_close: bool=True):
+    def __init__(self, title_text: str, subtitle_text: str=None, auto_close: bool=True, status_handler: any=None):
         """
-        Creates a GUIMenu instance. 
+        Creates a GUIMenu instance.
         param: title_text [str] The specified title
         param: subtitle_text [str] Optional subtitle text
+        param: status_handler [any] Optional function returning (status line or None, True to keep redrawing it) shown
+        at the bottom of the menu, i.e. background jobs; redrawn every second while it asks to be
         """
         self.title_text = title_text
         self.subtitle_text = subtitle_text if subtitle_text is not None else ""
-        self.arrow_index = 0 # where to start the option selector
-        self.prompts = [] # list of options' prompts and handlers 
+        self.arrow_index = 0 # where to start the option selector, within the filtered options
+        self.scroll_index = 0 # first filtered option shown in the scrolling window
+        self.prompts = [] # list of options' prompts and handlers
+        self.search_index = [] # text of each option without ANSI codes, lowercased for filtering
+        self.filter_text = "" # typed text options are filtered by
+        self.last_frame = None # lines drawn on screen by the last frame; None to redraw everything
         self.auto_close = auto_close
+        self.status_handler = status_handler
+        self.live = False # redraw the status line until a key is pressed
         Terminal.Screen.clear_screen() # clear the screen for the menu
         self.run_flag = True # runs the menu when true
 
-    def add_option(self, option_text: str, handler: any, arg_supplier_handler: any=None):
+    def add_option(self, option_text: str, handler: any, arg_supplier_handler: any=None, option_value: str=None):
         """
         Creates and adds an option to the menu. An option prompts with text. When selected, the option calls a
-        handler function that can have arguments passed in from a supplier. 
-        param: option_text [str] The text shown on the menu 
+        handler function that can have arguments passed in from a supplier.
+        param: option_text [str] The text shown on the menu
         param: handler [any] The function to call when the option is selected
         param: arg_supplier_handler [any] An optional arg that gets the arguments to pass into the handler
+        param: option_value [str] An optional value returned by run when this option is selected instead of its text
         """
-        self.prompts.append((option_text, handler, arg_supplier_handler))
+        self.prompts.append((option_text, handler, arg_supplier_handler, option_value))
+        self.search_index.append(strip_ansi(option_text).lower())
 
-    def print_line(self, line: str, padding: int, margin: int, content_width: int=MENU_WIDTH):
+    def set_option_text(self, index: int, option_text: str):
         """
-        Prints a formatted line of the GUI menu.
+        Changes the text of an option, i.e. once information shown on it is ready. Safe to call from another thread;
+        the menu shows it on its next redraw.
+        param: index [int] Index of the option, in the order options were added
+        param: option_text [str] The new text
+        """
+        self.prompts[index] = (option_text,) + self.prompts[index][1:]
+        self.search_index[index] = strip_ansi(option_text).lower()
+
+    def format_line(self, line: str, padding: int, margin: int, content_width: int=MENU_WIDTH):
+        """
+        Formats a line of the GUI menu, shortening it to fit inside the borders.
         param: line [str] The text to format
         param: padding [int] The amount of whitespace padding inside borders
         param: margin [int] The amount of whitespace outside borders
-        param: content_width [int] Width of the main text area (default 80)
+        param: content_width [int] Width of the main text area (default 70)
         """
         # padding and margin spaces
         padding_str = " " * padding
         margin_str = " " * margin
-        # insert padding into content
-        content = f"{padding_str}{line}{padding_str}"
-        # get content len without ascii
-        actual_line_length = len(re.sub(r'\033\[[0-9;]*m', '', content))
-        whitespace = " " * (content_width - actual_line_length) # whitespace to add for ljust
-
         # insert text into fixed length content area
-        content = content + whitespace
+        text, text_length = truncate_ansi(line, max(0, content_width - 2*padding))
+        whitespace = " " * (content_width - 2*padding - text_length) # whitespace to add for ljust
+        content = f"{padding_str}{text}{Terminal.Text.RESET}{whitespace}{padding_str}"
         # add borders
-        formatted_line = f"{margin_str}||{content}||{margin_str}"
-        print(formatted_line)
+        return f"{margin_str}||{content}||{margin_str}"
+
+    def print_line(self, line: str, padding: int, margin: int, content_width: int=MENU_WIDTH):
+        """
+        Prints a formatted line of the GUI menu.
+        param: line [str] The text to format
+        param: padding [int] The amount of whitespace padding inside borders
+        param: margin [int] The amount of whitespace outside borders
+        param: content_width [int] Width of the main text area (default 70)
+        """
+        print(self.format_line(line, padding, margin, content_width))
+
+    def filtered_indices(self):
+        """
+        Gets the indices of the options matching the typed filter text.
+        """
+        if len(self.filter_text) == 0:
+            return list(range(0, len(self.prompts)))
+        filter_text = self.filter_text.lower()
+        return [i for i in range(0, len(self.prompts)) if filter_text in self.search_index[i]]
+
+    def window_height(self, header_height: int):
+        """
+        Gets how many options fit on screen below the header and above the footer.
+        param: header_height [int] Number of lines above the options
+        """
+        terminal_rows = shutil.get_terminal_size(fallback=(80, 24)).lines
+        return max(3, terminal_rows - header_height - 3) # footer lines and the cursor line
+
+    def build_frame(self, indices: list):
+        """
+        Builds the lines of a full frame of the menu.
+        param: indices [list] Indices of the options to show
+        """
+        separator = "=" * GUIMenu.MENU_WIDTH
+        margin = GUIMenu.MENU_ORIGIN[0]
+        frame = [""] * (GUIMenu.MENU_ORIGIN[1] + 1) # offset to menu origin
+        frame.append(self.format_line(line=separator, padding=0, margin=margin))
+        # title and subtitle
+        frame.append(self.format_line(line=f"{Terminal.Text.BLUE}{Terminal.Text.BOLD}{self.title_text}{Terminal.Text.END}{Terminal.Text.RESET}", padding=GUIMenu.MENU_PADDING, margin=margin))
+        frame.append(self.format_line(line=f"{Terminal.Text.CYAN}{self.subtitle_text}{Terminal.Text.RESET}", padding=GUIMenu.MENU_PADDING, margin=margin))
+        frame.append(self.format_line(line=separator, padding=0, margin=margin))
+        extra_status, self.live = self.status_handler() if self.status_handler is not None else (None, False)
+        # keep the selector arrow inside the scrolling window
+        height = self.window_height(len(frame) + (1 if extra_status is not None else 0))
+        if self.arrow_index < self.scroll_index:
+            self.scroll_index = self.arrow_index
+        elif self.arrow_index >= self.scroll_index + height:
+            self.scroll_index = self.arrow_index - height + 1
+        self.scroll_index = max(0, min(self.scroll_index, len(indices) - height))
+        # rows of options
+        for position in range(self.scroll_index, min(len(indices), self.scroll_index + height)):
+            selector = f"{Terminal.Text.BOLD}{GUIMenu.MENU_ARROW}" if position == self.arrow_index else ""
+            selector = selector.ljust(3)
+            prompt = f"{' '*4 if position == self.arrow_index else ''}{self.prompts[indices[position]][0]}"
+            frame.append(self.format_line(line=f"{selector}{prompt}{Terminal.Text.END}", padding=GUIMenu.MENU_PADDING, margin=margin))
+        # filter and scroll position
+        status = f"{Terminal.Text.GREY}type to filter{Terminal.Text.RESET}" if len(self.filter_text) == 0 else f"{Terminal.Text.YELLOW}filter: {self.filter_text}{Terminal.Text.RESET}"
+        if len(indices) > height or len(self.filter_text) > 0:
+            status += f"{Terminal.Text.GREY}  ({self.scroll_index + 1 if len(indices) > 0 else 0}-{min(len(indices), self.scroll_index + height)} of {len(indices)}){Terminal.Text.RESET}"
+        frame.append(self.format_line(line=status, padding=GUIMenu.MENU_PADDING, margin=margin))
+        if extra_status is not None:
+            frame.append(self.format_line(line=extra_status, padding=GUIMenu.MENU_PADDING, margin=margin))
+        frame.append(self.format_line(line=separator, padding=0, margin=margin))
+        return frame
+
+    def draw(self, frame: list):
+        """
+        Draws a frame to the screen in one write, only redrawing lines that changed since the last frame.
+        The cursor is left on the line below the menu.
+        param: frame [list] The lines of the frame
+        """
+        buffer = []
+        for row, line in enumerate(frame):
+            if self.last_frame is None or row >= len(self.last_frame) or self.last_frame[row] != line:
+                buffer.append(f"\033[{row+1};1H\033[2K{line}")
+        # clear lines left over from a longer frame
+        if self.last_frame is not None:
+            for row in range(len(frame), len(self.last_frame)):
+                buffer.append(f"\033[{row+1};1H\033[2K")
+        buffer.append(f"\033[{len(frame)+1};1H")
+        sys.stdout.write("".join(buffer))
+        sys.stdout.flush()
+        self.last_frame = frame
 
     def exit(self):
         """
@@ -68,77 +207,67 @@ class GUIMenu:
 
     def run(self):
         """
-        A blocking function. This runs the menu. 
+        A blocking function. This runs the menu.
         """
-        self.run_flag = True # set run state 
-        # input from the keyboard
-        user_input = None
+        import readchar # only needed once a menu actually runs; keeps batch commands fast to start
+        self.run_flag = True # set run state
         # the last option selected from the menu
         option_selected = None
-        
-        # separator bar
-        separator = "=" * GUIMenu.MENU_WIDTH
-        
+
         # loop to run the menu
         while self.run_flag:
-            # only print the title if not done already, or an option was selected
-            if user_input is None or user_input == readchar.key.ENTER: 
-                # print offset to menu origin 
-                print("\n"*GUIMenu.MENU_ORIGIN[1])
-                # print horizontal separator
-                self.print_line(line=separator, padding=0, margin=GUIMenu.MENU_ORIGIN[0])
-                # print title and subtitle
-                self.print_line(line=f"{Terminal.Text.BLUE}{Terminal.Text.BOLD}{self.title_text}{Terminal.Text.END}{Terminal.Text.RESET}", padding=GUIMenu.MENU_PADDING, margin=GUIMenu.MENU_ORIGIN[0])
-                self.print_line(line=f"{Terminal.Text.CYAN}{self.subtitle_text}{Terminal.Text.RESET}", padding=GUIMenu.MENU_PADDING, margin=GUIMenu.MENU_ORIGIN[0])
-                # print horizontal separator
-                self.print_line(line=separator, padding=0, margin=GUIMenu.MENU_ORIGIN[0])
-                
-            # convert the prompt options names/texts into a list to print to the menu screen
-            for i in range(0, len(self.prompts)):
-                # print rows of options
-                selector = f"{Terminal.Text.BOLD}{GUIMenu.MENU_ARROW}" if i == self.arrow_index else ""
-                selector = selector.ljust(3)
-                prompt = f"{' '*4 if i == self.arrow_index else ''}{self.prompts[i][0]}"
-                row = f"{selector}{prompt}{Terminal.Text.END}"
-                self.print_line(line=row, padding=GUIMenu.MENU_PADDING, margin=GUIMenu.MENU_ORIGIN[0])
-            # print final horizontal separator
-            self.print_line(line=separator, padding=0, margin=GUIMenu.MENU_ORIGIN[0])
-
-            # loop while listening for user input from the keyboard
-            while True:
-                user_input = readchar.readkey()
-                # clamp the selector arrow and move it based on input and the list of options from the menu
-                if user_input == readchar.key.DOWN:
-                    self.arrow_index = min(self.arrow_index+1, len(self.prompts)-1)
-                    break # break to exit listening loop
-                elif user_input == readchar.key.UP:
-                    self.arrow_index = max(self.arrow_index-1, 0)
-                    break
-                # option selected; 
-                elif user_input == readchar.key.ENTER:
-                    # check for args
-                    args = self.prompts[self.arrow_index][2]
+            indices = self.filtered_indices()
+            self.arrow_index = max(0, min(self.arrow_index, len(indices)-1))
+            self.draw(self.build_frame(indices))
+
+            # listen for user input from the keyboard, keeping the status line current until a key is pressed
+            user_input = Terminal.read_key(1.0) if self.live else readchar.readkey()
+            if user_input is None:
+                continue
+            # clamp the selector arrow and move it based on input and the list of options from the menu
+            if user_input == readchar.key.DOWN:
+                self.arrow_index = min(self.arrow_index+1, len(indices)-1)
+            elif user_input == readchar.key.UP:
+                self.arrow_index = max(self.arrow_index-1, 0)
+            elif user_input == readchar.key.PAGE_DOWN:
+                self.arrow_index = min(self.arrow_index+self.window_height(0), len(indices)-1)
+            elif user_input == readchar.key.PAGE_UP:
+                self.arrow_index = max(self.arrow_index-self.window_height(0), 0)
+            # edit the filter text
+            elif user_input == readchar.key.BACKSPACE:
+                self.filter_text = self.filter_text[:-1]
+                self.arrow_index = 0
+            elif user_input == readchar.key.ESC:
+                self.filter_text = ""
+                self.arrow_index = 0
+            elif len(user_input) > 0 and user_input.isprintable(): # keys typed faster than a redraw arrive together
+                self.filter_text += user_input
+                self.arrow_index = 0
+            # option selected;
+            elif user_input in (readchar.key.ENTER, readchar.key.CR) and len(indices) > 0:
+                prompt = self.prompts[indices[self.arrow_index]]
+                # check for args
+                args = prompt[2]
+                # record commands run by the option against its handler
+                with Trace.operation(prompt[1].__name__.removeprefix("handle_")):
                     if args is None: # call option handler function without args
-                        self.prompts[self.arrow_index][1]()
+                        prompt[1]()
                     else: # call option handler function with args
                         # call args to get content
-                        self.prompts[self.arrow_index][1](args())
-                    # append choice to history of options selected
-                    option_selected = self.prompts[self.arrow_index][0]
-                    # put select/cursor arrow to the top of the menu
-                    self.arrow_index = 0
-                    break
-        
-            # clear lines of the menu options printed if an option was not selected
-            if user_input != readchar.key.ENTER:
-                Terminal.Screen.clear_line()
-                for i in range(0, len(self.prompts)+1):
-                    Terminal.Screen.move_cursor_relatively(-1,0)
-                    Terminal.Screen.clear_line()
-        
+                        prompt[1](args())
+                # append choice to history of options selected
+                option_selected = prompt[0] if prompt[3] is None else prompt[3]
+                # put select/cursor arrow to the top of the menu and clear the filter
+                self.arrow_index = 0
+                self.filter_text = ""
+                # the handler may have drawn over the menu; redraw all of it
+                if self.run_flag:
+                    Terminal.Screen.clear_screen()
+                self.last_frame = None
+
         if self.auto_close: # handle auto closing
             Terminal.Screen.clear_screen()
         # returns the menu options selected at runtime
         if option_selected.__contains__("deps:"):
             return option_selected.split(">")[0].strip()
-        return option_selected.strip()
\ No newline at end of file
+        return option_selected.strip()
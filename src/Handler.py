@@ -1,48 +1,265 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path as path
+import functools
 import sys
+import threading
+import time
 from GUIMenu import GUIMenu
 import Terminal
+import Settings
+import DependencyIndex
+import RepoStatus
+import ObjectCache
+import ChangeCache
+import CloneProfile
+import LargeFiles
+import SharedFetch
+import Workspace
+import RepoLock
+import Trace
 
 def handle_repository_dependendencies(cwd: path):
     """
-    Gets a list of the immediate dependencies associated with a given repository. Reads from .gitmodules file.
+    Gets a list of the immediate dependencies associated with a given repository. Reads from the dependency index,
+    which only parses the .gitmodules file again if it changed.
     param: cwd [path] Directory of the parent repository
     """
-    try: 
-        deps = [] # list of dependencies to collect
-        file_dir = str(cwd / path(".gitmodules"))
-        with open(file_dir, "r") as file:
-            # found the file; read it
-            for line in file:
-                # find dep / submodule url line
-                if line.startswith("	url"):
-                    # look at just the dep repo url, look at the repo name and drop .git file type
-                    dep = line.split().pop().split("/").pop().replace(".git", "")
-                    deps.append(dep) # add dep
-        # found all deps; return list 
-        return deps
-    except FileExistsError as e:
-        # file doesn't exist; return empty list
-        return []
+    try:
+        return DependencyIndex.get_dependency_names(repo_dir=cwd)
     except Exception as e:
         # handle all other errors
         return []
 
 
+def changes_push_bash_cmds(commit_message: str, repo_dir: path, changes: list=None):
+    """
+    Gets the bash commands that commit the real changes of a repository and push it to GitHub. Only files whose
+    content changed are staged; if nothing changed, nothing is committed.
+    param: commit_message [str] The commit message
+    param: repo_dir [path] Directory of the repository
+    param: changes [list] Optional changes from ChangeCache.changed_files, if already found
+    """
+    if changes is None:
+        LargeFiles.track(repo_dir)
+        changes = ChangeCache.changed_files(repo_dir)[0]
+    bash_cmds = ChangeCache.stage_bash_cmds(changes)
+    if len(changes) > 0:
+        bash_cmds.append(["git", "commit", "-m", commit_message])
+    bash_cmds.append(["git", "push"])
+    return bash_cmds
+
+def push_bash_cmds(commit_message: str):
+    """
+    Gets a function of a repository directory that returns the bash commands that commit its real changes and push
+    it to GitHub.
+    param: commit_message [str] The commit message
+    """
+    # a partial, unlike a closure, can be sent to a process pool
+    return functools.partial(changes_push_bash_cmds, commit_message)
+
+def create_dependency_bash_cmds(dep_repo_url: str, dep_repo: str, parent_repo: str):
+    """
+    Gets the bash commands, run in the parent repository, that add a dependency and push the parent to GitHub.
+    param: dep_repo_url [str] The remote URL of the dependency repository
+    param: dep_repo [str] Name of the dependency repository
+    param: parent_repo [str] Name of the parent repository
+    """
+    return [
+        ["git"] + LargeFiles.config_args() + ["submodule", "add"] + ObjectCache.reference_args() + [dep_repo_url, f"{path('dep') / path(dep_repo)}"],
+        ["git", "commit", "-am", f"Created {dep_repo} as a submodule/dependency to {parent_repo}"],
+        ["git", "push"]]
+
 def handle_github_current_working_directory():
     """
-    Gets the current working directory of where local GitHub repositories are found.
+    Gets the current working directory of where local GitHub repositories are found: the first workspace root, where
+    new repositories are cloned. Repositories under the other roots are found through it too.
     """
-    cwd = path.home() / "Documents" / "GitHub"
+    cwd = Workspace.roots()[0]
     cwd.mkdir(parents=True, exist_ok=True)
     return cwd
 
+def handle_local_repositories(cwd: path):
+    """
+    Gets the directories of every locally cloned repository under the workspace roots, from the repository index.
+    param: cwd [path] The GitHub current working directory
+    """
+    return Workspace.repositories(cwd)
+
+def handle_repository_lock(repo_dirs: list, holder: str):
+    """
+    Locks repositories and every dependency checked out inside them for an operation run from the menu, so it waits
+    for background jobs and batch commands working on any of them instead of running git alongside them.
+    param: repo_dirs [list] Directories of the repositories or dependency checkouts
+    param: holder [str] What is taking the locks, i.e. "push Main"
+    returns: the locks, to use in a with statement
+    """
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    waited = [] # holders of locks waited on, to only say so once
+
+    def on_wait(lock_holder: str):
+        if len(waited) == 0:
+            print(f"{margin}{Terminal.Text.YELLOW}Waiting for {lock_holder} to finish...{Terminal.Text.RESET}")
+        waited.append(lock_holder)
+
+    return RepoLock.repositories(repo_dirs, holder, on_wait=on_wait)
+
+def handle_repository_bash_cmds(repo_dir: path, bash_cmds: list):
+    """
+    Runs a list of bash commands on a single repository, stopping at the first command that fails.
+    This runs quietly so it can be used from a worker pool.
+    param: repo_dir [path] Directory of the repository
+    param: bash_cmds [list] The list of bash commands to run, or a function of the repository directory that returns it
+    returns: (repo name, succeeded, failed command, error text, seconds taken)
+    """
+    start_time = time.perf_counter()
+    if callable(bash_cmds):
+        bash_cmds = bash_cmds(repo_dir)
+    for cmd in bash_cmds:
+        result = Terminal.run_bash_cmd(cmd, cwd=repo_dir, verbose=False)
+        # a command failed; stop here and report it
+        if result is None or result.returncode != 0:
+            err_text = result.stderr.strip() if result is not None else ""
+            return (repo_dir.name, False, " ".join(cmd), err_text, time.perf_counter() - start_time)
+    return (repo_dir.name, True, None, "", time.perf_counter() - start_time)
+
+def handle_parallel_repositories(repo_dirs: list, bash_cmds: list, pool_type: str=None, max_workers: int=None, verbose: bool=True, should_stop: any=None, on_progress: any=None):
+    """
+    Runs the same list of bash commands on many repositories at once using a bounded worker pool.
+    Progress is printed as each repository finishes.
+    param: repo_dirs [list] Directories of the repositories
+    param: bash_cmds [list] The list of bash commands to run on each repository, or a function of the repository directory that returns it
+    param: pool_type [str] Optional "thread" or "process" pool; defaults to the pool_type setting
+    param: max_workers [int] Optional max number of repositories worked on at once; defaults to the pool_workers setting
+    param: verbose [bool] Optional to indicate if progress should be printed
+    param: should_stop [any] Optional function returning True to stop, i.e. a cancelled job; repositories not started
+    yet are left out with a "cancelled" error, and the ones running finish
+    param: on_progress [any] Optional function called with a short progress text as each repository finishes
+    returns: list of results from handle_repository_bash_cmds, in the order repositories finished
+    """
+    pool_type = pool_type if pool_type is not None else Settings.get("pool_type")
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    executor_type = ThreadPoolExecutor
+    if pool_type == "process":
+        from concurrent.futures import ProcessPoolExecutor # loads multiprocessing; only when asked for
+        executor_type = ProcessPoolExecutor
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    results = []
+    if len(repo_dirs) == 0:
+        return results
+    if verbose:
+        print(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.UNDERLINE}Running commands on {len(repo_dirs)} repositories with {max_workers} {pool_type} workers:{Terminal.Text.RESET}")
+    with executor_type(max_workers=max_workers, **Trace.pool_args()) as executor:
+        futures = {executor.submit(handle_repository_bash_cmds, repo_dir, bash_cmds): repo_dir for repo_dir in repo_dirs}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e: # the worker itself failed, or was cancelled before it started
+                result = (futures[future].name, False, None, "cancelled" if future.cancelled() else str(e), 0.0)
+            results.append(result)
+            if on_progress is not None:
+                on_progress(f"{len(results)}/{len(repo_dirs)} {result[0]}")
+            if should_stop is not None and should_stop():
+                for other in futures:
+                    other.cancel()
+            if not verbose:
+                continue
+            # print live progress for the finished repo
+            repo_name, succeeded, failed_cmd, err_text, elapsed = result
+            count = f"[{len(results):>{len(str(len(repo_dirs)))}}/{len(repo_dirs)}]"
+            if succeeded:
+                print(f"{margin}{count} {Terminal.Text.GREEN}done{Terminal.Text.RESET}   {repo_name} {Terminal.Text.GREY}({elapsed:.1f}s){Terminal.Text.RESET}")
+            else:
+                err_line = err_text.splitlines()[-1] if len(err_text) > 0 else ""
+                print(f"{margin}{count} {Terminal.Text.RED}failed{Terminal.Text.RESET} {repo_name} {Terminal.Text.GREY}({elapsed:.1f}s){Terminal.Text.RESET} {failed_cmd}: {err_line}")
+    return results
+
+def handle_pull_repositories(repo_dirs: list, pool_type: str=None, max_workers: int=None, verbose: bool=True, should_stop: any=None, on_progress: any=None):
+    """
+    Pulls many repositories and their dependencies at once. Repositories are pulled first, then every dependency they
+    pin is fetched with each remote URL fetched only once, however many parents share it, and then dependencies are
+    checked out.
+    param: repo_dirs [list] Directories of the repositories
+    param: pool_type [str] Optional "thread" or "process" pool; defaults to the pool_type setting
+    param: max_workers [int] Optional max number of repositories worked on at once; defaults to the pool_workers setting
+    param: verbose [bool] Optional to indicate if progress should be printed
+    param: should_stop [any] Optional function returning True to stop, i.e. a cancelled job; checked as each
+    repository finishes and between steps
+    param: on_progress [any] Optional function called with a short text of the step running and how far it got
+    returns: list of results from handle_repository_bash_cmds, in the order repositories finished
+    """
+    should_stop = should_stop if should_stop is not None else lambda: False
+    on_progress = on_progress if on_progress is not None else lambda text: None
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    results = handle_parallel_repositories(repo_dirs, CloneProfile.pull_parent_bash_cmds, pool_type, max_workers, verbose, should_stop, lambda text: on_progress(f"pulled {text}"))
+    if should_stop():
+        # pulled repositories keep their dependencies at the versions they were at
+        return [result if not result[1] else (result[0], False, None, "cancelled before checking out dependencies", result[4]) for result in results]
+    pulled_names = set([result[0] for result in results if result[1]])
+    pulled = [repo_dir for repo_dir in repo_dirs if repo_dir.name in pulled_names]
+    on_progress("fetching shared dependencies")
+    urls = SharedFetch.prefetch(pulled, max_workers)
+    if verbose:
+        print(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.UNDERLINE}Fetched {urls} shared dependency remotes once each; checking out dependencies:{Terminal.Text.RESET}")
+    # add the time each repository took to check out its dependencies
+    elapsed = dict([(result[0], result[4]) for result in results])
+    results = [result for result in results if not result[1]]
+    for repo_name, succeeded, failed_cmd, err_text, dep_elapsed in handle_parallel_repositories(pulled, CloneProfile.pull_dependencies_bash_cmds, pool_type, max_workers, verbose, should_stop, lambda text: on_progress(f"checked out dependencies {text}")):
+        results.append((repo_name, succeeded, failed_cmd, err_text, elapsed[repo_name] + dep_elapsed))
+    if should_stop():
+        return results
+    on_progress("downloading large files")
+    # download the large files of every checkout at once; checkouts that fail are reported on their own
+    lfs_results = LargeFiles.pull_repositories([repo_dir for repo_dir in pulled if repo_dir.name in set([result[0] for result in results if result[1]])], max_workers)
+    if verbose and len(lfs_results) > 0:
+        print(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.UNDERLINE}Downloaded large files of {len(lfs_results)} checkouts{Terminal.Text.RESET}")
+    results += [result for result in lfs_results if not result[1]]
+    return results
+
+def handle_repository_rows(cwd: path, ignore_repos: list=None, allow_repos: list=None, cached_status: bool=False):
+    """
+    Builds the menu rows of the local repositories, with their status and dependencies.
+    param: cwd [path] The GitHub current working directory
+    param: ignore_repos [list] Optional list of repos to leave out
+    param: allow_repos [list] Optional list of repos allowed; found repos not in this list are left out if the list is not None
+    param: cached_status [bool] Optional to show the last known status of each repo without running git
+    returns: list of (repo name, repo directory, row text)
+    """
+    rows = []
+    repo_dirs = Workspace.repositories(cwd)
+    # refresh the dependency index once for all rows
+    DependencyIndex.refresh(cwd, repo_dirs)
+    # get the status of every repo in parallel; unchanged repos come from the status cache
+    if not Settings.get("show_status"):
+        repo_statuses = {}
+    elif cached_status:
+        repo_statuses = RepoStatus.cached_statuses(repo_dirs)
+    else:
+        repo_statuses = RepoStatus.get_statuses(repo_dirs)
+    # step through the list of locally cloned repos
+    for item in repo_dirs:
+        # check if repo is in the set of ignored repos; if this set exist and contains the repo it should be ignored
+        in_ignored = ignore_repos is not None and ignore_repos.__contains__(item.name)
+        # check if repo is in the set of allowed; if the allowed set exists, make sure it is in it
+        in_allowed = allow_repos is None or allow_repos.__contains__(item.name)
+        # ignore repos to ignore (if any), and ensure they are in the set of allowed if it exsists
+        if in_ignored or not in_allowed:
+            continue # skip
+        # get the name of a cloned repo
+        local_repo = item.name
+        repo_dir = item
+        # list of dependencies of the repo option
+        repo_deps = DependencyIndex.get_dependency_names(repo_dir=repo_dir, refresh_entry=False)
+        row_deps = f"> {Terminal.Text.CYAN}deps: {Terminal.Text.CYAN}{repo_deps}{Terminal.Text.END}" if len(repo_deps) > 0 else ""
+        row_status = RepoStatus.format_status(repo_statuses.get(item))
+        rows.append((local_repo, repo_dir, f"{local_repo} {row_status} {row_deps}"))
+    return rows
+
 def handle_repository_menu(cwd: path, menu_title: str, bash_cmds: list, success_msg: str, err_msg: str, pause_prompt: bool=True, subtitle_text: str=None, ignore_repos: list=None, allow_repos: list=None, auto_close: bool=True):
     """
     Handles creating a menu listing local repositories as options.
     param: cwd [str] The GitHub current working directory
     param: menu_title [str] The title of the menu
-    param: bash_cmds [list] The list of bash commands to run
+    param: bash_cmds [list] The list of bash commands to run, or a function of the repository directory that returns it
     param: success_msg [str] The message to print if bash succeeds
     param: err_msg [str] The message to print if bash fails
     param: pause_prompt [bool] Optional to indicate if user should be paused and prompted with a status after running the bash commands
@@ -51,7 +268,32 @@ def handle_repository_menu(cwd: path, menu_title: str, bash_cmds: list, success_
     param: allow_repos [list] Optional list of repos allowed in the menu; found repos not in this list are ignored if the list is not None
     """
     root_dir = cwd # the root of locally cloned repos from the cwd
-    local_repo_menu = GUIMenu(title_text=menu_title, subtitle_text=subtitle_text, auto_close=auto_close) # create the menu
+    # rows are drawn with the last known status first, then redrawn once every repo has been checked again
+    rows = handle_repository_rows(cwd=root_dir, ignore_repos=ignore_repos, allow_repos=allow_repos, cached_status=True)
+    refreshed = threading.Event()
+
+    def handle_refresh():
+        """
+        Checks the status of every listed repo again and updates their rows.
+        """
+        try:
+            if Settings.get("show_status"):
+                new_rows = dict([(repo_dir, row) for local_repo, repo_dir, row in handle_repository_rows(cwd=root_dir, ignore_repos=ignore_repos, allow_repos=allow_repos)])
+                for index, (local_repo, repo_dir, row) in enumerate(rows):
+                    if repo_dir in new_rows:
+                        local_repo_menu.set_option_text(index, new_rows[repo_dir])
+        finally:
+            refreshed.set()
+
+    def handle_status():
+        """
+        Gets the status line of the menu, keeping it redrawn until the rows are refreshed.
+        """
+        if refreshed.is_set():
+            return (None, False)
+        return (f"{Terminal.Text.GREY}checking status...{Terminal.Text.RESET}", True)
+
+    local_repo_menu = GUIMenu(title_text=menu_title, subtitle_text=subtitle_text, auto_close=auto_close, status_handler=handle_status) # create the menu
 
     def handle_go_back():
         """
@@ -59,33 +301,22 @@ def handle_repository_menu(cwd: path, menu_title: str, bash_cmds: list, success_
         """
         local_repo_menu.exit()
 
-    import time
-    # step through the list of locally cloned repos
-    for item in root_dir.iterdir():
-        # check if repo is in the set of ignored repos; if this set exist and contains the repo it should be ignored
-        in_ignored = ignore_repos is not None and ignore_repos.__contains__(item.name)
-        # check if repo is in the set of allowed; if the allowed set exists, make sure it is in it
-        in_allowed = allow_repos is None or allow_repos.__contains__(item.name)
-        # ignore non-dirs, repos to ignore (if any), and ensure they are in the set of allowed if it exsists
-        if not (item.is_dir() and not in_ignored and in_allowed):
-            continue # skip
-        # get the name of a cloned repo
-        local_repo = item.name
-        repo_dir = cwd / path(local_repo)
-        # list of dependencies of the repo option
-        repo_deps = handle_repository_dependendencies(cwd=repo_dir)
-        row_deps = f"> {Terminal.Text.CYAN}deps: {Terminal.Text.CYAN}{repo_deps}{Terminal.Text.END}" if len(repo_deps) > 0 else ""
-        row = f"{local_repo} {row_deps}" 
+    # step through the rows of locally cloned repos
+    for local_repo, repo_dir, row in rows:
         def handle_bash_cmd(repo_name=local_repo, repo_dir=repo_dir):
             """
             Handles the bash command for for the local repo.
             """
             margin = " " * GUIMenu.MENU_ORIGIN[0]
+            refreshed.wait() # git status may be refreshing the index
             print(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.UNDERLINE}Running commands:{Terminal.Text.RESET}")
-            try: # attempt to run bash with the repo dir
-                for cmd in bash_cmds:
-                    # bash does not yet know which repo and where
-                    Terminal.run_bash_cmd(cmd, cwd=repo_dir) # run bash command
+            import asyncio # only needed by the menu; keeps batch commands fast to start
+            try: # attempt to run bash with the repo dir, streaming its output
+                cmds = bash_cmds(repo_dir) if callable(bash_cmds) else bash_cmds
+                with handle_repository_lock([repo_dir] if len(cmds) > 0 else [], f"menu on {repo_name}"):
+                    results = asyncio.run(Terminal.run_bash_cmds_async(cmds, cwd=repo_dir, timeout=Settings.get("command_timeout")))
+                if len(results) > 0 and not results[-1].ok:
+                    raise RuntimeError(f"{' '.join(results[-1].args)} exited with {results[-1].returncode}")
                 if pause_prompt:
                     input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}{success_msg}{Terminal.Text.RESET} Press enter to continue.\n")
             except: # handle failed bash command
@@ -95,10 +326,13 @@ def handle_repository_menu(cwd: path, menu_title: str, bash_cmds: list, success_
             local_repo_menu.exit()
 
         # add option to the menu for the cloned repo
-        local_repo_menu.add_option(row, handle_bash_cmd)
+        local_repo_menu.add_option(row, handle_bash_cmd, option_value=local_repo)
     
     # add final option to the menu to exit
     local_repo_menu.add_option(f"{Terminal.Text.YELLOW}<GO BACK>{Terminal.Text.END}", handle_go_back)
-    # run menu and return last option selected
-    return local_repo_menu.run() 
+    threading.Thread(target=handle_refresh, daemon=True).start()
+    # run menu and return last option selected, once nothing runs git in the background; callers run git on it next
+    option_selected = local_repo_menu.run()
+    refreshed.wait()
+    return option_selected
    
\ No newline at end of file
@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path as path
+import threading
+import time
+import Terminal
+import Settings
+import Trace
+import RepoLock
+
+# Runs menu operations as background jobs, so the menu stays usable while pulls, pushes, restores and updates run.
+# Jobs are queued and run a few at a time on a worker pool (the jobs_workers setting). Each job holds the locks of its
+# repositories and every dependency checked out inside them while it runs, so jobs touching the same checkouts run
+# one after another while jobs on unrelated repositories run at once.
+#
+# Jobs running git through run_bash_cmds stream their last line of output as progress, and cancelling one kills the
+# command it is running. Other jobs pass job.cancelled and job.set_progress to what they run, which stops at its next
+# step once cancelled and lets commands already running finish. Failed and cancelled jobs can be retried.
+
+QUEUED = "queued"
+WAITING = "waiting" # started, but another job or GitCAD process holds some of its repositories
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+STATUS_COLORS = {QUEUED: Terminal.Text.GREY, WAITING: Terminal.Text.YELLOW, RUNNING: Terminal.Text.BLUE,
+                 DONE: Terminal.Text.GREEN, FAILED: Terminal.Text.RED, CANCELLED: Terminal.Text.GREY}
+
+_lock = threading.Lock() # guards the list of jobs and the worker pool
+_jobs = [] # every job of this session, oldest first
+_executor = None # worker pool, started with the first job
+_next_id = 1 # id of the next job
+
+class Job:
+    """
+    An operation queued to run in the background on some repositories.
+    """
+    def __init__(self, job_id: int, operation: str, name: str, repo_dirs: list, call: any):
+        """
+        Creates a job.
+        param: job_id [int] Number of the job, unique in this session
+        param: operation [str] Name commands are recorded against in the trace, i.e. pull_repository
+        param: name [str] What the job does as shown to people, i.e. "pull Main"
+        param: repo_dirs [list] Directories of the repositories it locks
+        param: call [any] Function of the job that does the work and returns (succeeded, detail text)
+        """
+        self.id = job_id
+        self.operation = operation
+        self.name = name
+        self.repo_dirs = repo_dirs
+        self.call = call
+        self.status = QUEUED
+        self.progress = "" # last line of output, or what the job waits on
+        self.detail = "" # result or error text once finished
+        self.queued = time.time()
+        self.started = None
+        self.ended = None
+        self.stop_event = threading.Event()
+
+    def cancel(self):
+        """
+        Asks the job to stop. A queued or waiting job never starts; a running one stops at its current command.
+        """
+        self.stop_event.set()
+
+    def set_progress(self, text: str):
+        """
+        Shows what the job is doing, i.e. as the on_progress function of what it runs.
+        param: text [str] Short progress text
+        """
+        self.progress = text
+
+    def cancelled(self):
+        """
+        Checks if the job was asked to stop.
+        """
+        return self.stop_event.is_set()
+
+    def finished(self):
+        """
+        Checks if the job is done, failed or cancelled.
+        """
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def seconds(self):
+        """
+        Gets how long the job has been running, or ran.
+        """
+        if self.started is None:
+            return 0.0
+        return (self.ended or time.time()) - self.started
+
+def submit(operation: str, name: str, repo_dirs: list, call: any):
+    """
+    Queues a job to run in the background.
+    param: operation [str] Name commands are recorded against in the trace, i.e. pull_repository
+    param: name [str] What the job does as shown to people, i.e. "pull Main"
+    param: repo_dirs [list] Directories of the repositories the job works on, locked while it runs
+    param: call [any] Function of the job that does the work and returns (succeeded, detail text); it should check
+    job.cancelled() between steps
+    returns: the Job
+    """
+    global _executor, _next_id
+    with _lock:
+        job = Job(_next_id, operation, name, [path(repo_dir) for repo_dir in repo_dirs], call)
+        _next_id += 1
+        _jobs.append(job)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, int(Settings.get("jobs_workers"))), thread_name_prefix="gitcad-job")
+        _executor.submit(run, job)
+    return job
+
+def run(job: Job):
+    """
+    Runs a job on a worker thread once its repositories are free.
+    param: job [Job] The job
+    """
+    if job.cancelled():
+        job.status, job.ended = CANCELLED, time.time()
+        return
+
+    def on_wait(holder: str):
+        job.status, job.progress = WAITING, f"waiting for {holder}"
+
+    try:
+        with RepoLock.repositories(job.repo_dirs, job.name, should_stop=job.cancelled, on_wait=on_wait):
+            job.status, job.started, job.progress = RUNNING, time.time(), ""
+            with Trace.background(job.operation, foreground=True):
+                succeeded, job.detail = job.call(job)
+        job.status = DONE if succeeded else CANCELLED if job.cancelled() else FAILED
+    except RepoLock.Busy as e:
+        job.status = CANCELLED
+    except Exception as e: # the job itself failed
+        job.status, job.detail = FAILED, str(e)
+    job.ended = time.time()
+
+def run_bash_cmds(job: Job, repo_dir: path, bash_cmds: list):
+    """
+    Runs bash commands for a job, stopping at the first one that fails or once the job is cancelled, which kills the
+    command running. Each line of output becomes the job's progress.
+    param: job [Job] The job
+    param: repo_dir [path] Directory the commands run in
+    param: bash_cmds [list] The commands, or a function of the directory that returns them
+    returns: (succeeded, detail text)
+    """
+    import asyncio # only loaded once a job runs commands
+    if callable(bash_cmds):
+        bash_cmds = bash_cmds(repo_dir)
+    timeout = Settings.get("command_timeout")
+
+    def on_line(name: str, line: str):
+        job.progress = line.strip()
+
+    async def run_cmd(cmd: list):
+        task = asyncio.ensure_future(Terminal.run_bash_cmd_async(cmd, cwd=repo_dir, timeout=timeout, on_line=on_line, verbose=False))
+        while not task.done():
+            await asyncio.wait([task], timeout=0.2)
+            if job.cancelled() and not task.done():
+                task.cancel() # kills the command
+                try:
+                    await task
+                except asyncio.CancelledError as e:
+                    pass
+                return None
+        return task.result()
+
+    for cmd in bash_cmds:
+        if job.cancelled():
+            return (False, "cancelled")
+        result = asyncio.run(run_cmd(cmd))
+        if result is None:
+            return (False, f"cancelled during {' '.join(cmd)}")
+        if not result.ok:
+            err_text = result.stderr.strip().splitlines()
+            return (False, f"{' '.join(cmd)}: {err_text[-1] if len(err_text) > 0 else 'timed out' if result.timed_out else ''}")
+    return (True, "")
+
+def retry(job: Job):
+    """
+    Queues a failed or cancelled job again.
+    param: job [Job] The job
+    returns: the new Job, or None if the job has not failed or been cancelled
+    """
+    if job.status not in (FAILED, CANCELLED):
+        return None
+    return submit(job.operation, job.name, job.repo_dirs, job.call)
+
+def jobs():
+    """
+    Gets every job of this session, oldest first.
+    """
+    with _lock:
+        return list(_jobs)
+
+def active():
+    """
+    Gets the jobs that are queued, waiting or running.
+    """
+    return [job for job in jobs() if not job.finished()]
+
+def clear_finished():
+    """
+    Forgets the jobs that are done, failed or cancelled.
+    returns: number of jobs forgotten
+    """
+    with _lock:
+        finished = [job for job in _jobs if job.finished()]
+        for job in finished:
+            _jobs.remove(job)
+    return len(finished)
+
+def cancel_all():
+    """
+    Asks every job that has not finished to stop.
+    """
+    for job in active():
+        job.cancel()
+
+def status_line():
+    """
+    Gets a short colored summary of the jobs for the bottom of a menu.
+    returns: (the summary, or None if there are no jobs; True while any job has not finished)
+    """
+    counts = {}
+    for job in jobs():
+        counts[job.status] = counts.get(job.status, 0) + 1
+    if len(counts) == 0:
+        return (None, False)
+    parts = [f"{STATUS_COLORS[status]}{counts[status]} {status}{Terminal.Text.RESET}" for status in (RUNNING, WAITING, QUEUED, FAILED, CANCELLED, DONE) if status in counts]
+    return (f"jobs: {', '.join(parts)}", any([status in counts for status in (QUEUED, WAITING, RUNNING)]))
+
+def format_job(job: Job):
+    """
+    Formats a job as one colored line: its status, name, time taken and progress or result.
+    param: job [Job] The job
+    """
+    seconds = f"{job.seconds():.0f}s" if job.started is not None else ""
+    text = job.detail if job.finished() and len(job.detail) > 0 else job.progress
+    return f"{STATUS_COLORS[job.status]}{job.status:<9}{Terminal.Text.RESET} {job.name} {Terminal.Text.GREY}{seconds} {text}{Terminal.Text.RESET}"
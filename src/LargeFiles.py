@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path as path
+import os
+import threading
+import time
+import Terminal
+import Settings
+import Trace
+
+# Stores CAD files in Git LFS, so history and clones do not grow with every revision of every part. Files with an
+# extension in the lfs_extensions setting are tracked in each repository's .gitattributes when it is pushed.
+#
+# Every repository and dependency checkout keeps its LFS files in one shared cache, ~/.gitcad/lfs (git's
+# lfs.storage), so a file used by many parents is downloaded and stored once. The cache is kept under lfs_cache_mb by
+# dropping the least recently used files that no checkout has checked out, staged or still has to push.
+#
+# Clones and pulls check out pointer files first and then download the real files of every checkout at once. Nothing
+# here runs if git-lfs is not installed or the lfs setting is off.
+
+_lock = threading.Lock() # guards the availability check
+_available = None # if git-lfs is installed, once checked
+POINTER_VERSION = "https://git-lfs.github.com/spec/v1" # the LFS pointer format written by git-lfs
+
+def installed():
+    """
+    Checks if git-lfs is installed. Only checked once.
+    """
+    global _available
+    with _lock:
+        if _available is None:
+            result = Terminal.run_bash_cmd(["git", "lfs", "version"], verbose=False)
+            _available = result is not None and result.returncode == 0
+        return _available
+
+def available():
+    """
+    Checks if large files should be stored with LFS: the lfs setting is on and git-lfs is installed.
+    """
+    return bool(Settings.get("lfs")) and installed()
+
+def cache_dir():
+    """
+    Gets the shared LFS cache every checkout stores its large files in.
+    """
+    return Settings.settings_dir() / "lfs"
+
+def config_args(skip_smudge: bool=False):
+    """
+    Gets the git -c args that make a git command, and the git commands it starts, store large files in the shared
+    cache.
+    param: skip_smudge [bool] Optional to check out pointer files instead of downloading large files one at a time;
+    they are downloaded afterwards with pull_repositories
+    returns: the args to put right after "git", or no args if LFS is not used
+    """
+    if not available():
+        return []
+    args = ["-c", f"lfs.storage={cache_dir()}", "-c", f"lfs.concurrenttransfers={max(1, int(Settings.get('lfs_transfers')))}"]
+    if Settings.get("lfs_url"):
+        args += ["-c", f"lfs.url={Settings.get('lfs_url')}"]
+    if skip_smudge:
+        args += ["-c", "filter.lfs.smudge=git-lfs smudge --skip -- %f", "-c", "filter.lfs.process=git-lfs filter-process --skip"]
+    return args
+
+def attribute_pattern(extension: str):
+    """
+    Gets a .gitattributes pattern matching an extension in any case, i.e. *.[sS][tT][eE][pP] for step.
+    param: extension [str] The extension, with or without the dot
+    """
+    return "*." + "".join([f"[{char.lower()}{char.upper()}]" if char.isalpha() else char for char in extension.lstrip(".")])
+
+def prepare(checkout: path):
+    """
+    Sets a repository or dependency checkout up for LFS: installs the hooks that upload large files on push, and points
+    it at the shared cache and the configured LFS server. Checkouts already set up are left alone.
+    param: checkout [path] Directory of the checkout
+    returns: True if the checkout is set up
+    """
+    if not available():
+        return False
+    args = config_args()
+    wanted = dict([args[i+1].split("=", 1) for i in range(0, len(args), 2)])
+    result = Terminal.run_bash_cmd(["git", "config", "--local", "--get-regexp", r"^(lfs\.(storage|concurrenttransfers|url)|filter\.lfs\.process)$"], cwd=checkout, verbose=False)
+    current = dict([(line.split(maxsplit=1) + [""])[:2] for line in result.stdout.splitlines()]) if result is not None and result.returncode == 0 else {}
+    bash_cmds = [] if "filter.lfs.process" in current else [["git", "lfs", "install", "--local"]]
+    bash_cmds += [["git", "config", "--local", key, value] for key, value in wanted.items() if current.get(key) != value]
+    for cmd in bash_cmds:
+        result = Terminal.run_bash_cmd(cmd, cwd=checkout, verbose=False)
+        if result is None or result.returncode != 0:
+            return False
+    return True
+
+def track(repo_dir: path):
+    """
+    Tracks the CAD extensions of the lfs_extensions setting with LFS in a repository's .gitattributes, adding only the
+    ones missing. The changed .gitattributes is pushed with the repository's other changes.
+    param: repo_dir [path] Directory of the repository or dependency checkout
+    returns: True if .gitattributes changed
+    """
+    if not prepare(repo_dir):
+        return False
+    attributes_file = repo_dir / ".gitattributes"
+    try:
+        lines = attributes_file.read_text().splitlines()
+    except OSError as e:
+        lines = []
+    patterns = set([line.split()[0] for line in lines if len(line.split()) > 0])
+    missing = [attribute_pattern(extension) for extension in Settings.get("lfs_extensions") if attribute_pattern(extension) not in patterns]
+    if len(missing) == 0:
+        return False
+    lines += [f"{pattern} filter=lfs diff=lfs merge=lfs -text" for pattern in missing]
+    attributes_file.write_text("\n".join(lines) + "\n")
+    return True
+
+def uses_lfs(checkout: path):
+    """
+    Checks if a repository or dependency checkout has any files tracked with LFS.
+    param: checkout [path] Directory of the checkout
+    """
+    try:
+        return "filter=lfs" in (checkout / ".gitattributes").read_text()
+    except OSError as e:
+        return False
+
+def pointer(oid: str, size: int):
+    """
+    Gets the LFS pointer git stores in place of a large file.
+    param: oid [str] The SHA-256 of the file's content
+    param: size [int] Size of the file in bytes
+    """
+    return f"version {POINTER_VERSION}\noid sha256:{oid}\nsize {size}\n"
+
+def pull_checkout(checkout: path, name: str):
+    """
+    Downloads the large files a checkout has checked out as pointers, into the shared cache, and checks them out.
+    This runs quietly so it can be used from a worker pool.
+    param: checkout [path] Directory of the checkout
+    param: name [str] Name of the checkout, i.e. Main/dep/StandardCAD
+    returns: (checkout name, succeeded, failed command, error text, seconds taken)
+    """
+    start_time = time.perf_counter()
+    if not prepare(checkout):
+        return (name, False, "git lfs install", "could not set up LFS", time.perf_counter() - start_time)
+    result = Terminal.run_bash_cmd(["git"] + config_args() + ["lfs", "pull"], cwd=checkout, verbose=False)
+    if result is None or result.returncode != 0:
+        return (name, False, "git lfs pull", result.stderr.strip() if result is not None else "", time.perf_counter() - start_time)
+    return (name, True, None, "", time.perf_counter() - start_time)
+
+def pull_repositories(repo_dirs: list, max_workers: int=None):
+    """
+    Downloads the large files of many repositories and every dependency checked out inside them at once, then keeps
+    the shared cache under its size limit.
+    param: repo_dirs [list] Directories of the repositories
+    param: max_workers [int] Optional max number of checkouts downloaded at once; defaults to the pool_workers setting
+    returns: list of results from pull_checkout of the checkouts that use LFS
+    """
+    import Assembly
+    if not available() or len(repo_dirs) == 0:
+        return []
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    checkouts = [(checkout, Assembly.checkout_name(repo_dir, checkout)) for repo_dir in repo_dirs for checkout in Assembly.checkout_tree(repo_dir)]
+    checkouts = [(checkout, name) for checkout, name in checkouts if uses_lfs(checkout)]
+    with ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        results = list(executor.map(lambda checkout: pull_checkout(*checkout), checkouts))
+    if len(results) > 0:
+        prune_cache()
+    return results
+
+def cache_objects():
+    """
+    Gets every large file in the shared cache.
+    returns: list of (file path, size in bytes, when it was last used), least recently used first
+    """
+    objects = []
+    for root, folders, files in os.walk(cache_dir() / "objects"):
+        for file_name in files:
+            file_path = path(root) / file_name
+            try:
+                stat = file_path.stat()
+            except OSError as e:
+                continue
+            objects.append((file_path, stat.st_size, max(stat.st_atime, stat.st_mtime)))
+    objects.sort(key=lambda entry: entry[2])
+    return objects
+
+def checkout_objects(checkout: path):
+    """
+    Gets the large files a checkout needs from the cache: the ones it has checked out, the ones staged but not
+    committed yet, and the ones of commits it has not pushed yet.
+    param: checkout [path] Directory of the checkout
+    returns: set of LFS object ids
+    """
+    oids = set()
+    result = Terminal.run_bash_cmd(["git", "lfs", "ls-files", "--long", "HEAD"], cwd=checkout, verbose=False)
+    if result is not None and result.returncode == 0:
+        oids.update([line.split()[0] for line in result.stdout.splitlines() if len(line.split()) > 0])
+    # pointers staged since the last commit, whose files only exist in the cache, and pointers added by commits on no
+    # remote branch; dependency checkouts are detached, so there is no @{upstream} to compare with, and a commit's
+    # files may have been changed again by a later unpushed commit
+    for cmd in (["git", "diff", "--cached", "--no-textconv", "--no-ext-diff"], ["git", "log", "--format=", "--patch", "--no-textconv", "--no-ext-diff", "HEAD", "--not", "--remotes"]):
+        result = Terminal.run_bash_cmd(cmd, cwd=checkout, verbose=False)
+        if result is not None and result.returncode == 0:
+            oids.update([line[len("+oid sha256:"):].strip() for line in result.stdout.splitlines() if line.startswith("+oid sha256:")])
+    return oids
+
+def prune_cache(max_mb: float=None, max_workers: int=None):
+    """
+    Drops the least recently used large files from the shared cache until it is under its size limit. Files checked
+    out or staged by a workspace repository, dependency or opened version, or not pushed yet, are never dropped; they can be
+    downloaded again from GitHub if they are needed after being dropped.
+    param: max_mb [float] Optional size limit in MB; defaults to the lfs_cache_mb setting
+    param: max_workers [int] Optional max number of checkouts checked at once; defaults to the pool_workers setting
+    returns: (number of files dropped, bytes freed, bytes left in the cache)
+    """
+    import Assembly
+    import Workspace
+    import Worktree
+    max_bytes = float(max_mb if max_mb is not None else Settings.get("lfs_cache_mb")) * 1024 * 1024
+    objects = cache_objects()
+    total = sum([size for file_path, size, last_used in objects])
+    if total <= max_bytes:
+        return (0, 0, total)
+    # finding what is in use starts a git process per checkout; only done once over the limit
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    repo_dirs = Workspace.repositories(Workspace.roots()[0]) + [path(entry["path"]) for entry in Worktree.list_versions()]
+    checkouts = [checkout for repo_dir in repo_dirs for checkout in Assembly.checkout_tree(repo_dir) if uses_lfs(checkout)]
+    with ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        in_use = set().union(*executor.map(checkout_objects, checkouts)) if len(checkouts) > 0 else set()
+    dropped, freed = 0, 0
+    for file_path, size, last_used in objects:
+        if total - freed <= max_bytes:
+            break
+        if file_path.name in in_use:
+            continue
+        try:
+            file_path.unlink()
+        except OSError as e:
+            continue
+        dropped += 1
+        freed += size
+    return (dropped, freed, total - freed)
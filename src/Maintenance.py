@@ -0,0 +1,311 @@
+#!/usr/bin/python3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path as path
+import json
+import threading
+import time
+import Terminal
+import Settings
+import RepoStatus
+import RepoLock
+import Trace
+
+# Keeps workspace repositories fast as they grow. Each repository's loose objects, packs, commit-graph and stash are
+# checked against the maintenance settings and only the tasks it needs are run: packing loose objects, combining small
+# packs behind a multi-pack-index, writing the commit-graph, and dropping old stashes (every pull stashes local changes
+# first, so stashes pile up). The work itself is done by git maintenance, which never prunes unreachable objects.
+#
+# In the background, maintenance only runs once no menu operation has run for maintenance_idle seconds, one repository
+# at a time, and each repository at most once every maintenance_interval seconds.
+
+_lock = threading.Lock() # guards the maintenance state file
+_thread = None # the background maintenance thread, once started
+_stop = threading.Event() # set to stop the background maintenance thread
+GIT_TASKS = ["loose-objects", "incremental-repack", "commit-graph"] # git maintenance tasks, in the order they run
+
+def state_file():
+    """
+    Gets the path of the maintenance state file.
+    """
+    return Settings.settings_dir() / "maintenance.json"
+
+def load_state():
+    """
+    Loads when each repository was last maintained and what it gained.
+    """
+    try:
+        with open(state_file(), "r") as file:
+            return json.load(file)
+    except Exception as e:
+        return {}
+
+def save_state(state: dict):
+    """
+    Saves the maintenance state.
+    param: state [dict] Maps a repository directory to its maintenance state
+    """
+    with open(state_file(), "w") as file:
+        json.dump(state, file, indent=4)
+
+def stash_entries(git_path: path):
+    """
+    Gets when each stash entry was made, from the stash reflog.
+    param: git_path [path] The git directory
+    returns: list of timestamps, newest first so index N is stash@{N}
+    """
+    try:
+        with open(git_path / "logs" / "refs" / "stash", "r") as file:
+            lines = file.read().splitlines()
+    except OSError as e:
+        return []
+    times = []
+    for line in reversed(lines):
+        # <old sha> <new sha> <name> <email> <timestamp> <timezone>\t<message>
+        fields = line.partition("\t")[0].split()
+        times.append(int(fields[-2]) if len(fields) >= 2 and fields[-2].isdigit() else 0)
+    return times
+
+def expired_stashes(git_path: path, now: float):
+    """
+    Gets the stash entries the retention policy drops: those past the newest maintenance_stash_keep entries that are
+    also older than maintenance_stash_days.
+    param: git_path [path] The git directory
+    param: now [float] The current time
+    returns: indexes of the entries, highest first so dropping one does not renumber the rest
+    """
+    keep = max(0, int(Settings.get("maintenance_stash_keep")))
+    max_age = float(Settings.get("maintenance_stash_days")) * 86400
+    entries = stash_entries(git_path)
+    return [index for index in range(len(entries) - 1, keep - 1, -1) if now - entries[index] > max_age]
+
+def repository_stats(repo_dir: path):
+    """
+    Gets the loose object, pack and stash counts and the size on disk of a repository.
+    param: repo_dir [path] Directory of the repository
+    returns: dict of stats, or None if it is not a repository
+    """
+    git_path = RepoStatus.git_dir(repo_dir)
+    if git_path is None:
+        return None
+    result = Terminal.run_bash_cmd(["git", "count-objects", "-v"], cwd=repo_dir, verbose=False)
+    if result is None or result.returncode != 0:
+        return None
+    counts = {}
+    for line in result.stdout.splitlines():
+        key, _, value = line.partition(":")
+        if value.strip().isdigit():
+            counts[key.strip()] = int(value)
+    info_dir = git_path / "objects" / "info"
+    return {
+        "loose_objects": counts.get("count", 0),
+        "packs": counts.get("packs", 0),
+        "packed_objects": counts.get("in-pack", 0),
+        "size_kb": counts.get("size", 0) + counts.get("size-pack", 0) + counts.get("size-garbage", 0),
+        "stashes": len(stash_entries(git_path)),
+        "commit_graph": (info_dir / "commit-graph").exists() or (info_dir / "commit-graphs" / "commit-graph-chain").exists(),
+        "multi_pack_index": (git_path / "objects" / "pack" / "multi-pack-index").exists(),
+    }
+
+def commit_graph_stale(git_path: path):
+    """
+    Checks if a repository's commit-graph is missing or older than its last new commits.
+    param: git_path [path] The git directory
+    """
+    info_dir = git_path / "objects" / "info"
+    graph = max([RepoStatus.stamp(info_dir / "commit-graph") or 0, RepoStatus.stamp(info_dir / "commit-graphs" / "commit-graph-chain") or 0])
+    # commits, resets and fetches all write one of these
+    changed = max([RepoStatus.stamp(git_path / "logs" / "HEAD") or 0, RepoStatus.stamp(git_path / "FETCH_HEAD") or 0])
+    return graph == 0 or graph < changed
+
+def planned_tasks(repo_dir: path, stats: dict, force: bool=False):
+    """
+    Gets the maintenance tasks a repository needs.
+    param: repo_dir [path] Directory of the repository
+    param: stats [dict] The stats of the repository from repository_stats
+    param: force [bool] Optional to run every task whatever the stats; stashes still follow the retention policy
+    returns: list of git maintenance tasks, plus "stash" if stashes should be dropped
+    """
+    git_path = RepoStatus.git_dir(repo_dir)
+    needed = {
+        "loose-objects": stats["loose_objects"] >= int(Settings.get("maintenance_loose_objects")),
+        "incremental-repack": stats["packs"] >= int(Settings.get("maintenance_max_packs")) or (stats["packs"] > 1 and not stats["multi_pack_index"]),
+        "commit-graph": commit_graph_stale(git_path),
+    }
+    # combining packs needs at least one pack to index
+    tasks = [task for task in GIT_TASKS if (force or needed[task]) and (task != "incremental-repack" or stats["packs"] > 0)]
+    if len(expired_stashes(git_path, time.time())) > 0:
+        tasks.append("stash")
+    return tasks
+
+def walk_seconds(repo_dir: path):
+    """
+    Times walking the whole history of a repository, which the commit-graph and fewer packs speed up.
+    param: repo_dir [path] Directory of the repository
+    returns: seconds taken, or None if the walk failed
+    """
+    start_time = time.perf_counter()
+    result = Terminal.run_bash_cmd(["git", "rev-list", "--count", "--all"], cwd=repo_dir, verbose=False)
+    if result is None or result.returncode != 0:
+        return None
+    return time.perf_counter() - start_time
+
+def record(repo_dir: path, report: dict):
+    """
+    Records the outcome of maintaining a repository.
+    param: repo_dir [path] Directory of the repository
+    param: report [dict] The report from maintain_repository
+    """
+    with _lock:
+        state = load_state()
+        entry = state.get(str(repo_dir.absolute()), {})
+        entry["last_run"] = time.time()
+        entry["ok"] = report["ok"]
+        entry["stats"] = report["after"]
+        if len(report["tasks"]) > 0:
+            entry["tasks"] = report["tasks"]
+            entry["saved_kb"] = report["saved_kb"]
+            entry["total_saved_kb"] = entry.get("total_saved_kb", 0) + report["saved_kb"]
+            entry["walk_before"] = report["walk_before"]
+            entry["walk_after"] = report["walk_after"]
+        state[str(repo_dir.absolute())] = entry
+        save_state(state)
+
+def maintain_repository(repo_dir: path, force: bool=False, run_id: str=None):
+    """
+    Runs the maintenance tasks a repository needs, measuring its size and how long walking its history takes before
+    and after. This runs quietly so it can be used from a worker pool.
+    param: repo_dir [path] Directory of the repository
+    param: force [bool] Optional to run every task whatever the stats
+    param: run_id [str] Optional id of the maintenance pass, for the command trace
+    returns: dict of the repo name, tasks run, succeeded, failed command, error text, stats before and after, KB saved,
+    history walk seconds before and after, and seconds taken
+    """
+    start_time = time.perf_counter()
+    report = {"repo": repo_dir.name, "tasks": [], "ok": True, "failed_cmd": None, "error": "", "before": None, "after": None,
+              "saved_kb": 0, "walk_before": None, "walk_after": None, "seconds": 0.0}
+    with Trace.background("maintenance", run_id):
+        before = repository_stats(repo_dir)
+        if before is None:
+            report.update({"ok": False, "failed_cmd": "git count-objects -v", "error": "not a repository"})
+            return report
+        report["before"] = report["after"] = before
+        report["tasks"] = planned_tasks(repo_dir, before, force)
+        git_tasks = [task for task in GIT_TASKS if task in report["tasks"]]
+        bash_cmds = []
+        if "stash" in report["tasks"]:
+            bash_cmds += [["git", "stash", "drop", "--quiet", f"stash@{{{index}}}"] for index in expired_stashes(RepoStatus.git_dir(repo_dir), time.time())]
+        if len(git_tasks) > 0:
+            bash_cmds.append(["git", "maintenance", "run", "--quiet"] + [f"--task={task}" for task in git_tasks])
+            report["walk_before"] = walk_seconds(repo_dir)
+        # git leaves the objects and packs it just combined for its next run; drop them now, since nothing else is
+        # reading them while idle
+        if "loose-objects" in git_tasks:
+            bash_cmds.append(["git", "prune-packed", "--quiet"])
+        if "incremental-repack" in git_tasks:
+            bash_cmds.append(["git", "multi-pack-index", "expire"])
+        for cmd in bash_cmds:
+            result = Terminal.run_bash_cmd(cmd, cwd=repo_dir, verbose=False)
+            if result is None or result.returncode != 0:
+                report.update({"ok": False, "failed_cmd": " ".join(cmd), "error": result.stderr.strip() if result is not None else ""})
+                break
+        if len(report["tasks"]) > 0:
+            if len(git_tasks) > 0:
+                report["walk_after"] = walk_seconds(repo_dir)
+            report["after"] = repository_stats(repo_dir) or before
+            report["saved_kb"] = before["size_kb"] - report["after"]["size_kb"]
+    report["seconds"] = time.perf_counter() - start_time
+    record(repo_dir, report)
+    return report
+
+def run_once(repo_dirs: list, force: bool=False, scheduled: bool=False, max_workers: int=None, should_stop: any=None, skip_locked: bool=False):
+    """
+    Maintains many repositories, a few at a time.
+    param: repo_dirs [list] Directories of the repositories
+    param: force [bool] Optional to run every task on every repository whatever its stats
+    param: scheduled [bool] Optional to skip repositories maintained less than maintenance_interval seconds ago
+    param: max_workers [int] Optional max number of repositories maintained at once; defaults to the pool_workers setting
+    param: should_stop [any] Optional function checked before each repository; the rest are skipped once it returns True
+    param: skip_locked [bool] Optional to skip repositories a job or batch command is working on instead of waiting
+    returns: list of reports from maintain_repository for the repositories maintained, in the order of the repositories
+    """
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    if scheduled:
+        state = load_state()
+        interval = float(Settings.get("maintenance_interval"))
+        now = time.time()
+        repo_dirs = [repo_dir for repo_dir in repo_dirs if now >= state.get(str(repo_dir.absolute()), {}).get("last_run", 0) + interval]
+    if len(repo_dirs) == 0:
+        return []
+    run_id = Trace.new_run_id()
+
+    def maintain(repo_dir: path):
+        if should_stop is not None and should_stop():
+            return None
+        if not skip_locked:
+            return maintain_repository(repo_dir, force, run_id)
+        try:
+            with RepoLock.repositories([repo_dir], "maintenance", timeout=0):
+                return maintain_repository(repo_dir, force, run_id)
+        except RepoLock.Busy as e:
+            return None # still due; tried again next time
+
+    with ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        return [report for report in executor.map(maintain, repo_dirs) if report is not None]
+
+def run_forever(cwd: path):
+    """
+    Maintains the workspace repositories that are due whenever the program has been idle long enough, until stopped.
+    Maintenance stops between repositories as soon as a foreground operation starts.
+    param: cwd [path] The GitHub current working directory
+    """
+    import Handler
+    idle = float(Settings.get("maintenance_idle"))
+
+    def should_stop():
+        return _stop.is_set() or Trace.idle_seconds() < idle
+
+    while not _stop.is_set():
+        if not should_stop():
+            try:
+                run_once(Handler.handle_local_repositories(cwd), scheduled=True, max_workers=1, should_stop=should_stop, skip_locked=True)
+            except Exception as e:
+                pass # never let the background thread die; repositories are tried again next interval
+        _stop.wait(min(60.0, idle))
+
+def start(cwd: path):
+    """
+    Starts maintaining repositories in a background thread if the maintenance setting is on. The thread stops with
+    the program.
+    param: cwd [path] The GitHub current working directory
+    returns: True if maintenance was started
+    """
+    global _thread
+    if not Settings.get("maintenance") or (_thread is not None and _thread.is_alive()):
+        return False
+    _stop.clear()
+    _thread = threading.Thread(target=run_forever, args=(cwd,), name="gitcad-maintenance", daemon=True)
+    _thread.start()
+    return True
+
+def stop():
+    """
+    Stops the background maintenance thread after the repository it is working on.
+    """
+    _stop.set()
+
+def format_report(report: dict):
+    """
+    Formats a maintenance report as one colored line.
+    param: report [dict] A report from maintain_repository
+    """
+    import ChangeCache # only for formatting sizes
+    if not report["ok"]:
+        return f"{Terminal.Text.RED}failed{Terminal.Text.RESET} {report['repo']} {Terminal.Text.GREY}{report['failed_cmd']}: {report['error'].splitlines()[-1] if len(report['error']) > 0 else ''}{Terminal.Text.RESET}"
+    if len(report["tasks"]) == 0:
+        return f"{Terminal.Text.GREY}current{Terminal.Text.RESET} {report['repo']}"
+    gains = [f"{ChangeCache.format_size(max(0, report['saved_kb']) * 1024)} saved"]
+    if report["walk_before"] is not None and report["walk_after"] is not None:
+        gains.append(f"history walk {report['walk_before']*1000:.0f}ms -> {report['walk_after']*1000:.0f}ms")
+    before, after = report["before"], report["after"]
+    gains.append(f"{before['loose_objects']} -> {after['loose_objects']} loose objects, {before['packs']} -> {after['packs']} packs, {before['stashes']} -> {after['stashes']} stashes")
+    return f"{Terminal.Text.GREEN}maintained{Terminal.Text.RESET} {report['repo']} {Terminal.Text.CYAN}{', '.join(report['tasks'])}{Terminal.Text.RESET} {Terminal.Text.GREY}{'; '.join(gains)}{Terminal.Text.RESET}"
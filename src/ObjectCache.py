@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+from pathlib import Path as path
+import hashlib
+import re
+import threading
+import Terminal
+import Settings
+import RepoStatus
+
+# Every dependency clone (.git/modules/dep/<name>) borrows objects from one shared bare repository through git
+# alternates, so a dependency used by many parents is only downloaded and stored once.
+#
+# Garbage collection policy: a borrower may need any object in the store, and not every borrower is known: clones made
+# with --reference by git itself are never registered, and borrowers outside the workspace are never found. So objects
+# are never pruned from the store; gc only repacks it. Refs of dependencies no known borrower uses anymore are dropped.
+
+_lock = threading.RLock() # guards the borrowers file and store setup
+_key_locks = {} # one lock per dependency so the same dependency is not absorbed twice at once
+
+def store_dir():
+    """
+    Gets the directory of the shared object store. Created if it does not exist.
+    """
+    store = Settings.settings_dir() / "objects.git"
+    with _lock:
+        if not (store / "objects").is_dir():
+            Terminal.run_bash_cmd(["git", "init", "--bare", "--quiet", str(store)], cwd=Settings.settings_dir(), verbose=False)
+            # never let automatic gc prune objects that borrowers rely on
+            Terminal.run_bash_cmd(["git", "config", "gc.auto", "0"], cwd=store, verbose=False)
+            Terminal.run_bash_cmd(["git", "config", "gc.pruneExpire", "never"], cwd=store, verbose=False)
+    return store
+
+def enabled():
+    """
+    Checks if dependencies should share objects through the store.
+    """
+    return bool(Settings.get("shared_objects"))
+
+def reference_args():
+    """
+    Gets the extra git submodule update / submodule add args that make new dependency clones borrow from the store.
+    """
+    if not enabled():
+        return []
+    return ["--reference", str(store_dir())]
+
+def url_key(url: str):
+    """
+    Gets the name used for a dependency's refs inside the store.
+    param: url [str] The remote URL of the dependency
+    """
+    name = re.sub(r"[^A-Za-z0-9_-]", "_", url.strip().rstrip("/").split("/").pop().split(":").pop().removesuffix(".git"))
+    return f"{name}-{hashlib.sha1(url.strip().encode()).hexdigest()[:12]}"
+
+def key_lock(key: str):
+    """
+    Gets the lock of a single dependency in the store.
+    param: key [str] The name of the dependency's refs inside the store
+    """
+    with _lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+def borrowers_file():
+    """
+    Gets the file listing the git directories that borrow from the store.
+    """
+    return store_dir() / "gitcad-borrowers"
+
+def load_borrowers():
+    """
+    Gets the git directories that borrow from the store.
+    """
+    try:
+        with open(borrowers_file(), "r") as file:
+            return [line.strip() for line in file if len(line.strip()) > 0]
+    except OSError as e:
+        return []
+
+def save_borrowers(borrowers: list):
+    """
+    Saves the git directories that borrow from the store.
+    param: borrowers [list] The git directories
+    """
+    with open(borrowers_file(), "w") as file:
+        file.write("".join([f"{borrower}\n" for borrower in sorted(set(borrowers))]))
+
+def is_linked(git_dir: path):
+    """
+    Checks if a git directory borrows from the store.
+    param: git_dir [path] The git directory of a dependency clone
+    """
+    try:
+        with open(git_dir / "objects" / "info" / "alternates", "r") as file:
+            return str(store_dir() / "objects") in [line.strip() for line in file]
+    except OSError as e:
+        return False
+
+def link(git_dir: path):
+    """
+    Makes a git directory borrow objects from the store and registers it as a borrower.
+    param: git_dir [path] The git directory of a dependency clone
+    """
+    store_objects = str(store_dir() / "objects")
+    if not is_linked(git_dir):
+        alternates = git_dir / "objects" / "info" / "alternates"
+        alternates.parent.mkdir(parents=True, exist_ok=True)
+        with open(alternates, "a") as file:
+            file.write(f"{store_objects}\n")
+    with _lock:
+        save_borrowers(load_borrowers() + [str(git_dir.absolute())])
+
+def dependency_git_dirs(repo_dir: path):
+    """
+    Gets the git directories of every dependency clone of a repository, including nested ones.
+    param: repo_dir [path] Directory of the parent repository
+    """
+    git_dirs = []
+    def find_git_dirs(folder: path):
+        for child in folder.iterdir():
+            if not child.is_dir():
+                continue
+            if (child / "HEAD").is_file() and (child / "objects").is_dir():
+                git_dirs.append(child)
+                # nested dependencies of this dependency
+                if (child / "modules").is_dir():
+                    find_git_dirs(child / "modules")
+            else: # a folder of dependencies, like dep/
+                find_git_dirs(child)
+    # worktrees keep their dependency clones under their own git directory
+    git_path = RepoStatus.git_dir(repo_dir)
+    if git_path is not None and (git_path / "modules").is_dir():
+        find_git_dirs(git_path / "modules")
+    return sorted(git_dirs)
+
+def absorb(git_dir: path):
+    """
+    Copies a dependency clone's objects into the store, links it to the store and drops its own copies of objects the
+    store now has. This runs quietly so it can be used from a worker pool.
+    param: git_dir [path] The git directory of a dependency clone
+    returns: True if the dependency clone was absorbed
+    """
+    result = Terminal.run_bash_cmd(["git", "--git-dir", str(git_dir), "config", "--get", "remote.origin.url"], cwd=git_dir, verbose=False)
+    if result is None or result.returncode != 0:
+        return False
+    key = url_key(result.stdout.strip())
+    store = store_dir()
+    with key_lock(key):
+        # local fetch; no network
+        result = Terminal.run_bash_cmd(["git", "--git-dir", str(store), "fetch", "--quiet", "--no-tags", str(git_dir), f"+refs/*:refs/gitcad/{key}/*"], cwd=store, verbose=False)
+        if result is None or result.returncode != 0:
+            return False
+        link(git_dir)
+        # pack loose objects, then repack keeping only what the store does not have
+        Terminal.run_bash_cmd(["git", "--git-dir", str(git_dir), "repack", "-a", "-d", "-q"], cwd=git_dir, verbose=False)
+        Terminal.run_bash_cmd(["git", "--git-dir", str(git_dir), "repack", "-a", "-d", "-l", "-q"], cwd=git_dir, verbose=False)
+    return True
+
+def absorb_repository(repo_dir: path):
+    """
+    Absorbs every dependency clone of a repository into the store.
+    param: repo_dir [path] Directory of the parent repository
+    returns: number of dependency clones absorbed
+    """
+    if not enabled():
+        return 0
+    return len([git_dir for git_dir in dependency_git_dirs(repo_dir) if absorb(git_dir)])
+
+def collect_garbage(repo_dirs: list):
+    """
+    Runs garbage collection on the store. Borrowers that no longer exist are forgotten and refs of dependencies no
+    borrower uses are dropped. Objects are never pruned, since borrowers that were never registered may need them.
+    param: repo_dirs [list] Directories of the workspace repositories, searched for borrowers that were never registered
+    returns: (number of borrowers left, number of dependencies dropped)
+    """
+    store = store_dir()
+    found = [str(git_dir.absolute()) for repo_dir in repo_dirs for git_dir in dependency_git_dirs(repo_dir)]
+    with _lock:
+        borrowers = [borrower for borrower in set(load_borrowers() + found) if is_linked(path(borrower))]
+        save_borrowers(borrowers)
+    # dependencies still used by a borrower
+    used_keys = set()
+    for borrower in borrowers:
+        result = Terminal.run_bash_cmd(["git", "--git-dir", borrower, "config", "--get", "remote.origin.url"], cwd=store, verbose=False)
+        if result is not None and result.returncode == 0:
+            used_keys.add(url_key(result.stdout.strip()))
+    # drop refs of unused dependencies
+    result = Terminal.run_bash_cmd(["git", "--git-dir", str(store), "for-each-ref", "--format=%(refname)", "refs/gitcad/"], cwd=store, verbose=False)
+    stored_keys = set([ref.split("/")[2] for ref in result.stdout.split()]) if result is not None and result.returncode == 0 else set()
+    dropped_keys = stored_keys - used_keys
+    for key in dropped_keys:
+        refs = [ref for ref in result.stdout.split() if ref.split("/")[2] == key]
+        for ref in refs:
+            Terminal.run_bash_cmd(["git", "--git-dir", str(store), "update-ref", "-d", ref], cwd=store, verbose=False)
+    Terminal.run_bash_cmd(["git", "--git-dir", str(store), "gc", "--quiet", "--prune=never"], cwd=store, verbose=False)
+    return (len(borrowers), len(dropped_keys))
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path as path
+import json
+import threading
+import time
+import Terminal
+import Settings
+import SharedFetch
+import Trace
+
+# Fetches every workspace repository and dependency remote in the background, so foreground pulls only have to move
+# refs and the status column can show "behind" without going to the network.
+#
+# Repositories are fetched with git fetch --prefetch, which stores remote branches under refs/prefetch/remotes/origin
+# and never touches refs/remotes, branches or working trees. Dependency remotes are mirrored into the shared object
+# store (see SharedFetch). A remote that fails to fetch is retried after the prefetch interval doubled for every
+# failure in a row, up to prefetch_max_backoff.
+
+PREFETCH_VERSION = (2, 33) # first git with git fetch --prefetch
+
+_lock = threading.Lock() # guards the prefetch state file
+_thread = None # the background prefetch thread, once started
+_stop = threading.Event() # set to stop the background prefetch thread
+
+def state_file():
+    """
+    Gets the path of the prefetch state file.
+    """
+    return Settings.settings_dir() / "prefetch.json"
+
+def load_state():
+    """
+    Loads when each remote was last prefetched and how many times in a row it failed.
+    """
+    try:
+        with open(state_file(), "r") as file:
+            return json.load(file)
+    except Exception as e:
+        return {}
+
+def save_state(state: dict):
+    """
+    Saves the prefetch state.
+    param: state [dict] Maps a repository directory or remote URL to its prefetch state
+    """
+    with open(state_file(), "w") as file:
+        json.dump(state, file, indent=4)
+
+def due(entry: dict, now: float, interval: float):
+    """
+    Checks if a remote should be prefetched, backing off after failures.
+    param: entry [dict] The prefetch state of the remote, or None if it was never prefetched
+    param: now [float] The current time
+    param: interval [float] Seconds between prefetches
+    """
+    if entry is None:
+        return True
+    delay = min(interval * (2 ** entry.get("failures", 0)), float(Settings.get("prefetch_max_backoff")))
+    return now >= entry.get("last_attempt", 0) + delay
+
+def record(key: str, kind: str, ok: bool, error: str=""):
+    """
+    Records the outcome of prefetching a remote.
+    param: key [str] The repository directory or remote URL
+    param: kind [str] "repository" or "dependency"
+    param: ok [bool] If the prefetch succeeded
+    param: error [str] Optional error output
+    """
+    with _lock:
+        state = load_state()
+        entry = state.get(key, {})
+        entry["kind"] = kind
+        entry["last_attempt"] = time.time()
+        if ok:
+            entry["last_success"] = entry["last_attempt"]
+            entry["failures"] = 0
+            entry.pop("error", None)
+        else:
+            entry["failures"] = entry.get("failures", 0) + 1
+            entry["error"] = error.strip().splitlines()[-1] if len(error.strip()) > 0 else ""
+        state[key] = entry
+        save_state(state)
+
+def fetch_args():
+    """
+    Gets the git fetch args that fetch origin's branches into refs/prefetch. git fetch --prefetch needs git 2.33; older
+    git is given the same refspec by hand, and writes FETCH_HEAD since --no-write-fetch-head is newer than some of it.
+    """
+    import CloneProfile
+    version = CloneProfile.git_version()
+    if len(version) > 0 and version < PREFETCH_VERSION:
+        return ["--quiet", "--no-tags", "--no-recurse-submodules", "origin", "+refs/heads/*:refs/prefetch/remotes/origin/*"]
+    return ["--prefetch", "--quiet", "--no-tags", "--no-recurse-submodules", "--no-write-fetch-head", "origin"]
+
+def prefetch_repository(repo_dir: path, run_id: str=None):
+    """
+    Fetches a workspace repository's remote branches into refs/prefetch, without changing its branches or files.
+    param: repo_dir [path] Directory of the repository
+    param: run_id [str] Optional id of the prefetch pass, for the command trace
+    returns: (repository directory, succeeded, error text)
+    """
+    with Trace.background("prefetch", run_id):
+        result = Terminal.run_bash_cmd(["git", "fetch"] + fetch_args(), cwd=repo_dir, verbose=False)
+    ok = result is not None and result.returncode == 0
+    err_text = result.stderr if result is not None else ""
+    record(str(repo_dir.absolute()), "repository", ok, err_text)
+    return (str(repo_dir), ok, "" if ok else err_text.strip())
+
+def prefetch_dependency_remote(url: str, run_id: str=None):
+    """
+    Mirrors a dependency remote's branches into the shared object store.
+    param: url [str] The remote URL
+    param: run_id [str] Optional id of the prefetch pass, for the command trace
+    returns: (remote URL, succeeded, error text)
+    """
+    with Trace.background("prefetch", run_id):
+        ok = SharedFetch.fetch(url)
+    record(url, "dependency", ok, "" if ok else "fetch failed")
+    return (url, ok, "" if ok else "fetch failed")
+
+def dependency_remotes(repo_dirs: list, run_id: str=None):
+    """
+    Gets the distinct remote URLs of every dependency checkout of the workspace repositories that can fetch through
+    the store.
+    param: repo_dirs [list] Directories of the repositories
+    param: run_id [str] Optional id of the prefetch pass, for the command trace
+    """
+    import Restore
+    urls = set()
+    to_visit = list(repo_dirs)
+    with Trace.background("prefetch", run_id):
+        while len(to_visit) > 0:
+            parent_dir = to_visit.pop()
+            for dep_path in Restore.pinned_dependencies(parent_dir):
+                url = SharedFetch.dependency_remote(parent_dir / dep_path)
+                if url is not None:
+                    urls.add(url)
+                    to_visit.append(parent_dir / dep_path)
+    return sorted(urls)
+
+def run_once(cwd: path, force: bool=False):
+    """
+    Prefetches every workspace repository and dependency remote that is due, a few at a time.
+    param: cwd [path] The GitHub current working directory
+    param: force [bool] Optional to prefetch every remote now, ignoring the schedule and backoff
+    returns: list of (repository directory or remote URL, succeeded, error text) for the remotes prefetched
+    """
+    import Handler
+    interval = float(Settings.get("prefetch_interval"))
+    now = time.time()
+    state = load_state()
+    repo_dirs = Handler.handle_local_repositories(cwd)
+    repos_due = [repo_dir for repo_dir in repo_dirs if force or due(state.get(str(repo_dir.absolute())), now, interval)]
+    # finding dependency remotes starts a git process per dependency; skip it while nothing is due
+    if not force and len(repos_due) == 0 and not any([due(entry, now, interval) for entry in state.values() if entry.get("kind") == "dependency"]):
+        return []
+    run_id = Trace.new_run_id()
+    urls_due = [url for url in dependency_remotes(repo_dirs, run_id) if force or due(state.get(url), now, interval)]
+    with ThreadPoolExecutor(max_workers=max(1, int(Settings.get("prefetch_workers")))) as executor:
+        results = list(executor.map(lambda repo_dir: prefetch_repository(repo_dir, run_id), repos_due))
+        results += list(executor.map(lambda url: prefetch_dependency_remote(url, run_id), urls_due))
+    return results
+
+def run_forever(cwd: path):
+    """
+    Prefetches on a schedule until stopped. Passes are skipped while a foreground operation is running, so
+    prefetching never competes with what the user is waiting on.
+    param: cwd [path] The GitHub current working directory
+    """
+    while not _stop.is_set():
+        if not Trace.busy():
+            try:
+                run_once(cwd)
+            except Exception as e:
+                pass # never let the background thread die; failed remotes back off on their own
+        # check often, so remotes that become due are fetched soon after
+        _stop.wait(min(60.0, float(Settings.get("prefetch_interval"))))
+
+def start(cwd: path):
+    """
+    Starts prefetching in a background thread if the prefetch setting is on. The thread stops with the program.
+    param: cwd [path] The GitHub current working directory
+    returns: True if prefetching was started
+    """
+    global _thread
+    if not Settings.get("prefetch") or (_thread is not None and _thread.is_alive()):
+        return False
+    _stop.clear()
+    _thread = threading.Thread(target=run_forever, args=(cwd,), name="gitcad-prefetch", daemon=True)
+    _thread.start()
+    return True
+
+def stop():
+    """
+    Stops the background prefetch thread after its current pass.
+    """
+    _stop.set()
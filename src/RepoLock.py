@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+from pathlib import Path as path
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import Settings
+
+# Advisory locks that keep two GitCAD operations, in this or any other GitCAD process, from running git in the same
+# repository at once. Locking a repository also locks every dependency checked out inside it, since operations on a
+# repository check out, commit or fetch its dependencies too.
+#
+# Each checkout has a lock file in ~/.gitcad/locks, named after its path and locked with flock (msvcrt on Windows).
+# The operating system drops a process's locks when it exits, so a crash never leaves a repository locked. Locks are
+# taken all at once or not at all, so two operations wanting the same repositories can not deadlock.
+
+_lock = threading.Lock() # guards the handles held by this process
+_held = {} # lock file path -> open handle, for locks held by this process
+
+class Busy(Exception):
+    """
+    Raised when repositories stay locked by another operation for too long.
+    """
+    pass
+
+def locks_dir():
+    """
+    Gets the folder of the lock files. Created if it does not exist.
+    """
+    locks_path = Settings.settings_dir() / "locks"
+    locks_path.mkdir(parents=True, exist_ok=True)
+    return locks_path
+
+def lock_file(checkout: path):
+    """
+    Gets the lock file of a repository or dependency checkout.
+    param: checkout [path] Directory of the checkout
+    """
+    return locks_dir() / f"{hashlib.sha1(str(path(checkout).absolute()).encode()).hexdigest()[:16]}.lock"
+
+def try_lock(file_path: path, holder: str):
+    """
+    Takes a lock file without waiting.
+    param: file_path [path] The lock file
+    param: holder [str] What is taking the lock, written into the file so others can say what they wait on
+    returns: True if the lock was taken
+    """
+    with _lock:
+        if str(file_path) in _held:
+            return False # held by another operation of this process
+        handle = open(file_path, "a+")
+        try:
+            if sys.platform.startswith("win"):
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            handle.close()
+            return False
+        handle.seek(0)
+        handle.truncate()
+        handle.write(json.dumps({"pid": os.getpid(), "holder": holder, "since": time.time()}))
+        handle.flush()
+        _held[str(file_path)] = handle
+        return True
+
+def unlock(file_path: path):
+    """
+    Releases a lock file held by this process.
+    param: file_path [path] The lock file
+    """
+    with _lock:
+        handle = _held.pop(str(file_path), None)
+    if handle is None:
+        return
+    try:
+        if sys.platform.startswith("win"):
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+    finally:
+        handle.close()
+
+def holder(file_path: path):
+    """
+    Gets what holds a lock file, as written by the process that took it.
+    param: file_path [path] The lock file
+    returns: the holder text, or None if unknown
+    """
+    try:
+        with open(file_path, "r") as file:
+            info = json.load(file)
+        return f"{info['holder']} (pid {info['pid']})"
+    except Exception as e:
+        return None
+
+def lock_paths(repo_dirs: list):
+    """
+    Gets every checkout locked for some repositories: each repository and every dependency checked out inside it.
+    param: repo_dirs [list] Directories of the repositories or dependency checkouts
+    returns: sorted list of checkout directories
+    """
+    import Assembly
+    checkouts = set()
+    for repo_dir in repo_dirs:
+        checkouts.update([checkout.absolute() for checkout in Assembly.checkout_tree(path(repo_dir))])
+    return sorted(checkouts, key=str)
+
+class repositories:
+    """
+    Holds the locks of repositories and every dependency checked out inside them while it is entered, waiting for
+    other operations holding any of them to finish.
+    """
+    def __init__(self, repo_dirs: list, holder: str, timeout: float=None, should_stop: any=None, on_wait: any=None):
+        """
+        Creates the locks of repositories.
+        param: repo_dirs [list] Directories of the repositories or dependency checkouts
+        param: holder [str] What is taking the locks, i.e. "pull Main"
+        param: timeout [float] Optional seconds to wait before raising Busy; waits as long as it takes if None
+        param: should_stop [any] Optional function that returns True to stop waiting, which raises Busy
+        param: on_wait [any] Optional function called with the holder of a lock being waited on
+        """
+        self.repo_dirs = repo_dirs
+        self.holder = holder
+        self.timeout = timeout
+        self.should_stop = should_stop
+        self.on_wait = on_wait
+        self.files = []
+
+    def __enter__(self):
+        files = [lock_file(checkout) for checkout in lock_paths(self.repo_dirs)]
+        start_time = time.time()
+        while True:
+            taken = []
+            busy_file = None
+            for file_path in files:
+                if not try_lock(file_path, self.holder):
+                    busy_file = file_path
+                    break
+                taken.append(file_path)
+            if busy_file is None:
+                self.files = taken
+                return self
+            # give back what was taken, so whoever holds the rest can finish
+            for file_path in taken:
+                unlock(file_path)
+            if self.on_wait is not None:
+                self.on_wait(holder(busy_file) or "another operation")
+            if (self.timeout is not None and time.time() - start_time >= self.timeout) or (self.should_stop is not None and self.should_stop()):
+                raise Busy(f"locked by {holder(busy_file) or 'another operation'}")
+            time.sleep(0.2)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for file_path in self.files:
+            unlock(file_path)
+        self.files = []
+        return False
@@ -0,0 +1,301 @@
+#!/usr/bin/python3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path as path
+import json
+import struct
+import threading
+import Terminal
+import Settings
+import Trace
+
+# Status of each repository is cached on disk, keyed on the mtimes of the files git changes when the repository's
+# state changes (index, HEAD, refs). Only repositories whose key changed run a full git status. Editing a tracked file
+# changes none of those files, so changes to tracked files are always checked again, with git status -uno which skips
+# the slow search for untracked files.
+
+_lock = threading.Lock() # guards the in-memory cache
+_cache = None # in-memory copy of the status cache
+
+def cache_file():
+    """
+    Gets the path of the status cache file.
+    """
+    return Settings.settings_dir() / "status_cache.json"
+
+def load_cache():
+    """
+    Loads the status cache, from memory if already loaded or else from disk.
+    """
+    global _cache
+    with _lock:
+        if _cache is None:
+            try:
+                with open(cache_file(), "r") as file:
+                    _cache = json.load(file)
+            except Exception as e:
+                _cache = {}
+        return _cache
+
+def save_cache():
+    """
+    Saves the status cache to disk.
+    """
+    with _lock:
+        with open(cache_file(), "w") as file:
+            json.dump(_cache, file)
+
+def git_dir(repo_dir: path):
+    """
+    Gets the git directory of a repository or dependency checkout, following the .git file dependencies use.
+    param: repo_dir [path] Directory of the repository
+    returns: path of the git directory, or None if it is not a repository
+    """
+    dot_git = repo_dir / ".git"
+    if dot_git.is_dir():
+        return dot_git
+    try:
+        with open(dot_git, "r") as file:
+            line = file.readline().strip()
+        if line.startswith("gitdir:"):
+            return (repo_dir / line[len("gitdir:"):].strip()).resolve()
+    except OSError as e:
+        pass
+    return None
+
+def read_ref(git_path: path, ref: str):
+    """
+    Reads the commit a ref points to straight from the git directory, without running git.
+    param: git_path [path] The git directory
+    param: ref [str] The full ref name, i.e. refs/heads/main
+    returns: the commit SHA, or None if the ref does not exist
+    """
+    try:
+        with open(git_path / ref, "r") as file:
+            value = file.read().strip()
+        if value.startswith("ref:"):
+            return read_ref(git_path, value[len("ref:"):].strip())
+        return value
+    except OSError as e:
+        pass
+    # not a loose ref; look in packed-refs
+    try:
+        with open(git_path / "packed-refs", "r") as file:
+            for line in file:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    except OSError as e:
+        pass
+    return None
+
+def read_head(git_path: path):
+    """
+    Reads HEAD straight from the git directory.
+    param: git_path [path] The git directory
+    returns: (branch name or None if detached, commit SHA or None)
+    """
+    try:
+        with open(git_path / "HEAD", "r") as file:
+            value = file.read().strip()
+    except OSError as e:
+        return (None, None)
+    if value.startswith("ref:"):
+        ref = value[len("ref:"):].strip()
+        return (ref.removeprefix("refs/heads/"), read_ref(git_path, ref))
+    return (None, value)
+
+def read_gitlinks(git_path: path):
+    """
+    Reads the pinned commits of dependencies (gitlinks) straight from the index file.
+    param: git_path [path] The git directory
+    returns: dict mapping a dependency path to its pinned SHA, or None if the index could not be read
+    """
+    try:
+        with open(git_path / "index", "rb") as file:
+            data = file.read()
+    except OSError as e:
+        return {}
+    if data[:4] != b"DIRC":
+        return None
+    version, count = struct.unpack(">II", data[4:12])
+    if version not in (2, 3):
+        return None # v4 compresses paths; let git read it
+    gitlinks = {}
+    offset = 12
+    for i in range(count):
+        mode = struct.unpack(">I", data[offset+24:offset+28])[0]
+        sha = data[offset+40:offset+60].hex()
+        flags = struct.unpack(">H", data[offset+60:offset+62])[0]
+        path_start = offset + 62 + (2 if flags & 0x4000 else 0) # extended flags
+        path_end = data.index(b"\0", path_start)
+        if mode == 0o160000: # gitlink
+            gitlinks[data[path_start:path_end].decode(errors="replace")] = sha
+        # entries are padded with NULs to a multiple of 8 bytes
+        entry_length = path_end - offset + 1
+        offset += (entry_length + 7) // 8 * 8
+    return gitlinks
+
+def stamp(file_path: path):
+    """
+    Gets the mtime of a file, or None if it does not exist.
+    param: file_path [path] The file
+    """
+    try:
+        return file_path.stat().st_mtime_ns
+    except OSError as e:
+        return None
+
+def cache_key(repo_dir: path, git_path: path, branch: str, gitlinks: dict):
+    """
+    Gets the cache key of a repository's status from the mtimes of the files that change with it.
+    param: repo_dir [path] Directory of the repository
+    param: git_path [path] The git directory
+    param: branch [str] The checked out branch
+    param: gitlinks [dict] The dependencies' pinned commits
+    """
+    # the repository folder itself changes when top-level files are added or removed
+    files = [repo_dir, git_path / "index", git_path / "HEAD", git_path / "packed-refs", git_path / "FETCH_HEAD"]
+    if branch is not None:
+        files += [git_path / "refs" / "heads" / branch, git_path / "refs" / "remotes" / "origin" / branch, git_path / "refs" / "prefetch" / "remotes" / "origin" / branch]
+    for dep_path in sorted(gitlinks or {}):
+        dep_git_path = git_dir(repo_dir / dep_path)
+        if dep_git_path is not None:
+            files.append(dep_git_path / "HEAD")
+    return [stamp(file_path) for file_path in files]
+
+def upstream_sha(git_path: path, branch: str):
+    """
+    Gets the latest known commit of a branch on origin: from the last fetch, or from the background prefetch if that
+    was more recent.
+    param: git_path [path] The git directory
+    param: branch [str] The branch
+    returns: the commit SHA, or None if the branch was never fetched
+    """
+    refs = [f"refs/remotes/origin/{branch}", f"refs/prefetch/remotes/origin/{branch}"]
+    # newest loose ref first; packed refs are older than any loose one
+    refs.sort(key=lambda ref: -(stamp(git_path / ref) or 0))
+    for ref in refs:
+        sha = read_ref(git_path, ref)
+        if sha is not None:
+            return sha
+    return None
+
+def changed_files(repo_dir: path, gitlinks: dict, untracked: bool=True):
+    """
+    Lists the changed files of a repository with git status.
+    param: repo_dir [path] Directory of the repository
+    param: gitlinks [dict] The dependencies' pinned commits; changed pins are not counted
+    param: untracked [bool] Optional to indicate if untracked files are listed too
+    returns: list of git status lines, or None if git failed
+    """
+    result = Terminal.run_bash_cmd(["git", "status", "--porcelain", "--ignore-submodules=dirty"] + ([] if untracked else ["-uno"]), cwd=repo_dir, verbose=False)
+    if result is None or result.returncode != 0:
+        return None
+    # changed pins show up as modified dependencies; count only real changes
+    return [line for line in result.stdout.splitlines() if line[3:] not in (gitlinks or {})]
+
+def compute_status(repo_dir: path, git_path: path, branch: str, head_sha: str, gitlinks: dict):
+    """
+    Computes the status of a repository, reading refs from the git directory and only running git where needed.
+    param: repo_dir [path] Directory of the repository
+    param: git_path [path] The git directory
+    param: branch [str] The checked out branch
+    param: head_sha [str] The checked out commit
+    param: gitlinks [dict] The dependencies' pinned commits, or None if git should read them
+    returns: dict of dirty, untracked, ahead, behind and outdated_pins (dependency paths not checked out at their pinned
+    commit)
+    """
+    status = {"dirty": None, "untracked": None, "ahead": 0, "behind": 0, "outdated_pins": []}
+    changed = changed_files(repo_dir, gitlinks)
+    if changed is not None:
+        status["dirty"] = len(changed) > 0
+        status["untracked"] = any([line.startswith("??") for line in changed])
+    # ahead/behind origin; only needs git when the commits differ
+    remote_sha = upstream_sha(git_path, branch) if branch is not None else None
+    if head_sha is not None and remote_sha is not None and head_sha != remote_sha:
+        result = Terminal.run_bash_cmd(["git", "rev-list", "--left-right", "--count", f"{head_sha}...{remote_sha}"], cwd=repo_dir, verbose=False)
+        if result is not None and result.returncode == 0 and len(result.stdout.split()) == 2:
+            status["ahead"], status["behind"] = [int(count) for count in result.stdout.split()]
+    # dependencies not checked out at their pinned commit
+    if gitlinks is None:
+        result = Terminal.run_bash_cmd(["git", "submodule", "status"], cwd=repo_dir, verbose=False)
+        if result is not None and result.returncode == 0:
+            status["outdated_pins"] = [line[1:].split()[1] for line in result.stdout.splitlines() if line.startswith("+")]
+    else:
+        for dep_path, pinned in gitlinks.items():
+            dep_git_path = git_dir(repo_dir / dep_path)
+            if dep_git_path is not None and read_head(dep_git_path)[1] != pinned:
+                status["outdated_pins"].append(dep_path)
+    return status
+
+def get_status(repo_dir: path):
+    """
+    Gets the status of a repository, from the cache if nothing it depends on changed apart from tracked files.
+    param: repo_dir [path] Directory of the repository
+    returns: dict of dirty, untracked, ahead, behind and outdated_pins, or None if it is not a repository
+    """
+    git_path = git_dir(repo_dir)
+    if git_path is None:
+        return None
+    branch, head_sha = read_head(git_path)
+    try:
+        gitlinks = read_gitlinks(git_path)
+    except Exception as e:
+        gitlinks = None # unexpected index layout; let git read it
+    key = cache_key(repo_dir, git_path, branch, gitlinks)
+    cache = load_cache()
+    entry = cache.get(str(repo_dir.absolute()))
+    if entry is not None and entry["key"] == key and entry["status"].get("untracked") is not None:
+        # refs and pins are unchanged, but tracked files may have been edited since
+        changed = changed_files(repo_dir, gitlinks, untracked=False)
+        status = dict(entry["status"])
+        status["dirty"] = None if changed is None else len(changed) > 0 or status["untracked"]
+        return status
+    status = compute_status(repo_dir, git_path, branch, head_sha, gitlinks)
+    with _lock:
+        # git status may have refreshed the index; key on the state after it ran
+        cache[str(repo_dir.absolute())] = {"key": cache_key(repo_dir, git_path, branch, gitlinks), "status": status}
+    return status
+
+def get_statuses(repo_dirs: list, max_workers: int=None):
+    """
+    Gets the status of many repositories in parallel.
+    param: repo_dirs [list] Directories of the repositories
+    param: max_workers [int] Optional max number of repositories checked at once; defaults to the pool_workers setting
+    returns: dict mapping a repository directory to its status
+    """
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    with ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        statuses = dict(zip(repo_dirs, executor.map(get_status, repo_dirs)))
+    save_cache()
+    return statuses
+
+def cached_statuses(repo_dirs: list):
+    """
+    Gets the last known status of repositories from the cache without running git, to show while they are checked again.
+    param: repo_dirs [list] Directories of the repositories
+    returns: dict mapping a repository directory to its last status; repositories never checked are left out
+    """
+    cache = load_cache()
+    with _lock:
+        return dict([(repo_dir, cache[str(repo_dir.absolute())]["status"]) for repo_dir in repo_dirs if str(repo_dir.absolute()) in cache])
+
+def format_status(status: dict):
+    """
+    Formats a repository status as a short colored menu column.
+    param: status [dict] The status of a repository
+    """
+    if status is None:
+        return ""
+    parts = []
+    if status["dirty"]:
+        parts.append(f"{Terminal.Text.RED}dirty")
+    if status["ahead"] > 0:
+        parts.append(f"{Terminal.Text.YELLOW}↑{status['ahead']}")
+    if status["behind"] > 0:
+        parts.append(f"{Terminal.Text.YELLOW}↓{status['behind']}")
+    if len(status["outdated_pins"]) > 0:
+        parts.append(f"{Terminal.Text.RED}pins:{len(status['outdated_pins'])}")
+    if len(parts) == 0:
+        parts.append(f"{Terminal.Text.GREEN}clean")
+    return f"[{' '.join(parts)}{Terminal.Text.END}]"
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path as path
+import threading
+import time
+import Terminal
+import Settings
+import LargeFiles
+import RepoStatus
+import ObjectCache
+import SharedFetch
+import Trace
+
+# Restores dependencies to the commits their parents pinned, only touching the ones that differ. Every dependency is
+# checked in parallel, reading its HEAD straight from its git directory; a git process is only started to check for
+# local changes and to fix dependencies that need it. Nested dependencies are checked once their parent is restored.
+# Missing commits are fetched through SharedFetch, so a dependency shared by many parents is only fetched once.
+
+_lock = threading.Lock() # guards the parent locks
+_parent_locks = {} # one lock per parent so dependencies of the same parent are not cloned at once
+
+def parent_lock(parent_dir: path):
+    """
+    Gets the lock of a parent repository or dependency checkout.
+    param: parent_dir [path] Directory of the parent
+    """
+    with _lock:
+        return _parent_locks.setdefault(str(parent_dir.absolute()), threading.Lock())
+
+def pinned_dependencies(repo_dir: path):
+    """
+    Gets the commit a repository, or dependency checkout, pins for each of its dependencies.
+    param: repo_dir [path] Directory of the repository
+    returns: dict mapping a dependency path to its pinned SHA
+    """
+    git_path = RepoStatus.git_dir(repo_dir)
+    if git_path is None:
+        return {}
+    try:
+        gitlinks = RepoStatus.read_gitlinks(git_path)
+    except Exception as e:
+        gitlinks = None
+    if gitlinks is not None:
+        return gitlinks
+    # unexpected index layout; let git read it
+    result = Terminal.run_bash_cmd(["git", "ls-files", "--stage"], cwd=repo_dir, verbose=False)
+    if result is None or result.returncode != 0:
+        return {}
+    gitlinks = {}
+    for line in result.stdout.splitlines():
+        info, _, dep_path = line.partition("\t")
+        if info.startswith("160000"):
+            gitlinks[dep_path] = info.split()[1]
+    return gitlinks
+
+def has_commit(repo_dir: path, sha: str):
+    """
+    Checks if a repository or dependency checkout has a commit, including through the shared object store.
+    param: repo_dir [path] Directory of the repository
+    param: sha [str] The commit SHA
+    """
+    result = Terminal.run_bash_cmd(["git", "cat-file", "-e", f"{sha}^{{commit}}"], cwd=repo_dir, verbose=False)
+    return result is not None and result.returncode == 0
+
+def restore_dependency(parent_dir: path, dep_path: str, pinned: str):
+    """
+    Checks one dependency against the commit its parent pinned and fixes it if it differs: missing checkouts are
+    cloned, checkouts at another commit are force checked out at the pinned one (fetching only if it is missing) and
+    checkouts with local changes are reset. This runs quietly so it can be used from a worker pool.
+    param: parent_dir [path] Directory of the parent repository or dependency checkout
+    param: dep_path [str] Path of the dependency inside the parent
+    param: pinned [str] The pinned SHA
+    returns: (action, SHA the dependency was at, failed command, error text) where action is None if nothing changed,
+    or "cloned", "checked out" or "reset"
+    """
+    dep_dir = parent_dir / dep_path
+    dep_git_path = RepoStatus.git_dir(dep_dir)
+    if dep_git_path is None:
+        # submodule update writes the parent's config; one clone per parent at a time
+        cmd = ["git"] + LargeFiles.config_args() + ["submodule", "update", "--init", "--force"] + ObjectCache.reference_args() + ["--", dep_path]
+        with parent_lock(parent_dir):
+            result = Terminal.run_bash_cmd(cmd, cwd=parent_dir, verbose=False)
+        if result is None or result.returncode != 0:
+            return ("cloned", None, " ".join(cmd), result.stderr.strip() if result is not None else "")
+        git_path = RepoStatus.git_dir(dep_dir)
+        if git_path is not None and ObjectCache.enabled():
+            ObjectCache.absorb(git_path)
+        return ("cloned", None, None, "")
+    head_sha = RepoStatus.read_head(dep_git_path)[1]
+    if head_sha != pinned:
+        action = "checked out"
+        bash_cmds = [["git", "checkout", "--force", "--quiet", "--detach", pinned]]
+        # only fetch if the pinned commit is missing; through the store first, so shared dependencies are fetched once
+        if not has_commit(dep_dir, pinned) and not (SharedFetch.fetch_dependency(dep_dir) and has_commit(dep_dir, pinned)):
+            bash_cmds.insert(0, ["git", "fetch", "--quiet", "origin"])
+    else:
+        # at the pinned commit; only needs resetting if files were changed
+        result = Terminal.run_bash_cmd(["git", "status", "--porcelain", "--untracked-files=no", "--ignore-submodules=all"], cwd=dep_dir, verbose=False)
+        if result is not None and result.returncode == 0 and len(result.stdout.strip()) == 0:
+            return (None, head_sha, None, "")
+        action = "reset"
+        bash_cmds = [["git", "reset", "--hard", "--quiet"]]
+    for cmd in bash_cmds:
+        result = Terminal.run_bash_cmd(cmd, cwd=dep_dir, verbose=False)
+        if result is None or result.returncode != 0:
+            return (action, head_sha, " ".join(cmd), result.stderr.strip() if result is not None else "")
+    return (action, head_sha, None, "")
+
+def restore_repository(repo_dir: path, max_workers: int=None, should_stop: any=None, on_progress: any=None):
+    """
+    Restores every dependency of a repository, including nested ones, to the commits pinned by their parents.
+    Dependencies are checked and fixed in parallel.
+    param: repo_dir [path] Directory of the repository
+    param: max_workers [int] Optional max number of dependencies worked on at once; defaults to the pool_workers setting
+    param: should_stop [any] Optional function returning True to stop, i.e. a cancelled job; dependencies not started
+    yet are left as they are, and the ones being fixed finish
+    param: on_progress [any] Optional function called with a short progress text as each dependency is checked
+    returns: (repo name, succeeded, failed command, error text, seconds taken, list of changes) where each change is a
+    dict of dependency path, action and the commits it moved from and to
+    """
+    start_time = time.perf_counter()
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    changes = []
+    failed_cmd, err_text = None, ""
+    with SharedFetch.session(), ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        def submit(parent_dir: path, prefix: str):
+            """
+            Starts checking every dependency of a parent.
+            """
+            return {executor.submit(restore_dependency, parent_dir, dep_path, pinned): (parent_dir, f"{prefix}{dep_path}", dep_path, pinned)
+                    for dep_path, pinned in pinned_dependencies(parent_dir).items()}
+        pending = submit(repo_dir, "")
+        stopped = False
+        while len(pending) > 0:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                parent_dir, full_path, dep_path, pinned = pending.pop(future)
+                try:
+                    action, from_sha, dep_failed_cmd, dep_err_text = future.result()
+                except Exception as e: # the worker itself failed
+                    action, from_sha, dep_failed_cmd, dep_err_text = (None, None, "restore", str(e))
+                if action is not None:
+                    changes.append({"dependency": full_path, "action": action, "from": from_sha, "to": pinned, "ok": dep_failed_cmd is None})
+                if on_progress is not None:
+                    on_progress(f"{len(changes)} restored, checked {full_path}")
+                if dep_failed_cmd is not None:
+                    failed_cmd, err_text = (failed_cmd or dep_failed_cmd, f"{err_text}\n{full_path}: {dep_err_text}".strip())
+                    continue # nested dependencies of a broken checkout can not be restored
+                if stopped:
+                    continue
+                # the dependency is at its pinned commit; check its own dependencies
+                pending.update(submit(parent_dir / dep_path, f"{full_path}/"))
+            if not stopped and should_stop is not None and should_stop():
+                # dependencies being fixed finish; the rest are left as they are
+                stopped = True
+                pending = dict([(future, pending[future]) for future in pending if not future.cancel()])
+    if stopped and failed_cmd is None:
+        failed_cmd, err_text = ("cancelled", "")
+    changes.sort(key=lambda change: change["dependency"])
+    return (repo_dir.name, failed_cmd is None, failed_cmd, err_text, time.perf_counter() - start_time, changes)
+
+def restore_repositories(repo_dirs: list, max_workers: int=None):
+    """
+    Restores the dependencies of many repositories at once.
+    param: repo_dirs [list] Directories of the repositories
+    param: max_workers [int] Optional max number of repositories worked on at once; defaults to the pool_workers setting
+    returns: list of results from restore_repository, in the order of the repositories
+    """
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    if len(repo_dirs) == 0:
+        return []
+    with SharedFetch.session(), ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        return list(executor.map(lambda repo_dir: restore_repository(repo_dir, max_workers), repo_dirs))
+
+def format_change(change: dict):
+    """
+    Formats a restored dependency as one colored line.
+    param: change [dict] A change from restore_repository
+    """
+    color = Terminal.Text.GREEN if change["ok"] else Terminal.Text.RED
+    from_sha = change["from"][:7] if change["from"] is not None else "none"
+    return f"{color}{change['action']}{Terminal.Text.RESET} {change['dependency']} {Terminal.Text.GREY}{from_sha} -> {change['to'][:7]}{Terminal.Text.RESET}"
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+from pathlib import Path as path
+import json
+import threading
+
+# default values for every setting GitCAD knows about
+DEFAULTS = {
+    "workspace_roots": ["~/Documents/GitHub"], # folders searched for repositories; new repositories are cloned into the first
+    "workspace_depth": 3, # folder levels searched below each workspace root
+    "pool_type": "thread", # "thread" or "process" worker pool for workspace-wide operations
+    "pool_workers": 8, # max number of repositories worked on at once
+    "background_jobs": True, # run pulls, pushes, restores and updates from the menu as background jobs
+    "jobs_workers": 4, # max number of background jobs running at once
+    "clone_profile": "full", # "full", "blobless", "shallow" or "sparse" clone of new repositories
+    "clone_depth": 1, # number of commits kept by shallow clones
+    "clone_sparse_paths": [], # folders checked out by sparse clones
+    "show_status": True, # show dirty, ahead/behind and outdated pin status of each repository in menus
+    "command_timeout": None, # seconds after which a git command run from a menu is killed; no limit if None
+    "shared_objects": True, # dependencies borrow objects from one shared store instead of each keeping a copy
+    "trace": True, # record the timing, exit code and output size of every command in ~/.gitcad/trace.jsonl
+    "trace_max_kb": 1024, # size after which the trace file is rotated
+    "trace_files": 3, # number of trace files kept, including the one being written
+    "prefetch": False, # fetch every repository and dependency in the background while the menu is open
+    "prefetch_interval": 900, # seconds between background fetches of each remote
+    "prefetch_workers": 2, # max number of background fetches at once
+    "prefetch_max_backoff": 14400, # max seconds to wait before retrying a remote that keeps failing to fetch
+    "maintenance": True, # pack objects, write the commit-graph and drop old stashes in the background while idle
+    "maintenance_interval": 86400, # min seconds between background maintenance of each repository
+    "maintenance_idle": 60, # seconds without a menu operation before background maintenance starts
+    "maintenance_loose_objects": 200, # loose objects after which they are packed
+    "maintenance_max_packs": 8, # packs after which small ones are combined
+    "maintenance_stash_keep": 10, # newest stashes always kept
+    "maintenance_stash_days": 90, # age in days after which stashes past the newest ones kept are dropped
+    "worktree_dir": None, # folder other versions of repositories and dependencies are opened in; ~/.gitcad/worktrees if None
+    "lfs": False, # store CAD files with Git LFS in a shared cache, if git-lfs is installed; rewrites .gitattributes on push
+    "lfs_extensions": ["FCStd", "step", "stp", "stl", "3mf", "iges", "igs", "sldprt", "sldasm", "slddrw", "ipt", "iam", "f3d", "dwg"], # extensions tracked with LFS when pushing
+    "lfs_cache_mb": 20480, # size of the shared LFS cache after which least recently used large files are dropped
+    "lfs_transfers": 8, # large files downloaded at once per checkout
+    "lfs_url": None, # LFS server used instead of each remote's own, i.e. a local stand-in server for testing
+    "bundle_dir": None, # folder offline bundle exports are written to; ~/.gitcad/bundles if None
+    "profile": False, # run each operation under cProfile, saving stats to ~/.gitcad/profiles
+}
+
+_lock = threading.Lock() # guards the in-memory settings
+_cache = None # (stamp of the settings file, settings loaded from it), so most gets skip reading the file
+
+def settings_dir():
+    """
+    Gets the directory GitCAD keeps its settings and caches in. Created if it does not exist.
+    """
+    settings_path = path.home() / ".gitcad"
+    settings_path.mkdir(parents=True, exist_ok=True)
+    return settings_path
+
+def settings_file():
+    """
+    Gets the path of the settings file.
+    """
+    return settings_dir() / "settings.json"
+
+def settings_stamp():
+    """
+    Gets a stamp of the settings file that changes when the file changes or is created.
+    """
+    file_path = settings_file() # HOME can change, i.e. in the benchmark
+    try:
+        stat = file_path.stat()
+        return [str(file_path), stat.st_mtime_ns, stat.st_size]
+    except OSError as e:
+        return [str(file_path), None, None]
+
+def cached():
+    """
+    Gets the settings loaded in memory, reading the settings file again only if it changed since, i.e. edited by hand.
+    Callers must not change the returned dict.
+    """
+    global _cache
+    stamp = settings_stamp()
+    with _lock:
+        if _cache is not None and _cache[0] == stamp:
+            return _cache[1]
+    settings = dict(DEFAULTS)
+    try:
+        with open(settings_file(), "r") as file:
+            settings.update(json.load(file))
+    except Exception as e:
+        # no settings saved yet, or the file is unreadable; use defaults
+        pass
+    with _lock:
+        _cache = (stamp, settings)
+    return settings
+
+def load():
+    """
+    Loads all settings from the settings file, filling in defaults for any that are missing.
+    """
+    return dict(cached())
+
+def get(key: str, default: any=None):
+    """
+    Gets the value of a single setting.
+    param: key [str] The name of the setting
+    param: default [any] Optional value returned if the setting has no value or default
+    """
+    return cached().get(key, default)
+
+def set(key: str, value: any):
+    """
+    Saves the value of a single setting to the settings file.
+    param: key [str] The name of the setting
+    param: value [any] The value to save; must be JSON serializable
+    """
+    global _cache
+    settings = load()
+    settings[key] = value
+    with open(settings_file(), "w") as file:
+        json.dump(settings, file, indent=4)
+    with _lock:
+        _cache = (settings_stamp(), settings)
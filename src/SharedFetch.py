@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path as path
+import threading
+import Terminal
+import Settings
+import RepoStatus
+import ObjectCache
+import Trace
+
+# Coalesces network fetches of dependencies shared by many parents. During a fetch session (one pull, restore or
+# update across many repositories) each remote URL is fetched from the network at most once, into the shared object
+# store (refs/gitcad/<key>/mirror/*). Dependency checkouts then fetch from the store, which is a local copy.
+#
+# Shallow and partial (blobless) dependency clones are left to fetch on their own, since a full fetch into the store
+# would download more than they ask for.
+
+_lock = threading.Lock() # guards the session state
+_depth = 0 # number of open sessions; results are only remembered while one is open
+_results = {} # results of coalesced network calls in the open session
+_key_locks = {} # one lock per network call so threads asking for the same call wait for the first
+
+class session:
+    """
+    Remembers the result of every coalesced network call made inside it, so each is only made once. Sessions nest;
+    results are forgotten when the outermost one ends.
+    """
+    def __enter__(self):
+        global _depth
+        with _lock:
+            _depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _depth
+        with _lock:
+            _depth -= 1
+            if _depth == 0:
+                _results.clear()
+                _key_locks.clear()
+        return False
+
+def once(key: tuple, call: any):
+    """
+    Makes a network call only once per session, returning the remembered result to later callers.
+    Outside a session the call is always made.
+    param: key [tuple] What identifies the call
+    param: call [any] The function making the call
+    """
+    with _lock:
+        if _depth == 0:
+            call_lock = None
+        else:
+            call_lock = _key_locks.setdefault(key, threading.Lock())
+    if call_lock is None:
+        return call()
+    with call_lock:
+        with _lock:
+            if key in _results:
+                return _results[key]
+        result = call()
+        with _lock:
+            if _depth > 0:
+                _results[key] = result
+        return result
+
+def forget_url(url: str):
+    """
+    Forgets every remembered network call made to a remote URL.
+    param: url [str] The remote URL
+    """
+    with _lock:
+        for key in [key for key in _results if len(key) > 1 and key[1] == url]:
+            del _results[key]
+
+def mirror_refs(url: str):
+    """
+    Gets the refs of the store a remote URL's branches are mirrored to.
+    param: url [str] The remote URL
+    """
+    return f"refs/gitcad/{ObjectCache.url_key(url)}/mirror"
+
+def fetch(url: str):
+    """
+    Fetches every branch of a remote URL into the shared object store, once per session.
+    param: url [str] The remote URL
+    returns: True if the fetch succeeded
+    """
+    def fetch_into_store():
+        store = ObjectCache.store_dir()
+        result = Terminal.run_bash_cmd(["git", "--git-dir", str(store), "fetch", "--quiet", "--no-tags", "--no-write-fetch-head", "--prune", url, f"+refs/heads/*:{mirror_refs(url)}/*"], cwd=store, verbose=False)
+        return result is not None and result.returncode == 0
+    return once(("fetch", url), fetch_into_store)
+
+def remote_refs(repo_dir: path, url: str):
+    """
+    Gets the commit of every branch of a remote URL, and of its default branch, in one query without fetching, once
+    per session.
+    param: repo_dir [path] Directory to run from
+    param: url [str] The remote URL
+    returns: dict mapping HEAD and refs/heads/<branch> to commit SHAs, or None if the remote could not be read
+    """
+    def read_remote():
+        result = Terminal.run_bash_cmd(["git", "ls-remote", url, "HEAD", "refs/heads/*"], cwd=repo_dir, verbose=False)
+        if result is None or result.returncode != 0:
+            return None
+        refs = {}
+        for line in result.stdout.splitlines():
+            sha, _, ref = line.partition("\t")
+            refs[ref.strip()] = sha.strip()
+        return refs
+    return once(("ls-remote", url), read_remote)
+
+def ls_remote(repo_dir: path, url: str, ref: str):
+    """
+    Gets the commit a ref of a remote URL points to without fetching. Every ref of a remote is read at once, once per
+    session, however many refs are asked for.
+    param: repo_dir [path] Directory to run from
+    param: url [str] The remote URL
+    param: ref [str] The ref, i.e. refs/heads/main or HEAD
+    returns: the commit SHA, or None if it could not be read
+    """
+    refs = remote_refs(repo_dir, url)
+    return refs.get(ref) if refs is not None else None
+
+def dependency_remote(dep_dir: path):
+    """
+    Gets the remote URL of a dependency checkout if it can fetch through the store.
+    param: dep_dir [path] Directory of the dependency checkout
+    returns: the remote URL, or None if it is not checked out, has no remote, or is a shallow or partial clone
+    """
+    git_path = RepoStatus.git_dir(dep_dir)
+    if git_path is None or (git_path / "shallow").exists():
+        return None
+    result = Terminal.run_bash_cmd(["git", "config", "--get-regexp", r"^remote\.origin\.(url|promisor)$"], cwd=dep_dir, verbose=False)
+    if result is None or result.returncode != 0:
+        return None
+    config = dict([(line.split(maxsplit=1) + [""])[:2] for line in result.stdout.splitlines()])
+    if config.get("remote.origin.promisor") == "true":
+        return None
+    return config.get("remote.origin.url")
+
+def fetch_dependency(dep_dir: path, url: str=None):
+    """
+    Brings a dependency checkout's remote branches up to date, fetching its remote URL from the network at most once
+    per session and then fetching from the store.
+    param: dep_dir [path] Directory of the dependency checkout
+    param: url [str] Optional remote URL of the dependency, if already known
+    returns: True if the dependency was fetched through the store; False if it should fetch on its own
+    """
+    url = url if url is not None else dependency_remote(dep_dir)
+    if url is None or not fetch(url):
+        return False
+    result = Terminal.run_bash_cmd(["git", "fetch", "--quiet", "--no-tags", str(ObjectCache.store_dir()), f"+{mirror_refs(url)}/*:refs/remotes/origin/*"], cwd=dep_dir, verbose=False)
+    return result is not None and result.returncode == 0
+
+def prefetch(repo_dirs: list, max_workers: int=None):
+    """
+    Fetches the pinned commits of every dependency checkout of many repositories that does not have them yet,
+    fetching each remote URL only once, so updating the checkouts afterwards does not need the network.
+    param: repo_dirs [list] Directories of the parent repositories
+    param: max_workers [int] Optional max number of fetches at once; defaults to the pool_workers setting
+    returns: number of distinct remote URLs fetched
+    """
+    import Restore # Restore fetches through this module
+    max_workers = max(1, int(max_workers if max_workers is not None else Settings.get("pool_workers")))
+    # every dependency checkout, including nested ones
+    checkouts = []
+    to_visit = list(repo_dirs)
+    while len(to_visit) > 0:
+        parent_dir = to_visit.pop()
+        for dep_path, pinned in Restore.pinned_dependencies(parent_dir).items():
+            if RepoStatus.git_dir(parent_dir / dep_path) is not None:
+                checkouts.append((parent_dir / dep_path, pinned))
+                to_visit.append(parent_dir / dep_path)
+
+    def missing_commit(checkout: tuple):
+        return not Restore.has_commit(*checkout)
+
+    def fetch_missing(dep_dir: path):
+        url = dependency_remote(dep_dir)
+        return url if url is not None and fetch_dependency(dep_dir, url) else None
+
+    with ThreadPoolExecutor(max_workers=max_workers, **Trace.pool_args()) as executor:
+        missing = [dep_dir for (dep_dir, pinned), is_missing in zip(checkouts, executor.map(missing_commit, checkouts)) if is_missing]
+        with session():
+            urls = set(executor.map(fetch_missing, missing)) - set([None])
+    return len(urls)
@@ -1,8 +1,10 @@
 #!/usr/bin/python3
 from pathlib import Path as path
 import Terminal
+import Trace
 import subprocess
 import sys
+import time
 
 class Screen:
     """
@@ -61,28 +63,214 @@ class Text:
     def __init__(self):
         pass
 
-def run_bash_cmd(cmd: list, cwd:path=None):
+def run_bash_cmd(cmd: list, cwd:path=None, verbose: bool=True):
     """
     Runs a bash command. 
     param: cmd [list] The command to run
     param: cwd [str] Optional current working directory
+    param: verbose [bool] Optional to indicate if the command should be printed; off when run from worker threads
     """
+    start = time.perf_counter()
     try:
         shell = sys.platform.startswith("win") # only use shell on windows
         result = subprocess.run(cmd, cwd=cwd, check=False, text=True, capture_output=True, shell=shell)
+        Trace.record(cmd, cwd, time.perf_counter() - start, result.returncode, result.stdout, result.stderr)
         # print commands printed from the current working directory 
         margin = " "*4 # margin for offset
         # get name from cwd directory and pop off the end    
         repo_name = cwd.__str__().split(slash()).pop()
         cmd_str = " ".join(result.args) # get list of args 
         # format cwd and command line args to show the bash command
-        print(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.YELLOW}{cwd}{slash()}{Terminal.Text.BLUE}{repo_name}>{Terminal.Text.RESET} {cmd_str}")
+        if verbose:
+            print(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.YELLOW}{cwd}{slash()}{Terminal.Text.BLUE}{repo_name}>{Terminal.Text.RESET} {cmd_str}")
         # return results
         return result
     except Exception as e:
+        Trace.record(cmd, cwd, time.perf_counter() - start, None, "", str(e))
         print(f" ERROR : {e}")
     return None
 
+class CommandResult:
+    """
+    The structured result of a command run with run_bash_cmd_async. Has the same args, returncode, stdout and stderr
+    as the result of run_bash_cmd so callers can treat both alike.
+    """
+    def __init__(self, args: list, returncode: int, stdout: str, stderr: str, timed_out: bool=False):
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out # killed for running longer than its timeout
+
+    @property
+    def ok(self):
+        """
+        Checks if the command exited successfully.
+        """
+        return self.returncode == 0 and not self.timed_out
+
+async def run_bash_cmd_async(cmd: list, cwd: path=None, timeout: float=None, on_line: any=None, verbose: bool=True):
+    """
+    Runs a bash command without blocking, streaming its stdout and stderr line by line as it runs.
+    Cancelling the awaiting task kills the command.
+    param: cmd [list] The command to run
+    param: cwd [str] Optional current working directory
+    param: timeout [float] Optional seconds after which the command is killed; no limit if None
+    param: on_line [any] Optional function called with ("stdout" or "stderr", line) for every line of output
+    param: verbose [bool] Optional to indicate if the command and its output should be printed when on_line is None
+    returns: CommandResult
+    """
+    import asyncio # only loaded by callers that run commands asynchronously
+    margin = " "*4 # margin for offset
+    if verbose:
+        print(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.YELLOW}{cwd}{Terminal.Text.BLUE}>{Terminal.Text.RESET} {' '.join(cmd)}")
+    start = time.perf_counter()
+    if sys.platform.startswith("win"): # only use shell on windows
+        process = await asyncio.create_subprocess_shell(subprocess.list2cmdline(cmd), cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    else:
+        process = await asyncio.create_subprocess_exec(*cmd, cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    output = {"stdout": [], "stderr": []}
+
+    async def read_stream(stream: asyncio.StreamReader, name: str):
+        """
+        Reads a stream until it closes, splitting lines on newlines and on the carriage returns git uses for progress.
+        """
+        import codecs
+        # characters split between two chunks are decoded once the rest arrives
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        pending = ""
+        while True:
+            chunk = await stream.read(4096)
+            output[name].append(decoder.decode(chunk, final=not chunk))
+            pending += output[name][-1]
+            if not chunk:
+                break
+            *lines, pending = pending.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+            for line in lines:
+                if len(line.strip()) == 0:
+                    continue
+                if on_line is not None:
+                    on_line(name, line)
+                elif verbose:
+                    print(f"{margin}{margin}{Terminal.Text.GREY}{line}{Terminal.Text.RESET}")
+        if len(pending.strip()) > 0 and on_line is not None:
+            on_line(name, pending)
+        elif len(pending.strip()) > 0 and verbose:
+            print(f"{margin}{margin}{Terminal.Text.GREY}{pending}{Terminal.Text.RESET}")
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(asyncio.gather(read_stream(process.stdout, "stdout"), read_stream(process.stderr, "stderr"), process.wait()), timeout)
+    except asyncio.TimeoutError as e:
+        timed_out = True
+        process.kill()
+        await process.wait()
+    except asyncio.CancelledError as e:
+        # cancelled; stop the command before giving up
+        process.kill()
+        await process.wait()
+        Trace.record(cmd, cwd, time.perf_counter() - start, process.returncode, "".join(output["stdout"]), "".join(output["stderr"]))
+        raise
+    result = CommandResult(cmd, process.returncode, "".join(output["stdout"]), "".join(output["stderr"]), timed_out)
+    Trace.record(cmd, cwd, time.perf_counter() - start, result.returncode, result.stdout, result.stderr, timed_out)
+    return result
+
+async def run_bash_cmds_async(cmds: list, cwd: path=None, timeout: float=None, on_line: any=None, verbose: bool=True):
+    """
+    Runs a list of bash commands one after another without blocking, stopping at the first command that fails.
+    param: cmds [list] The list of commands to run
+    param: cwd [str] Optional current working directory
+    param: timeout [float] Optional seconds after which each command is killed; no limit if None
+    param: on_line [any] Optional function called with ("stdout" or "stderr", line) for every line of output
+    param: verbose [bool] Optional to indicate if the commands and their output should be printed when on_line is None
+    returns: list of CommandResult, the last one being the failed command if any failed
+    """
+    results = []
+    for cmd in cmds:
+        results.append(await run_bash_cmd_async(cmd, cwd=cwd, timeout=timeout, on_line=on_line, verbose=verbose))
+        if not results[-1].ok:
+            break
+    return results
+
+async def gather_bash_cmds_async(jobs: list, max_concurrency: int=8, timeout: float=None, on_line: any=None):
+    """
+    Runs the command lists of many repositories at once without blocking, a bounded number at a time.
+    param: jobs [list] List of (cwd, list of commands) to run
+    param: max_concurrency [int] Optional max number of command lists running at once
+    param: timeout [float] Optional seconds after which each command is killed; no limit if None
+    param: on_line [any] Optional function called with (cwd, "stdout" or "stderr", line) for every line of output
+    returns: list of lists of CommandResult, in the order of the jobs
+    """
+    import asyncio
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run_job(cwd: path, cmds: list):
+        async with semaphore:
+            line_handler = (lambda name, line: on_line(cwd, name, line)) if on_line is not None else None
+            return await run_bash_cmds_async(cmds, cwd=cwd, timeout=timeout, on_line=line_handler, verbose=False)
+
+    return await asyncio.gather(*[run_job(cwd, cmds) for cwd, cmds in jobs])
+
+_keys = [] # keys read but not returned yet, i.e. a held arrow key read in one go
+
+def split_keys(text: str):
+    """
+    Splits what was read from the terminal into keys: escape sequences, i.e. arrow keys, and single characters.
+    param: text [str] The characters read
+    returns: list of keys
+    """
+    keys = []
+    position = 0
+    while position < len(text):
+        end = position + 1
+        if text[position] == "\x1b" and end < len(text) and text[end] == "[":
+            # control sequence: parameters, then a final character from @ to ~
+            end += 1
+            while end < len(text) and not ("@" <= text[end] <= "~"):
+                end += 1
+            end = min(end + 1, len(text))
+        elif text[position] == "\x1b" and end < len(text) and text[end] == "O":
+            end = min(end + 2, len(text)) # i.e. arrow keys in application mode
+        keys.append(text[position:end])
+        position = end
+    return keys
+
+def read_key(timeout: float):
+    """
+    Reads a key press, waiting at most a while for one, so a screen can be redrawn while nothing is pressed.
+    Keys are returned the same as readchar.readkey returns them, one at a time, however many were read at once.
+    param: timeout [float] Max seconds to wait
+    returns: the key, or None if nothing was pressed in time
+    """
+    if len(_keys) > 0:
+        return _keys.pop(0)
+    if sys.platform.startswith("win"):
+        import msvcrt
+        import readchar
+        end = time.monotonic() + timeout
+        while not msvcrt.kbhit() and time.monotonic() < end:
+            time.sleep(0.05)
+        return readchar.readkey() if msvcrt.kbhit() else None
+    import os
+    import select
+    import termios
+    if not sys.stdin.isatty():
+        return sys.stdin.read(1) or None
+    fd = sys.stdin.fileno()
+    old_mode = termios.tcgetattr(fd)
+    mode = termios.tcgetattr(fd)
+    mode[3] &= ~(termios.ICANON | termios.ECHO)
+    try:
+        # switch without flushing, unlike readchar, so keys pressed while the screen was drawn are kept
+        termios.tcsetattr(fd, termios.TCSANOW, mode)
+        if len(select.select([fd], [], [], timeout)[0]) == 0:
+            return None
+        text = os.read(fd, 1024).decode(errors="replace") # every key pressed since, escape sequences whole
+    finally:
+        termios.tcsetattr(fd, termios.TCSANOW, old_mode)
+    _keys.extend(split_keys(text))
+    return _keys.pop(0) if len(_keys) > 0 else None
+
 def slash():
     """
     Returns the slash notation of the operating system.
@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+from pathlib import Path as path
+import json
+import os
+import threading
+import time
+import Settings
+
+# Every command run through Terminal is recorded as one JSON line in ~/.gitcad/trace.jsonl: when it ran, the operation
+# (menu option or batch command) it ran for, the repository, wall time, exit code and bytes of output. The file is
+# rotated once it grows past the trace_max_kb setting, keeping trace_files files in total.
+#
+# The current operation is a module global rather than thread-local, so commands run from worker pool threads are
+# recorded against the operation that started them. Operations nest; only the outermost one is recorded. Background
+# operations are thread-local; worker pools started inside one pass it on to their threads with pool_args.
+
+_lock = threading.Lock() # guards writing and rotating the trace file
+_operation = None # (name, run id) of the operation commands are recorded against
+_enabled = None # trace setting, read once per process
+_thread = threading.local() # operation of background threads, which is not shared with the foreground
+_finished = time.time() # when the last foreground operation ended; starting the program counts as one
+_jobs = 0 # background operations running for the user, i.e. queued menu jobs; they count as foreground work
+
+def trace_file(index: int=0):
+    """
+    Gets the path of a trace file.
+    param: index [int] Optional number of the rotated file; 0 is the file being written
+    """
+    return Settings.settings_dir() / ("trace.jsonl" if index == 0 else f"trace.{index}.jsonl")
+
+def enabled():
+    """
+    Checks if commands should be recorded.
+    """
+    global _enabled
+    if _enabled is None:
+        _enabled = bool(Settings.get("trace"))
+    return _enabled
+
+def rotate():
+    """
+    Moves the trace file aside once it is too big, dropping the oldest rotated file.
+    """
+    max_bytes = int(Settings.get("trace_max_kb")) * 1024
+    try:
+        if trace_file().stat().st_size < max_bytes:
+            return
+    except OSError as e:
+        return
+    files = max(1, int(Settings.get("trace_files")))
+    for index in range(files - 1, 0, -1):
+        if trace_file(index - 1).exists():
+            os.replace(trace_file(index - 1), trace_file(index))
+    if files == 1:
+        trace_file().unlink(missing_ok=True)
+
+def record(cmd: list, cwd: path, seconds: float, returncode: int, stdout: str, stderr: str, timed_out: bool=False):
+    """
+    Records a finished command to the trace file.
+    param: cmd [list] The command that ran
+    param: cwd [path] The directory it ran in
+    param: seconds [float] Wall time it took
+    param: returncode [int] Its exit code, or None if it could not be started
+    param: stdout [str] Its output
+    param: stderr [str] Its error output
+    param: timed_out [bool] Optional to indicate it was killed for running too long
+    """
+    if not enabled():
+        return
+    operation, run_id = getattr(_thread, "operation", None) or _operation or (None, None)
+    entry = {
+        "time": round(time.time(), 3),
+        "operation": operation,
+        "run": run_id,
+        "repo": path(cwd).name if cwd is not None else None,
+        "cwd": str(cwd) if cwd is not None else None,
+        "cmd": [str(arg) for arg in cmd],
+        "seconds": round(seconds, 4),
+        "returncode": returncode,
+        "timed_out": timed_out,
+        "stdout_bytes": len((stdout or "").encode(errors="replace")),
+        "stderr_bytes": len((stderr or "").encode(errors="replace")),
+        "pid": os.getpid(),
+    }
+    line = json.dumps(entry) + "\n"
+    try:
+        with _lock:
+            rotate()
+            with open(trace_file(), "a") as file:
+                file.write(line)
+    except OSError as e:
+        pass # tracing must never break a command
+
+def new_run_id():
+    """
+    Gets a new id for a run of an operation, unique across processes.
+    """
+    return f"{int(time.time()*1000):x}-{os.getpid()}-{threading.get_ident() % 10000}"
+
+class operation:
+    """
+    Records commands run inside it against a named operation, i.e. a menu option or batch command. With the profile
+    setting on, the outermost operation is also run under cProfile and its stats saved to ~/.gitcad/profiles.
+    """
+    def __init__(self, name: str, profile: bool=None):
+        """
+        Creates an operation.
+        param: name [str] Name of the operation
+        param: profile [bool] Optional to force profiling on or off; defaults to the profile setting
+        """
+        self.name = name
+        self.profile = profile
+        self.outermost = False
+        self.profiler = None
+
+    def __enter__(self):
+        global _operation
+        if _operation is None:
+            self.outermost = True
+            _operation = (self.name, new_run_id())
+            if self.profile or (self.profile is None and Settings.get("profile")):
+                import cProfile # only loaded when profiling
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _operation, _finished
+        if self.outermost:
+            if self.profiler is not None:
+                self.profiler.disable()
+                profiles_dir = Settings.settings_dir() / "profiles"
+                profiles_dir.mkdir(parents=True, exist_ok=True)
+                self.profiler.dump_stats(profiles_dir / f"{self.name.replace(' ', '_')}-{_operation[1]}.prof")
+            _operation = None
+            _finished = time.time()
+        return False
+
+class background:
+    """
+    Records commands run inside it by the current thread against a named background operation, i.e. prefetching,
+    instead of whatever the foreground is doing.
+    """
+    def __init__(self, name: str, run_id: str=None, foreground: bool=False):
+        """
+        Creates a background operation.
+        param: name [str] Name of the operation
+        param: run_id [str] Optional id shared by every thread working on the same run of the operation
+        param: foreground [bool] Optional to count it as foreground work the user is waiting on, i.e. a queued menu
+        job, so prefetching and maintenance hold off while it runs
+        """
+        self.name = name
+        self.run_id = run_id if run_id is not None else new_run_id()
+        self.foreground = foreground
+
+    def __enter__(self):
+        global _jobs
+        _thread.operation = (self.name, self.run_id)
+        if self.foreground:
+            with _lock:
+                _jobs += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _jobs, _finished
+        _thread.operation = None
+        if self.foreground:
+            with _lock:
+                _jobs -= 1
+                _finished = time.time()
+        return False
+
+def inherit(operation: tuple):
+    """
+    Records commands run by the current thread against an operation; the initializer of worker pool threads.
+    param: operation [tuple] (name, run id) of the operation, or None for the foreground operation
+    """
+    _thread.operation = operation
+
+def pool_args():
+    """
+    Gets the args that make a worker pool's threads record commands against the background operation of the thread
+    starting it, i.e. a menu job, instead of the foreground operation.
+    returns: dict of initializer args to pass to an executor
+    """
+    return {"initializer": inherit, "initargs": (getattr(_thread, "operation", None),)}
+
+def busy():
+    """
+    Checks if a foreground operation or job is running.
+    """
+    return _operation is not None or _jobs > 0
+
+def idle_seconds():
+    """
+    Gets how long no foreground operation or job has been running, or 0 while one is.
+    """
+    return 0.0 if busy() else time.time() - _finished
+
+def load(operation_name: str=None):
+    """
+    Loads recorded commands from the trace files, oldest first.
+    param: operation_name [str] Optional name of the only operation to load
+    """
+    entries = []
+    for index in range(max(1, int(Settings.get("trace_files"))) - 1, -1, -1):
+        try:
+            with open(trace_file(index), "r") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError as e:
+                        continue # a line cut off by a crash
+                    if operation_name is None or entry.get("operation") == operation_name:
+                        entries.append(entry)
+        except OSError as e:
+            pass
+    return entries
+
+def command_name(cmd: list):
+    """
+    Gets the program and subcommand of a command, i.e. "git fetch" for git --git-dir x fetch --quiet.
+    param: cmd [list] The command
+    """
+    words = cmd[:1]
+    skip = False # the next arg is the value of a git option
+    for arg in cmd[1:]:
+        if skip:
+            skip = False
+        elif arg in ("-C", "-c", "--git-dir", "--work-tree"):
+            skip = True
+        elif not arg.startswith("-"):
+            words.append(arg)
+            break
+    return " ".join(words)
+
+def summary(operation_name: str=None, top: int=5):
+    """
+    Summarizes recorded commands per operation: how often it ran, and its slowest repositories and commands.
+    param: operation_name [str] Optional name of the only operation to summarize
+    param: top [int] Optional number of repositories and commands listed per operation
+    returns: dict mapping an operation name to its summary, slowest operations first
+    """
+    operations = {}
+    for entry in load(operation_name):
+        name = entry.get("operation") or "(none)"
+        summary_entry = operations.setdefault(name, {"runs": set(), "commands": 0, "nonzero_exits": 0, "seconds": 0.0, "repos": {}, "cmds": {}})
+        summary_entry["runs"].add(entry.get("run"))
+        summary_entry["commands"] += 1
+        summary_entry["nonzero_exits"] += 1 if entry.get("returncode") != 0 or entry.get("timed_out") else 0
+        summary_entry["seconds"] += entry["seconds"]
+        summary_entry["repos"][entry.get("repo")] = summary_entry["repos"].get(entry.get("repo"), 0.0) + entry["seconds"]
+        cmd_name = command_name(entry["cmd"])
+        cmd_stats = summary_entry["cmds"].setdefault(cmd_name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+        cmd_stats["count"] += 1
+        cmd_stats["seconds"] += entry["seconds"]
+        cmd_stats["max_seconds"] = max(cmd_stats["max_seconds"], entry["seconds"])
+    result = {}
+    for name, summary_entry in sorted(operations.items(), key=lambda item: -item[1]["seconds"]):
+        slowest_repos = sorted(summary_entry["repos"].items(), key=lambda item: -item[1])[:top]
+        slowest_cmds = sorted(summary_entry["cmds"].items(), key=lambda item: -item[1]["seconds"])[:top]
+        result[name] = {
+            "runs": len(summary_entry["runs"]),
+            "commands": summary_entry["commands"],
+            "nonzero_exits": summary_entry["nonzero_exits"],
+            "seconds": round(summary_entry["seconds"], 3),
+            "slowest_repos": [{"repo": repo, "seconds": round(seconds, 3)} for repo, seconds in slowest_repos],
+            "slowest_commands": [{"cmd": cmd_name, "count": stats["count"], "seconds": round(stats["seconds"], 3), "max_seconds": round(stats["max_seconds"], 3)} for cmd_name, stats in slowest_cmds],
+        }
+    return result
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+from pathlib import Path as path
+import json
+import os
+import threading
+import Settings
+
+# Finds the git repositories under the workspace roots (the workspace_roots setting; the first is where new
+# repositories are cloned). Folders are searched down to workspace_depth levels, stopping at each repository found.
+#
+# What was found is cached in ~/.gitcad/repo_index.json with the mtime of every folder searched. A folder's mtime
+# changes when anything is added to or removed from it, so only folders whose mtime changed are listed again; the rest
+# cost one stat each, which keeps startup fast on large or network-mounted trees.
+
+_lock = threading.Lock() # guards the in-memory index
+_index = None # in-memory copy of the repository index
+INDEX_VERSION = 2 # bump when the layout of the index file changes
+
+def index_file():
+    """
+    Gets the path of the repository index file.
+    """
+    return Settings.settings_dir() / "repo_index.json"
+
+def load():
+    """
+    Loads the repository index, from memory if already loaded or else from disk.
+    The index maps a root to every folder searched under it: its mtime, if it is a repository, and its subfolders.
+    """
+    global _index
+    if _index is not None:
+        return _index
+    try:
+        with open(index_file(), "r") as file:
+            _index = json.load(file)
+        if _index.get("version") != INDEX_VERSION:
+            raise ValueError("outdated repository index")
+    except Exception as e:
+        # no index yet, unreadable, or old; start a new one
+        _index = {"version": INDEX_VERSION, "roots": {}}
+    return _index
+
+def save(index: dict):
+    """
+    Saves the repository index to disk.
+    param: index [dict] The index to save
+    """
+    with open(index_file(), "w") as file:
+        json.dump(index, file)
+
+def roots():
+    """
+    Gets the configured workspace roots, the first being where new repositories are cloned.
+    """
+    configured = Settings.get("workspace_roots") or ["~/Documents/GitHub"]
+    return [path(root).expanduser().absolute() for root in configured]
+
+def workspace_roots(cwd: path):
+    """
+    Gets the roots searched for repositories of a working directory: every configured root if it is the first one
+    (the GitHub current working directory), or else only the working directory itself, i.e. one given with --cwd.
+    param: cwd [path] The GitHub current working directory
+    """
+    configured = roots()
+    return configured if path(cwd).absolute() == configured[0] else [path(cwd).absolute()]
+
+def is_repository(directory: path):
+    """
+    Checks if a folder is a git repository, including worktrees whose .git is a file.
+    param: directory [path] The folder
+    """
+    return (directory / ".git").exists()
+
+def scan_root(root: path, cached: dict, max_depth: int):
+    """
+    Searches a root for repositories, listing only folders whose mtime changed since they were cached.
+    param: root [path] The root folder
+    param: cached [dict] Maps each folder searched last time to [mtime, is repository, subfolder names, if its
+    subfolders were left out for being deeper than max_depth]
+    param: max_depth [int] Number of folder levels searched below the root
+    returns: (the folders searched now, in the same layout; if anything differs from the cached folders)
+    """
+    folders = {}
+    changed = False
+    to_visit = [(root, 0)]
+    while len(to_visit) > 0:
+        directory, depth = to_visit.pop()
+        try:
+            stamp = directory.stat().st_mtime_ns
+        except OSError as e:
+            changed = changed or str(directory) in cached # removed since it was listed
+            continue
+        entry = cached.get(str(directory))
+        if entry is None or entry[0] != stamp or (entry[3] and depth < max_depth):
+            # new or changed folder, or one left unlisted when the depth setting was lower; list it again
+            changed = True
+            repo = is_repository(directory)
+            subfolders = []
+            if not repo and depth < max_depth:
+                try:
+                    subfolders = sorted([item.name for item in os.scandir(directory)
+                                         if not item.name.startswith(".") and item.is_dir(follow_symlinks=False)])
+                except OSError as e:
+                    pass # unreadable folder; leave it empty
+            entry = [stamp, repo, subfolders, not repo and depth >= max_depth]
+        elif not entry[1] and depth >= max_depth and len(entry[2]) > 0:
+            # searched deeper than the current depth setting
+            changed = True
+            entry = [stamp, False, [], True]
+        folders[str(directory)] = entry
+        if not entry[1]:
+            to_visit.extend([(directory / name, depth + 1) for name in entry[2]])
+    return (folders, changed or len(folders) != len(cached))
+
+def repositories(cwd: path):
+    """
+    Gets every repository under the roots of a working directory. Repositories with the same name as one found
+    earlier are left out, since repositories are known by name.
+    param: cwd [path] The GitHub current working directory
+    returns: list of repository directories, sorted by root and then by name
+    """
+    max_depth = max(0, int(Settings.get("workspace_depth")))
+    repo_dirs = []
+    names = set()
+    with _lock:
+        index = load()
+        changed = False
+        for root in workspace_roots(cwd):
+            folders, root_changed = scan_root(root, index["roots"].get(str(root), {}), max_depth)
+            if root_changed:
+                index["roots"][str(root)] = folders
+                changed = True
+            for folder in sorted([path(folder) for folder, entry in folders.items() if entry[1]], key=lambda folder: (folder.name, str(folder))):
+                if folder.name not in names:
+                    names.add(folder.name)
+                    repo_dirs.append(folder)
+        if changed:
+            save(index)
+    return repo_dirs
+
+def repository_dirs(cwd: path):
+    """
+    Gets the directory of every repository under the roots of a working directory by name.
+    param: cwd [path] The GitHub current working directory
+    """
+    return dict([(repo_dir.name, repo_dir) for repo_dir in repositories(cwd)])
+
+def repo_dir(cwd: path, repo_name: str):
+    """
+    Gets the directory of a repository by name, wherever it is under the roots of a working directory.
+    param: cwd [path] The GitHub current working directory
+    param: repo_name [str] Name of the repository
+    returns: its directory, or the working directory joined with the name if it was not found
+    """
+    return repository_dirs(cwd).get(repo_name, path(cwd) / repo_name)
@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+from pathlib import Path as path
+import json
+import re
+import shutil
+import threading
+import time
+import Terminal
+import Settings
+import RepoStatus
+import ObjectCache
+import SharedFetch
+import LargeFiles
+
+# Opens other versions of a repository or dependency checkout next to the one in use, as git worktrees. A worktree
+# shares the objects of the checkout it was opened from, and its own dependencies borrow from the shared store, so
+# opening a version only writes its files; nothing is downloaded again and the checkout in use is not touched.
+# Opening another version under the same label checks it out over the old one, rewriting only the files that differ.
+#
+# Opened versions are tracked in ~/.gitcad/worktrees.json so they can be listed and cleaned up.
+
+_lock = threading.Lock() # guards the worktrees file
+
+def worktrees_dir():
+    """
+    Gets the folder versions are opened in, from the worktree_dir setting or else ~/.gitcad/worktrees.
+    """
+    configured = Settings.get("worktree_dir")
+    return path(configured).expanduser() if configured else Settings.settings_dir() / "worktrees"
+
+def state_file():
+    """
+    Gets the path of the file tracking opened versions.
+    """
+    return Settings.settings_dir() / "worktrees.json"
+
+def load_state():
+    """
+    Loads the opened versions.
+    """
+    try:
+        with open(state_file(), "r") as file:
+            return json.load(file)
+    except Exception as e:
+        return {}
+
+def save_state(state: dict):
+    """
+    Saves the opened versions.
+    param: state [dict] Maps the folder of each opened version to what it was opened from and at
+    """
+    with open(state_file(), "w") as file:
+        json.dump(state, file, indent=4)
+
+def label_for(rev: str):
+    """
+    Gets a folder name for a commit, tag or branch.
+    param: rev [str] The commit, tag or branch
+    """
+    return re.sub(r"[^A-Za-z0-9._-]", "_", rev.strip()) or "HEAD"
+
+def resolve(checkout: path, rev: str):
+    """
+    Gets the commit of a commit, tag or branch of a checkout, fetching it if the checkout does not have it yet.
+    Dependencies fetch through the shared store.
+    param: checkout [path] Directory of the repository or dependency checkout
+    param: rev [str] The commit, tag or branch
+    returns: the commit SHA, or None if it does not exist
+    """
+    def rev_parse():
+        for candidate in (rev, f"origin/{rev}"):
+            result = Terminal.run_bash_cmd(["git", "rev-parse", "--verify", "--quiet", f"{candidate}^{{commit}}"], cwd=checkout, verbose=False)
+            if result is not None and result.returncode == 0:
+                return result.stdout.strip()
+        return None
+    sha = rev_parse()
+    if sha is None:
+        SharedFetch.fetch_dependency(checkout)
+        Terminal.run_bash_cmd(["git", "fetch", "--quiet", "--tags", "origin"], cwd=checkout, verbose=False)
+        sha = rev_parse()
+    return sha
+
+def open_version(checkout: path, name: str, rev: str, label: str=None, with_dependencies: bool=True):
+    """
+    Opens a repository or dependency checkout at a commit, tag or branch in its own folder, sharing objects with the
+    checkout. This runs quietly so it can be used from a worker pool.
+    param: checkout [path] Directory of the repository or dependency checkout
+    param: name [str] Name of the checkout, i.e. Main/dep/StandardCAD; the version's folder is named after it
+    param: rev [str] The commit, tag or branch
+    param: label [str] Optional name of the version's folder; defaults to the rev. An open version with the same
+    label is switched to the rev.
+    param: with_dependencies [bool] Optional to check out the dependencies the version pins as well
+    returns: (folder of the version, commit SHA, failed command, error text)
+    """
+    worktree = worktrees_dir() / name.replace("/", "-") / label_for(label or rev)
+    sha = resolve(checkout, rev)
+    if sha is None:
+        return (worktree, None, "git rev-parse", f"{rev} not found in {name}")
+    state = load_state()
+    entry = state.get(str(worktree))
+    if entry is not None and entry["source"] != str(checkout.absolute()):
+        return (worktree, sha, "git worktree add", f"{worktree} is already a version of {entry['name']}")
+    if entry is not None and RepoStatus.git_dir(worktree) is not None:
+        # switching versions only rewrites the files that differ
+        bash_cmds = [(["git", "checkout", "--quiet", "--force", "--detach", sha], worktree)]
+    else:
+        worktree.parent.mkdir(parents=True, exist_ok=True)
+        bash_cmds = [(["git", "worktree", "add", "--quiet", "--force", "--detach", str(worktree), sha], checkout)]
+    if with_dependencies:
+        bash_cmds.append((["git"] + LargeFiles.config_args() + ["submodule", "update", "--init", "--recursive", "--force"] + ObjectCache.reference_args(), worktree))
+    for cmd, cwd in bash_cmds:
+        result = Terminal.run_bash_cmd(cmd, cwd=cwd, verbose=False)
+        if result is None or result.returncode != 0:
+            return (worktree, sha, " ".join(cmd), result.stderr.strip() if result is not None else "")
+    if with_dependencies:
+        ObjectCache.absorb_repository(worktree)
+    with _lock:
+        state = load_state()
+        state[str(worktree)] = {"name": name, "source": str(checkout.absolute()), "rev": rev, "sha": sha, "opened": time.time()}
+        save_state(state)
+    return (worktree, sha, None, "")
+
+def list_versions():
+    """
+    Gets the opened versions, dropping ones whose folder was deleted by hand.
+    returns: list of dicts of folder, name, source checkout, rev, SHA and when it was opened, sorted by name and rev
+    """
+    with _lock:
+        state = load_state()
+        missing = [worktree for worktree in state if RepoStatus.git_dir(path(worktree)) is None]
+        for worktree in missing:
+            del state[worktree]
+        if len(missing) > 0:
+            save_state(state)
+    return sorted([dict(entry, path=worktree) for worktree, entry in state.items()], key=lambda entry: (entry["name"], entry["rev"]))
+
+def sources(worktrees: list=None):
+    """
+    Gets the checkouts opened versions were opened from, which removing them changes.
+    param: worktrees [list] Optional folders of the versions; every opened version if None
+    returns: sorted list of checkout directories
+    """
+    with _lock:
+        state = load_state()
+    return sorted(set([path(entry["source"]) for worktree, entry in state.items() if worktrees is None or worktree in [str(folder) for folder in worktrees]]), key=str)
+
+def remove_version(worktree: path):
+    """
+    Removes an opened version: its folder and what its checkout knows about it. Changes made in it are lost.
+    param: worktree [path] Folder of the version
+    returns: True if it was removed
+    """
+    with _lock:
+        state = load_state()
+        entry = state.pop(str(worktree), None)
+        save_state(state)
+    if entry is None:
+        return False
+    source = path(entry["source"])
+    result = None
+    if RepoStatus.git_dir(source) is not None:
+        result = Terminal.run_bash_cmd(["git", "worktree", "remove", "--force", "--force", str(worktree)], cwd=source, verbose=False)
+    if result is None or result.returncode != 0:
+        shutil.rmtree(worktree, ignore_errors=True)
+    if RepoStatus.git_dir(source) is not None:
+        Terminal.run_bash_cmd(["git", "worktree", "prune"], cwd=source, verbose=False)
+    # drop the checkout's folder once its last version is gone
+    try:
+        worktree.parent.rmdir()
+    except OSError as e:
+        pass
+    return True
+
+def prune(max_age_days: float=None):
+    """
+    Cleans up opened versions: forgets ones deleted by hand or whose checkout is gone, and removes ones opened more
+    than a number of days ago.
+    param: max_age_days [float] Optional age in days after which versions are removed; none are removed if None
+    returns: list of folders of the versions removed or forgotten
+    """
+    cleaned = []
+    with _lock:
+        state = load_state()
+        sources = set([entry["source"] for entry in state.values()])
+    for worktree, entry in state.items():
+        expired = max_age_days is not None and time.time() - entry["opened"] > max_age_days * 86400
+        if expired or RepoStatus.git_dir(path(entry["source"])) is None or RepoStatus.git_dir(path(worktree)) is None:
+            remove_version(path(worktree))
+            cleaned.append(worktree)
+    # let git forget worktrees deleted by hand
+    for source in sources:
+        if RepoStatus.git_dir(path(source)) is not None:
+            Terminal.run_bash_cmd(["git", "worktree", "prune"], cwd=path(source), verbose=False)
+    return cleaned
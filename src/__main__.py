@@ -1,8 +1,37 @@
+import sys
+
+if getattr(sys, "frozen", False): # needed for process pools in the packaged executables
+    import multiprocessing
+    multiprocessing.freeze_support()
+
+# batch commands skip loading the interactive menu
+if __name__ == "__main__" and len(sys.argv) > 1:
+    import Cli
+    sys.exit(Cli.main(sys.argv[1:]))
+
 from GUIMenu import GUIMenu
 from pathlib import Path as path
 import Terminal
 import Handler
-import sys
+import Assembly
+import Bundle
+import CloneProfile
+import ChangeCache
+import DiskUsage
+import Jobs
+import LargeFiles
+import Maintenance
+import ObjectCache
+import Prefetch
+import Restore
+import Settings
+import SharedFetch
+import Trace
+import Workspace
+import Worktree
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
 
 def handle_clone_repository(cwd: path):
     """
@@ -14,37 +43,103 @@ def handle_clone_repository(cwd: path):
     print(f"\n{margin}Lets {Terminal.Text.YELLOW}clone{Terminal.Text.END} from GitHub.\n")
     # get online GitHub repo URL
     repo_url = input(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}Please input the GitHub Repository URL: {Terminal.Text.RESET}")
+    # get how to clone it; the last choices are the defaults
+    profile, depth, sparse_paths = handle_clone_profile_prompt()
     
     try: # attempt to clone
-        Terminal.run_bash_cmd(["git", "clone", repo_url], cwd=str(cwd))
-        # import submodule/dependencies with cloned repo
         repo_name = repo_url.split(sep="/").pop().replace(".git", "")
         repo_dir = cwd / path(repo_name) # repo directory after cloning
-        Terminal.run_bash_cmd(["git", "submodule", "update", "--init", "--recursive"], cwd=str(repo_dir))
+        cwd_cmds, repo_cmds = CloneProfile.clone_bash_cmds(repo_url, profile, depth, sparse_paths)
+        with Handler.handle_repository_lock([repo_dir], f"clone {repo_name}"):
+            # stream the clone's progress while it runs
+            results = asyncio.run(Terminal.run_bash_cmds_async(cwd_cmds, cwd=str(cwd), timeout=Settings.get("command_timeout")))
+            if not results[-1].ok:
+                raise RuntimeError(results[-1].stderr)
+            # import submodule/dependencies with cloned repo
+            results = asyncio.run(Terminal.run_bash_cmds_async(repo_cmds, cwd=str(repo_dir), timeout=Settings.get("command_timeout")))
+            if not results[-1].ok:
+                raise RuntimeError(results[-1].stderr)
+            # share the objects of the new dependency clones with the rest of the workspace
+            ObjectCache.absorb_repository(repo_dir)
+            # download the large files of the repository and its dependencies at once
+            if not all([result[1] for result in LargeFiles.pull_repositories([repo_dir])]):
+                raise RuntimeError("failed to download large files")
         input(f"\n{Terminal.Text.BOLD}{Terminal.Text.GREEN}Repository successfully cloned.{Terminal.Text.RESET} Press enter to continue.")
     except: # handle failed cloning
         input(f"\n{Terminal.Text.BOLD}{Terminal.Text.RED}Failed to clone the repository.{Terminal.Text.RESET} Press enter to continue.")
     # clear the screen once done with menu
     Terminal.Screen.clear_screen()
 
+def handle_clone_profile_prompt():
+    """
+    Prompts for how to clone a repository: full, blobless, shallow (with a depth) or sparse (with folders).
+    The choices are saved as the defaults for the next clone.
+    returns: (profile, depth, sparse paths)
+    """
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    profile = Settings.get("clone_profile")
+    depth = Settings.get("clone_depth")
+    sparse_paths = Settings.get("clone_sparse_paths")
+    # get the clone profile
+    answer = input(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}Clone profile {Terminal.Text.CYAN}[{'/'.join(CloneProfile.PROFILES)}] (default {profile}): {Terminal.Text.RESET}").strip().lower()
+    profile = answer if answer in CloneProfile.PROFILES else profile
+    if profile == CloneProfile.SHALLOW:
+        answer = input(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}Number of commits to keep {Terminal.Text.CYAN}(default {depth}): {Terminal.Text.RESET}").strip()
+        depth = int(answer) if answer.isdigit() and int(answer) > 0 else depth
+    elif profile == CloneProfile.SPARSE:
+        answer = input(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}Folders to check out, separated by commas {Terminal.Text.CYAN}(default {', '.join(sparse_paths) or 'top-level files only'}): {Terminal.Text.RESET}").strip()
+        sparse_paths = [folder.strip() for folder in answer.split(",") if len(folder.strip()) > 0] if len(answer) > 0 else sparse_paths
+    Settings.set("clone_profile", profile)
+    Settings.set("clone_depth", depth)
+    Settings.set("clone_sparse_paths", sparse_paths)
+    return (profile, depth, sparse_paths)
+
 def handle_pull_repository(cwd: path):
     """
     Handles pulling an online GitHub repository to update the locally cloned one. This handler is for the main menu. 
     param: cwd [str] The GitHub current working directory
     """
-    Handler.handle_repository_menu(
+    background = Settings.get("background_jobs")
+    local_repo = Handler.handle_repository_menu(
         cwd=cwd, 
         menu_title="Here are your local repos.",
         subtitle_text=f"Select the one you want to {Terminal.Text.YELLOW}pull changes{Terminal.Text.CYAN} from GitHub for.", 
-        bash_cmds=[
-            # stash (keep) local changes and pull from github
-            ["git", "stash"],
-            ["git", "fetch", "origin"],
-            ["git", "reset", "--hard", "origin/main"],
-            ["git", "submodule", "update", "--init", "--recursive"]],
-        success_msg="Successfully pulled the repository.",
-        err_msg="Failed to pull the repository."
+        bash_cmds=[] if background else CloneProfile.pull_bash_cmds,
+        success_msg="" if background else "Successfully pulled the repository.",
+        err_msg="" if background else "Failed to pull the repository.",
+        pause_prompt=not background,
+        auto_close=not background
     )
+    # pull in the background, unless the menu was exited
+    if background and not (local_repo.__contains__('<') and local_repo.__contains__('>')):
+        repo_dir = Workspace.repo_dir(cwd, local_repo)
+        Jobs.submit("pull_repository", f"pull {local_repo}", [repo_dir], functools.partial(pull_job, repo_dirs=[repo_dir]))
+        Terminal.Screen.clear_screen()
+
+def handle_pull_all_repositories(cwd: path):
+    """
+    Handles pulling every local repository from GitHub at once on a worker pool. This handler is for the main menu.
+    param: cwd [str] The GitHub current working directory
+    """
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    if Settings.get("background_jobs"):
+        # one job holding every repository, so shared dependencies are still fetched once for all of them
+        repo_dirs = Handler.handle_local_repositories(cwd)
+        Jobs.submit("pull_all_repositories", f"pull all {len(repo_dirs)} repositories", repo_dirs, functools.partial(pull_job, repo_dirs=repo_dirs))
+        Terminal.Screen.clear_screen()
+        return
+    print(f"\n{margin}Lets {Terminal.Text.YELLOW}pull all{Terminal.Text.END} repositories from GitHub.\n")
+    repo_dirs = Handler.handle_local_repositories(cwd)
+    with Handler.handle_repository_lock(repo_dirs, f"pull all {len(repo_dirs)} repositories"):
+        results = Handler.handle_pull_repositories(repo_dirs=repo_dirs)
+    # print summary of successes and failures
+    failed = [result for result in results if not result[1]]
+    print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}{len(results) - len(failed)} pulled{Terminal.Text.RESET}, {Terminal.Text.BOLD}{Terminal.Text.RED}{len(failed)} failed{Terminal.Text.RESET}")
+    for repo_name, succeeded, failed_cmd, err_text, elapsed in failed:
+        print(f"{margin}  {Terminal.Text.RED}{repo_name}{Terminal.Text.RESET}: {failed_cmd}")
+    input(f"\n{margin}Press enter to continue.")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
 
 def handle_push_repository(cwd: path):
     """
@@ -66,20 +161,91 @@ def handle_push_repository(cwd: path):
     # check if the menu was exited
     if local_repo.__contains__('<') and local_repo.__contains__('>'):
         return
-    # get commit message to push
-    commit_message = input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.BLUE}What changes were made? {Terminal.Text.CYAN}Press enter when done, but type here: {Terminal.Text.RESET}")
-    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    repo_dir = Workspace.repo_dir(cwd, local_repo)
+    # track new CAD files with LFS, then preview the files whose content really changed
+    with Handler.handle_repository_lock([repo_dir], f"push {local_repo}"):
+        LargeFiles.track(repo_dir)
+        changes, unchanged = ChangeCache.changed_files(repo_dir)
+    print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.UNDERLINE}Changes to push in {local_repo}:{Terminal.Text.RESET}")
+    for change in changes:
+        print(f"{margin}  {ChangeCache.format_change(change)}")
+    if len(changes) == 0:
+        print(f"{margin}  No files changed.")
+    total_size = sum([change[2] for change in changes])
+    print(f"{margin}{Terminal.Text.GREY}{len(changes)} changed ({ChangeCache.format_size(total_size)}), {unchanged} rewritten with the same content left out{Terminal.Text.RESET}")
+    # get commit message to push, only if there is something to commit
+    commit_message = ""
+    if len(changes) > 0:
+        commit_message = input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.BLUE}What changes were made? {Terminal.Text.CYAN}Press enter when done, but type here: {Terminal.Text.RESET}")
+    if Settings.get("background_jobs"):
+        Jobs.submit("push_repository", f"push {local_repo}", [repo_dir], functools.partial(Jobs.run_bash_cmds, repo_dir=repo_dir, bash_cmds=Handler.push_bash_cmds(commit_message)))
+        input(f"\n{margin}{Terminal.Text.GREEN}Pushing in the background.{Terminal.Text.RESET} Press enter to continue.\n")
+        Terminal.Screen.clear_screen()
+        return
     # try to push
-    try:
-        Terminal.run_bash_cmd(["git", "add", "."], cwd=cwd / path(local_repo))
-        Terminal.run_bash_cmd(["git", "commit", "-m", commit_message], cwd=cwd / path(local_repo))
-        Terminal.run_bash_cmd(["git", "push"], cwd=cwd / path(local_repo))
+    succeeded, result = True, None
+    with Handler.handle_repository_lock([repo_dir], f"push {local_repo}"):
+        for cmd in Handler.changes_push_bash_cmds(commit_message, repo_dir, changes):
+            result = Terminal.run_bash_cmd(cmd, cwd=repo_dir)
+            if result is None or result.returncode != 0:
+                succeeded = False
+                break
+    if succeeded:
         input(f"\n{margin}{Terminal.Text.GREEN}Successfully pushed the repository to GitHub.{Terminal.Text.RESET} Press enter to continue.\n")
-    except:
-        input(f"\n{margin}{Terminal.Text.RED}Did not push changes. It's possible there are no changes to push.{Terminal.Text.RESET} Press enter to continue.\n")
+    else:
+        print(f"{margin}{Terminal.Text.GREY}{result.stderr.strip() if result is not None else ''}{Terminal.Text.RESET}")
+        input(f"\n{margin}{Terminal.Text.RED}Did not push changes.{Terminal.Text.RESET} Press enter to continue.\n")
     # clear the screen once done with menu
     Terminal.Screen.clear_line()
 
+def handle_push_assembly(cwd: path):
+    """
+    Handles pushing an assembly and every dependency changed inside it back to GitHub, dependencies first, so each
+    parent records the versions its dependencies were just pushed at. This is for the main menu.
+    param: cwd [str] The GitHub current working directory
+    """
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    # get the assembly from the menu
+    root_repo = Handler.handle_repository_menu(
+        cwd=cwd,
+        menu_title="Here are your local repos.",
+        subtitle_text=f"Select the {Terminal.Text.YELLOW}assembly{Terminal.Text.CYAN} to {Terminal.Text.YELLOW}push changes{Terminal.Text.CYAN} back to GitHub for, with its changed dependencies.",
+        bash_cmds=[],
+        success_msg="",
+        err_msg="",
+        pause_prompt=False,
+        auto_close=False
+    )
+    # check if the menu was exited
+    if root_repo.__contains__('<') and root_repo.__contains__('>'):
+        Terminal.Screen.clear_screen()
+        return
+    repo_dir = Workspace.repo_dir(cwd, root_repo)
+    # preview what changed in each repository and dependency
+    with Handler.handle_repository_lock([repo_dir], f"push {root_repo} assembly"):
+        tree, changes = Assembly.assembly_changes(repo_dir)
+    print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.UNDERLINE}Changes to push in the {root_repo} assembly:{Terminal.Text.RESET}")
+    for checkout in sorted(changes, key=lambda checkout: -len(checkout.parts)):
+        print(f"{margin}  {Terminal.Text.BLUE}{Assembly.checkout_name(repo_dir, checkout)}{Terminal.Text.RESET}")
+        for change in changes[checkout]:
+            print(f"{margin}    {ChangeCache.format_change(change)}")
+        if len(changes[checkout]) == 0:
+            print(f"{margin}    {Terminal.Text.GREY}new versions of its dependencies{Terminal.Text.RESET}")
+    if len(changes) == 0:
+        input(f"{margin}  No files changed. Press enter to continue.")
+        Terminal.Screen.clear_screen()
+        return
+    commit_message = input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.BLUE}What changes were made? {Terminal.Text.CYAN}Press enter when done, but type here: {Terminal.Text.RESET}")
+    print()
+    with Handler.handle_repository_lock([repo_dir], f"push {root_repo} assembly"):
+        results = Assembly.push_assembly(repo_dir, commit_message)
+    # print summary of the push
+    statuses = [result[1] for result in results]
+    print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}{statuses.count('pushed')} pushed{Terminal.Text.RESET}, {Terminal.Text.BOLD}{Terminal.Text.RED}{len(statuses) - statuses.count('pushed')} failed or skipped{Terminal.Text.RESET}")
+    input(f"\n{margin}Press enter to continue.")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
+
 def handle_create_dependency(cwd: path):
     """
     Create a new dependency between a repository and a parent repository. 
@@ -101,7 +267,7 @@ def handle_create_dependency(cwd: path):
         Terminal.Screen.clear_screen()
         return
     # repos that are already dependencies of the parent; ignore them below
-    current_repo_deps = Handler.handle_repository_dependendencies(cwd=cwd / path(parent_repo))
+    current_repo_deps = Handler.handle_repository_dependendencies(cwd=Workspace.repo_dir(cwd, parent_repo))
     ignore_repos = current_repo_deps # repos to ignore
     ignore_repos.append(parent_repo)
     # get the dependency repo from another menu
@@ -124,15 +290,16 @@ def handle_create_dependency(cwd: path):
     margin = " " * GUIMenu.MENU_ORIGIN[0]
     try:
         # get repo directories 
-        parent_repo_dir = cwd / path(parent_repo)
-        dep_repo_dir = cwd / path(dep_repo)
+        parent_repo_dir = Workspace.repo_dir(cwd, parent_repo)
+        dep_repo_dir = Workspace.repo_dir(cwd, dep_repo)
         # get dependency repo url from bash
         dep_repo_ssh_url = Terminal.run_bash_cmd(["git", "remote", "get-url", "origin"], cwd=str(dep_repo_dir)).stdout.strip()
 
         # add dependency repo by its url and push parent repo to github
-        Terminal.run_bash_cmd(["git", "submodule", "add", dep_repo_ssh_url, f"{path('dep') / path(dep_repo)}"], cwd=str(parent_repo_dir))
-        Terminal.run_bash_cmd(["git", "commit", "-am", f"Created {dep_repo} as a submodule/dependency to {parent_repo}"], cwd=str(parent_repo_dir))
-        Terminal.run_bash_cmd(["git", "push"], cwd=str(parent_repo_dir))
+        with Handler.handle_repository_lock([parent_repo_dir], f"add {dep_repo} to {parent_repo}"):
+            for cmd in Handler.create_dependency_bash_cmds(dep_repo_ssh_url, dep_repo, parent_repo):
+                Terminal.run_bash_cmd(cmd, cwd=str(parent_repo_dir))
+            ObjectCache.absorb_repository(parent_repo_dir)
         input(f"\n{margin}{Terminal.Text.GREEN}Successfully created dependency and pushed it to GitHub.{Terminal.Text.RESET} Press enter to continue.\n")
     except:
         input(f"\n{margin}{Terminal.Text.RED}Failed to create dependency. It may already exist, or a chosen repository does not.{Terminal.Text.RESET} Press enter to continue.\n")
@@ -160,7 +327,7 @@ def handle_delete_dependency(cwd: path):
         Terminal.Screen.clear_screen()
         return
     # get repos allowed to be deleted (deps of the parent)
-    allowed_repos = Handler.handle_repository_dependendencies(cwd=cwd / path(parent_repo))
+    allowed_repos = Handler.handle_repository_dependendencies(cwd=Workspace.repo_dir(cwd, parent_repo))
     # get dependency repo from another menu
     dep_repo = Handler.handle_repository_menu(
         cwd=cwd, 
@@ -182,27 +349,28 @@ def handle_delete_dependency(cwd: path):
     margin = " " * GUIMenu.MENU_ORIGIN[0]
     try:
         # get parent repo directory 
-        parent_repo_dir = cwd / path(parent_repo)
-        # run dependency removal bash
-        # remove submodule tracking
-        Terminal.run_bash_cmd(["git", "submodule", "deinit", "-f", f"{path('dep') / path(dep_repo)}"], cwd=str(parent_repo_dir))
-        Terminal.run_bash_cmd(["git", "rm", "-f", f"{path('dep') / path(dep_repo)}"], cwd=str(parent_repo_dir))
+        parent_repo_dir = Workspace.repo_dir(cwd, parent_repo)
+        with Handler.handle_repository_lock([parent_repo_dir], f"delete {dep_repo} from {parent_repo}"):
+            # run dependency removal bash
+            # remove submodule tracking
+            Terminal.run_bash_cmd(["git", "submodule", "deinit", "-f", f"{path('dep') / path(dep_repo)}"], cwd=str(parent_repo_dir))
+            Terminal.run_bash_cmd(["git", "rm", "-f", f"{path('dep') / path(dep_repo)}"], cwd=str(parent_repo_dir))
     
-        # get args based on os
-        args = (None, None, None)
-        if sys.platform.startswith("win"):
-            args = ("rmdir", "/s", "/q")
-        elif sys.platform.startswith("linux"):
-            args = ("rm", "-rf", " ")
-        elif sys.platform.startswith("darwin"):
-            args = ("rm", "-rf", " ")
-        # clean up metadata left over
-        Terminal.run_bash_cmd([args[0], args[1], args[2], f"{path('.git') / path('modules') / path('dep') / path(dep_repo)}"], cwd=str(parent_repo_dir))
-        Terminal.run_bash_cmd([args[0], args[1], args[2], f"{path('dep') / path(dep_repo)}"], cwd=str(parent_repo_dir))
+            # get args based on os
+            args = (None, None, None)
+            if sys.platform.startswith("win"):
+                args = ("rmdir", "/s", "/q")
+            elif sys.platform.startswith("linux"):
+                args = ("rm", "-rf", " ")
+            elif sys.platform.startswith("darwin"):
+                args = ("rm", "-rf", " ")
+            # clean up metadata left over
+            Terminal.run_bash_cmd([args[0], args[1], args[2], f"{path('.git') / path('modules') / path('dep') / path(dep_repo)}"], cwd=str(parent_repo_dir))
+            Terminal.run_bash_cmd([args[0], args[1], args[2], f"{path('dep') / path(dep_repo)}"], cwd=str(parent_repo_dir))
        
-        # commit and push changes of removed dependency
-        Terminal.run_bash_cmd(["git", "commit", "-m", f"Deleted submodule/dependency {dep_repo} from {parent_repo}"], cwd=str(parent_repo_dir))
-        Terminal.run_bash_cmd(["git", "push"], cwd=str(parent_repo_dir))
+            # commit and push changes of removed dependency
+            Terminal.run_bash_cmd(["git", "commit", "-m", f"Deleted submodule/dependency {dep_repo} from {parent_repo}"], cwd=str(parent_repo_dir))
+            Terminal.run_bash_cmd(["git", "push"], cwd=str(parent_repo_dir))
         input(f"\n{margin}{Terminal.Text.GREEN}Successfully deleted dependency and pushed change to GitHub.{Terminal.Text.RESET} Press enter to continue.\n")
     except Exception as e:
         input(f"\n{margin}{Terminal.Text.RED}Failed to delete dependency. It may not exist, or already deleted.{Terminal.Text.RESET} Press enter to continue.\n")
@@ -211,63 +379,544 @@ def handle_delete_dependency(cwd: path):
 
 def handle_restore_dependencies(cwd: str):
     """
-    Resets dependencies to the current versions tagged and available for a repository.
+    Resets dependencies to the current versions tagged and available for a repository. Only dependencies that are
+    missing, at another version or have local changes are touched.
     param: cwd [str] The GitHub current working directory
     """
-    Handler.handle_repository_menu(
+    # get the repo to restore from the menu
+    local_repo = Handler.handle_repository_menu(
         cwd=cwd,
         menu_title="Here are your local repos.",
         subtitle_text=f"Select which to {Terminal.Text.YELLOW}restore{Terminal.Text.CYAN} its {Terminal.Text.YELLOW}dependencies{Terminal.Text.CYAN} for.",
-        bash_cmds=[
-            # pull content of current versions of deps and do a hard-reset on local copies
-            ["git", "fetch", "origin"],
-            ["git", "submodule", "update", "--init", "--recursive"],
-            ["git", "submodule", "foreach", "--recursive", "git reset --hard"]
-        ],
-        
-        success_msg="Successfully synced dependencies with versions on GitHub.",
-        err_msg="Failed to sync dependencies."
+        bash_cmds=[],
+        success_msg="",
+        err_msg="",
+        pause_prompt=False,
+        auto_close=False
     )
+    # check if the menu was exited
+    if local_repo.__contains__('<') and local_repo.__contains__('>'):
+        Terminal.Screen.clear_screen()
+        return
+    if Settings.get("background_jobs"):
+        repo_dir = Workspace.repo_dir(cwd, local_repo)
+        Jobs.submit("restore_dependencies", f"restore {local_repo}", [repo_dir], functools.partial(restore_job, repo_dir=repo_dir))
+        Terminal.Screen.clear_screen()
+        return
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.UNDERLINE}Restoring dependencies of {local_repo}:{Terminal.Text.RESET}")
+    repo_dir = Workspace.repo_dir(cwd, local_repo)
+    with Handler.handle_repository_lock([repo_dir], f"restore {local_repo}"):
+        repo_name, succeeded, failed_cmd, err_text, elapsed, changes = Restore.restore_repository(repo_dir)
+    for change in changes:
+        print(f"{margin}  {Restore.format_change(change)}")
+    if len(changes) == 0:
+        print(f"{margin}  All dependencies are already at their pinned versions.")
+    if succeeded:
+        input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}Successfully synced dependencies with versions on GitHub.{Terminal.Text.RESET} Press enter to continue.\n")
+    else:
+        print(f"\n{margin}{Terminal.Text.GREY}{err_text}{Terminal.Text.RESET}")
+        input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.RED}Failed to sync dependencies.{Terminal.Text.RESET} Press enter to continue.\n")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
 
 def handle_update_to_latest_dependencies(cwd: str):
     """
-    Refreshes the dependencies attached to a repository by pulling updated dependency content from GitHub. 
+    Refreshes the dependencies attached to a repository by pulling updated dependency content from GitHub. Which
+    dependencies would change is shown first, and nothing is done if they are all current.
     """
-    Handler.handle_repository_menu(
+    local_repo = Handler.handle_repository_menu(
         cwd=cwd,
         menu_title="Here are your local repositories.",
         subtitle_text=f"Select which to {Terminal.Text.YELLOW}update dependencies{Terminal.Text.CYAN} to {Terminal.Text.YELLOW}latest versions{Terminal.Text.CYAN} for.",
-        bash_cmds=[
-            # get latest versions of deps and push these changes to github 
-            ["git", "submodule", "update", "--remote"],
-            ["git", "add", f"{path('dep') / path('*')}"],
-            ["git", "commit", "-m", "Updated submodules/dependencies"],
-            ["git", "push"],
-            # pull content of latests versions of deps and do a hard-reset on local copies
-            ["git", "fetch", "origin"],
-            ["git", "submodule", "update", "--init", "--recursive"],
-            ["git", "submodule", "foreach", "--recursive", "git reset --hard"]
-        ],
-        success_msg="Dependencies successfully updated and then pushed to GitHub.",
-        err_msg="Failed to update dependencies. It could be that they're already up to date." 
+        bash_cmds=[],
+        success_msg="",
+        err_msg="",
+        pause_prompt=False,
+        auto_close=False
+    )
+    # check if the menu was exited
+    if local_repo.__contains__('<') and local_repo.__contains__('>'):
+        Terminal.Screen.clear_screen()
+        return
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    repo_dir = Workspace.repo_dir(cwd, local_repo)
+    rows = Assembly.update_preview([repo_dir])
+    outdated = [row for row in rows if row["status"] != "current"]
+    print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.UNDERLINE}Dependencies of {local_repo}:{Terminal.Text.RESET}")
+    widths = (max([len(row["repo"]) for row in rows] + [0]), max([len(row["dependency"]) for row in rows] + [0]))
+    for row in rows:
+        print(f"{margin}  {Assembly.format_preview_row(row, widths)}")
+    if len(outdated) == 0:
+        input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}Dependencies are already at their latest versions.{Terminal.Text.RESET} Press enter to continue.\n")
+        Terminal.Screen.clear_screen()
+        return
+    if Settings.get("background_jobs"):
+        Jobs.submit("update_to_latest_dependencies", f"update {local_repo}", [repo_dir], functools.partial(update_job, repo_dir=repo_dir))
+        input(f"\n{margin}{Terminal.Text.GREEN}Updating in the background.{Terminal.Text.RESET} Press enter to continue.\n")
+        Terminal.Screen.clear_screen()
+        return
+    # get latest versions of deps and push these changes to github, then bring local copies to them
+    with Handler.handle_repository_lock([repo_dir], f"update {local_repo}"), SharedFetch.session():
+        repo_name, status, detail, elapsed = Assembly.update_repository_dependencies(repo_dir)
+    if status in ("updated", "current"):
+        input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}Dependencies successfully updated and then pushed to GitHub.{Terminal.Text.RESET} Press enter to continue.\n")
+    else:
+        print(f"\n{margin}{Terminal.Text.GREY}{detail}{Terminal.Text.RESET}")
+        input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.RED}Failed to update dependencies.{Terminal.Text.RESET} Press enter to continue.\n")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
+
+def handle_update_preview(cwd: path):
+    """
+    Shows which dependencies of every repository are behind their latest versions on GitHub, without changing or
+    downloading anything. This is for the main menu.
+    param: cwd [str] The GitHub current working directory
+    """
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    print(f"\n{margin}Checking which {Terminal.Text.YELLOW}dependencies{Terminal.Text.END} have newer versions on GitHub.\n")
+    rows = [row for row in Assembly.update_preview(Handler.handle_local_repositories(cwd)) if row["status"] != "current"]
+    widths = (max([len(row["repo"]) for row in rows] + [len("Parent")]), max([len(row["dependency"]) for row in rows] + [len("Dependency")]))
+    if len(rows) == 0:
+        print(f"{margin}{Terminal.Text.GREEN}Every dependency is at its latest version.{Terminal.Text.RESET}")
+    else:
+        print(f"{margin}  {Terminal.Text.BOLD}{'Parent':<{widths[0]}}  {'Dependency':<{widths[1]}}  Pinned -> Latest{Terminal.Text.RESET}")
+        for row in rows:
+            print(f"{margin}  {Assembly.format_preview_row(row, widths)}")
+        print(f"\n{margin}{len([row for row in rows if row['status'] == 'outdated'])} outdated, {len([row for row in rows if row['status'] == 'unknown'])} could not be checked")
+    input(f"\n{margin}Press enter to continue.")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
+
+def handle_update_assembly_dependencies(cwd: path):
+    """
+    Updates dependencies to their latest versions through a whole assembly tree, leaves first, so a change to a
+    dependency rolls up through every parent that uses it. This is for the main menu.
+    param: cwd [str] The GitHub current working directory
+    """
+    # get the top-level assembly from the menu
+    root_repo = Handler.handle_repository_menu(
+        cwd=cwd,
+        menu_title="Here are your local repositories.",
+        subtitle_text=f"Select the {Terminal.Text.YELLOW}assembly{Terminal.Text.CYAN} to {Terminal.Text.YELLOW}update dependencies{Terminal.Text.CYAN} to {Terminal.Text.YELLOW}latest versions{Terminal.Text.CYAN} all the way down.",
+        bash_cmds=[],
+        success_msg="",
+        err_msg="",
+        pause_prompt=False,
+        auto_close=False
     )
+    # check if the menu was exited
+    if root_repo.__contains__('<') and root_repo.__contains__('>'):
+        Terminal.Screen.clear_screen()
+        return
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.UNDERLINE}Updating the {root_repo} assembly, leaves first:{Terminal.Text.RESET}")
+    with Handler.handle_repository_lock([Workspace.repo_dir(cwd, root_repo)], f"update {root_repo} assembly"):
+        results = Assembly.update_assembly(cwd=cwd, roots=[root_repo])
+    # print summary of the update
+    statuses = [result[1] for result in results]
+    print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}{statuses.count('updated')} updated{Terminal.Text.RESET}, {statuses.count('current')} already current, {Terminal.Text.BOLD}{Terminal.Text.RED}{len(statuses) - statuses.count('updated') - statuses.count('current')} failed or skipped{Terminal.Text.RESET}")
+    for repo_name, status, detail, elapsed in results:
+        if status not in ("updated", "current"):
+            print(f"{margin}  {Terminal.Text.RED}{repo_name}{Terminal.Text.RESET} ({status}): {detail}")
+    input(f"\n{margin}Press enter to continue.")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
+
+def handle_open_version(cwd: path):
+    """
+    Opens a repository, or a dependency checked out inside it, at another commit, tag or branch in its own folder. The
+    version shares objects with the checkout, so nothing is downloaded again and the checkout in use is not touched.
+    This is for the main menu.
+    param: cwd [str] The GitHub current working directory
+    """
+    local_repo = Handler.handle_repository_menu(
+        cwd=cwd,
+        menu_title="Here are your local repositories.",
+        subtitle_text=f"Select which to {Terminal.Text.YELLOW}open another version{Terminal.Text.CYAN} of, or of one of its {Terminal.Text.YELLOW}dependencies{Terminal.Text.CYAN}.",
+        bash_cmds=[],
+        success_msg="",
+        err_msg="",
+        pause_prompt=False,
+        auto_close=False
+    )
+    # check if the menu was exited
+    if local_repo.__contains__('<') and local_repo.__contains__('>'):
+        Terminal.Screen.clear_screen()
+        return
+    repo_dir = Workspace.repo_dir(cwd, local_repo)
+    # pick the repository itself or one of the dependencies checked out inside it
+    checkouts = sorted(Assembly.checkout_tree(repo_dir).keys(), key=lambda checkout: Assembly.checkout_name(repo_dir, checkout))
+    checkout_menu = GUIMenu(title_text=f"Here are {local_repo} and its dependencies.", subtitle_text=f"Select which to {Terminal.Text.YELLOW}open another version{Terminal.Text.CYAN} of.", auto_close=False)
+    for checkout in checkouts:
+        checkout_menu.add_option(Assembly.checkout_name(repo_dir, checkout), checkout_menu.exit, option_value=str(checkout))
+    checkout_menu.add_option(f"{Terminal.Text.YELLOW}<GO BACK>{Terminal.Text.END}", checkout_menu.exit)
+    selected = checkout_menu.run()
+    if selected.__contains__('<') and selected.__contains__('>'):
+        Terminal.Screen.clear_screen()
+        return
+    checkout = path(selected)
+    name = Assembly.checkout_name(repo_dir, checkout)
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    Terminal.Screen.clear_screen()
+    # show recent commits and tags to pick from
+    print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.UNDERLINE}Recent versions of {name}:{Terminal.Text.RESET}")
+    result = Terminal.run_bash_cmd(["git", "log", "--oneline", "--decorate", "-15"], cwd=checkout, verbose=False)
+    for line in (result.stdout.splitlines() if result is not None else []):
+        print(f"{margin}  {line}")
+    result = Terminal.run_bash_cmd(["git", "tag", "--sort=-creatordate"], cwd=checkout, verbose=False)
+    tags = result.stdout.split() if result is not None and result.returncode == 0 else []
+    if len(tags) > 0:
+        print(f"\n{margin}{Terminal.Text.BOLD}Tags:{Terminal.Text.RESET} {', '.join(tags[:15])}")
+    rev = input(f"\n{margin}Enter the {Terminal.Text.YELLOW}commit, tag or branch{Terminal.Text.RESET} to open (empty to go back): ").strip()
+    if len(rev) == 0:
+        Terminal.Screen.clear_screen()
+        return
+    label = input(f"{margin}Enter a {Terminal.Text.YELLOW}name{Terminal.Text.RESET} for its folder; an open version with the same name is switched (empty for {Worktree.label_for(rev)}): ").strip()
+    print(f"\n{margin}Opening {name} at {rev}...")
+    with Handler.handle_repository_lock([checkout], f"open {name} at {rev}"):
+        worktree, sha, failed_cmd, err_text = Worktree.open_version(checkout, name, rev, label=label or None)
+    if failed_cmd is None:
+        print(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}Opened {name} at {sha[:12]} in:{Terminal.Text.RESET}")
+        print(f"{margin}  {worktree}")
+        input(f"\n{margin}Press enter to continue.")
+    else:
+        print(f"{margin}{Terminal.Text.GREY}{failed_cmd}: {err_text}{Terminal.Text.RESET}")
+        input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.RED}Failed to open the version.{Terminal.Text.RESET} Press enter to continue.\n")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
+
+def handle_versions_cleanup(cwd: path):
+    """
+    Lists the versions opened in their own folders and removes them, or only the ones deleted by hand. This is for
+    the main menu.
+    param: cwd [str] The GitHub current working directory
+    """
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    print(f"\n{margin}Lets {Terminal.Text.YELLOW}clean up{Terminal.Text.END} opened versions.\n")
+    with Handler.handle_repository_lock(Worktree.sources(), "clean up opened versions"):
+        forgotten = Worktree.prune()
+    versions = Worktree.list_versions()
+    if len(forgotten) > 0:
+        print(f"{margin}{len(forgotten)} versions deleted by hand were forgotten.")
+    if len(versions) == 0:
+        print(f"{margin}No versions are open.")
+        input(f"\n{margin}Press enter to continue.")
+        Terminal.Screen.clear_screen()
+        return
+    for entry in versions:
+        print(f"{margin}  {Terminal.Text.BLUE}{entry['name']}{Terminal.Text.RESET} at {entry['rev']} ({entry['sha'][:12]})  {Terminal.Text.GREY}{entry['path']}{Terminal.Text.RESET}")
+    answer = input(f"\n{margin}Remove all of them? Changes made in them are lost. (y/n) ").strip().lower()
+    if answer in ("y", "yes"):
+        with Handler.handle_repository_lock(Worktree.sources(), "clean up opened versions"):
+            removed = sum([Worktree.remove_version(path(entry["path"])) for entry in versions])
+        print(f"{margin}{Terminal.Text.GREEN}{removed} versions removed.{Terminal.Text.RESET}")
+        input(f"\n{margin}Press enter to continue.")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
+
+def handle_export_bundles(cwd: path):
+    """
+    Exports an assembly and every dependency checked out inside it as bundles for a machine without GitHub access.
+    Only commits made since the last export to that machine are included. This is for the main menu.
+    param: cwd [str] The GitHub current working directory
+    """
+    local_repo = Handler.handle_repository_menu(
+        cwd=cwd,
+        menu_title="Here are your local repositories.",
+        subtitle_text=f"Select the {Terminal.Text.YELLOW}assembly{Terminal.Text.CYAN} to {Terminal.Text.YELLOW}export{Terminal.Text.CYAN} for an offline machine.",
+        bash_cmds=[],
+        success_msg="",
+        err_msg="",
+        pause_prompt=False,
+        auto_close=False
+    )
+    # check if the menu was exited
+    if local_repo.__contains__('<') and local_repo.__contains__('>'):
+        Terminal.Screen.clear_screen()
+        return
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    target = input(f"\n{margin}Enter the {Terminal.Text.YELLOW}name of the offline machine{Terminal.Text.RESET} (empty for offline): ").strip() or "offline"
+    out_dir = input(f"{margin}Enter the {Terminal.Text.YELLOW}folder{Terminal.Text.RESET} to export to, i.e. a USB drive (empty for {Bundle.bundles_dir()}): ").strip()
+    print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.UNDERLINE}Exporting {local_repo} for {target}:{Terminal.Text.RESET}")
+    repo_dir = Workspace.repo_dir(cwd, local_repo)
+    with Handler.handle_repository_lock([repo_dir], f"export {local_repo}"):
+        export_dir, rows = Bundle.export_assembly(repo_dir, target, path(out_dir) if out_dir else None)
+    for row in rows:
+        print(f"{margin}  {Bundle.format_export_row(row)}")
+    if any([row["status"] == "failed" for row in rows]):
+        input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.RED}Failed to export some repositories.{Terminal.Text.RESET} Press enter to continue.\n")
+    elif export_dir is None:
+        input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}Nothing changed since the last export to {target}.{Terminal.Text.RESET} Press enter to continue.\n")
+    else:
+        print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}Exported {ChangeCache.format_size(sum([row['size'] for row in rows]))} to:{Terminal.Text.RESET}")
+        print(f"{margin}  {export_dir}")
+        input(f"\n{margin}Press enter to continue.")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
+
+def handle_import_bundles(cwd: path):
+    """
+    Imports exported bundles into the existing clones of their assemblies, oldest first, and restores the
+    dependencies to their pinned versions, without the network. This is for the main menu.
+    param: cwd [str] The GitHub current working directory
+    """
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    print(f"\n{margin}Lets {Terminal.Text.YELLOW}import{Terminal.Text.END} assemblies exported on another machine.\n")
+    folder = input(f"{margin}Enter the {Terminal.Text.YELLOW}folder{Terminal.Text.RESET} of the export, or one holding exports, i.e. a USB drive: ").strip()
+    export_dirs = Bundle.export_dirs(path(folder)) if folder else []
+    if len(export_dirs) == 0:
+        input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.RED}No exports found.{Terminal.Text.RESET} Press enter to continue.\n")
+        Terminal.Screen.clear_screen()
+        return
+    failed = 0
+    for export_dir in export_dirs:
+        assembly = Bundle.export_assembly_name(export_dir)
+        with Handler.handle_repository_lock([Workspace.repo_dir(cwd, assembly)], f"import {assembly}"):
+            assembly, rows, restored = Bundle.import_export(export_dir, cwd)
+        print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.UNDERLINE}Importing {assembly} from {export_dir.name}:{Terminal.Text.RESET}")
+        for row in rows:
+            print(f"{margin}  {Bundle.format_import_row(row)}")
+        failed += len([row for row in rows if row["status"] == "failed"])
+        if restored is not None:
+            for change in restored[5]:
+                print(f"{margin}  {Restore.format_change(change)}")
+            if not restored[1]:
+                failed += 1
+                print(f"{margin}  {Terminal.Text.GREY}{restored[3]}{Terminal.Text.RESET}")
+    if failed > 0:
+        input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.RED}Failed to import some repositories.{Terminal.Text.RESET} Press enter to continue.\n")
+    else:
+        input(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}Successfully imported {len(export_dirs)} exports.{Terminal.Text.RESET} Press enter to continue.\n")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
+
+def handle_shared_objects_cleanup(cwd: path):
+    """
+    Moves the objects of every dependency clone in the workspace into the shared object store, so each dependency is
+    stored once, then runs garbage collection on the store. This is for the main menu.
+    param: cwd [str] The GitHub current working directory
+    """
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    print(f"\n{margin}Lets {Terminal.Text.YELLOW}clean up{Terminal.Text.END} shared dependency objects.\n")
+    repo_dirs = Handler.handle_local_repositories(cwd)
+    with Handler.handle_repository_lock(repo_dirs, "clean up shared objects"):
+        with ThreadPoolExecutor(max_workers=max(1, int(Settings.get("pool_workers"))), **Trace.pool_args()) as executor:
+            absorbed = sum(executor.map(ObjectCache.absorb_repository, repo_dirs))
+        borrowers, dropped = ObjectCache.collect_garbage(repo_dirs)
+    print(f"{margin}{Terminal.Text.GREEN}{absorbed} dependency clones shared{Terminal.Text.RESET}, {borrowers} borrowing from the store, {dropped} unused dependencies dropped.")
+    input(f"\n{margin}Press enter to continue.")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
+
+def handle_repository_maintenance(cwd: path):
+    """
+    Packs loose objects and small packs, writes the commit-graph and drops old stashes of every repository that needs
+    it, showing the space saved and how much faster each history is to walk. This is for the main menu.
+    param: cwd [str] The GitHub current working directory
+    """
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    print(f"\n{margin}Lets run {Terminal.Text.YELLOW}maintenance{Terminal.Text.END} on the repositories that need it.\n")
+    repo_dirs = Handler.handle_local_repositories(cwd)
+    with Handler.handle_repository_lock(repo_dirs, "maintenance"):
+        reports = Maintenance.run_once(repo_dirs)
+    for report in reports:
+        print(f"{margin}  {Maintenance.format_report(report)}")
+    maintained = [report for report in reports if report["ok"] and len(report["tasks"]) > 0]
+    saved_kb = sum([max(0, report["saved_kb"]) for report in maintained])
+    print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}{len(maintained)} maintained{Terminal.Text.RESET}, {ChangeCache.format_size(saved_kb * 1024)} saved, {len([report for report in reports if not report['ok']])} failed")
+    input(f"\n{margin}Press enter to continue.")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
+
+def handle_trace_summary(cwd: path):
+    """
+    Shows the slowest repositories and commands of each operation from the recorded command trace. This is for the
+    main menu.
+    param: cwd [str] The GitHub current working directory
+    """
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    print(f"\n{margin}Slowest {Terminal.Text.YELLOW}repositories and commands{Terminal.Text.END} of each operation, from {Trace.trace_file()}\n")
+    operations = Trace.summary(top=5)
+    if len(operations) == 0:
+        print(f"{margin}No commands recorded yet.")
+    for name, operation in operations.items():
+        print(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.BLUE}{name}{Terminal.Text.RESET}: {operation['runs']} runs, {operation['commands']} commands, {operation['seconds']}s total, {operation['nonzero_exits']} non-zero exits")
+        for repo in operation["slowest_repos"]:
+            print(f"{margin}{margin}{Terminal.Text.YELLOW}{repo['seconds']:>8.3f}s{Terminal.Text.RESET}  {repo['repo']}")
+        for cmd in operation["slowest_commands"]:
+            print(f"{margin}{margin}{Terminal.Text.CYAN}{cmd['seconds']:>8.3f}s{Terminal.Text.RESET}  {cmd['cmd']} x{cmd['count']} (max {cmd['max_seconds']}s)")
+        print()
+    input(f"{margin}Press enter to continue.")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
+
+def handle_disk_usage(cwd: path):
+    """
+    Shows the disk space of every repository and dependency in the workspace, objects stored more than once across
+    them, the largest files in their history and how much space dedup and pruning would reclaim. This is for the main
+    menu.
+    param: cwd [str] The GitHub current working directory
+    """
+    margin = " " * GUIMenu.MENU_ORIGIN[0]
+    print(f"\n{margin}Lets look at the {Terminal.Text.YELLOW}disk usage{Terminal.Text.END} of the workspace.\n")
+    report = DiskUsage.analyze(Handler.handle_local_repositories(cwd))
+    for repo in report["repos"]:
+        print(f"{margin}{Terminal.Text.BOLD}{Terminal.Text.BLUE}{ChangeCache.format_size(repo['total_bytes']):>10}{Terminal.Text.RESET}  {repo['repo']} ({ChangeCache.format_size(repo['worktree_bytes'])} files, {ChangeCache.format_size(repo['objects_bytes'])} history)")
+        for row in [row for row in report["checkouts"] if row["repo"] == repo["repo"] and row["kind"] == "dependency"]:
+            shared = " shared" if row["linked"] else ""
+            print(f"{margin}{margin}{Terminal.Text.GREY}{ChangeCache.format_size(row['worktree_bytes'] + row['objects_bytes']):>10}  {row['name']}{shared}{Terminal.Text.RESET}")
+    print(f"\n{margin}Shared object store {ChangeCache.format_size(report['store_bytes'])}, LFS cache {ChangeCache.format_size(report['lfs_cache_bytes'])}, opened versions {ChangeCache.format_size(report['versions_bytes'])}")
+    duplicates = report["duplicates"]
+    print(f"\n{margin}{Terminal.Text.YELLOW}{duplicates['objects']} objects{Terminal.Text.RESET} stored more than once, {ChangeCache.format_size(duplicates['bytes'])} of extra copies")
+    for duplicate in duplicates["largest"]:
+        print(f"{margin}{margin}{ChangeCache.format_size(duplicate['bytes']):>10} x{duplicate['copies']}  {duplicate['path'] or duplicate['oid'][:12]} {Terminal.Text.GREY}in {', '.join(duplicate['stores'])}{Terminal.Text.RESET}")
+    print(f"\n{margin}{Terminal.Text.YELLOW}Largest files{Terminal.Text.RESET} in history")
+    for largest in report["largest_files"]:
+        print(f"{margin}{margin}{ChangeCache.format_size(largest['size']):>10}  {largest['path']} {Terminal.Text.GREY}{largest['oid'][:12]} in {', '.join(largest['repos'])}{Terminal.Text.RESET}")
+    reclaimable = report["reclaimable"]
+    print(f"\n{margin}{Terminal.Text.BOLD}{Terminal.Text.GREEN}{ChangeCache.format_size(sum(reclaimable.values()))} reclaimable{Terminal.Text.RESET}: "
+          f"{ChangeCache.format_size(reclaimable['dedup'])} by storing duplicate objects once, {ChangeCache.format_size(reclaimable['prune'])} by pruning, "
+          f"{ChangeCache.format_size(reclaimable['versions'])} by removing opened versions, {ChangeCache.format_size(reclaimable['lfs'])} by pruning the LFS cache")
+    input(f"\n{margin}Press enter to continue.")
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
+
+def pull_job(job: Jobs.Job, repo_dirs: list):
+    """
+    Pulls repositories and their dependencies, with their large files, as a background job.
+    param: job [Job] The job
+    param: repo_dirs [list] Directories of the repositories
+    returns: (succeeded, detail text)
+    """
+    job.progress = f"pulling {len(repo_dirs)} repositories"
+    results = Handler.handle_pull_repositories(repo_dirs=repo_dirs, verbose=False, should_stop=job.cancelled, on_progress=job.set_progress)
+    failed = [result for result in results if not result[1]]
+    if job.cancelled():
+        return (False, f"cancelled; {len(results) - len(failed)} pulled")
+    detail = f"{len(results) - len(failed)} pulled, {len(failed)} failed"
+    if len(failed) > 0:
+        detail += f": {', '.join([f'{repo_name} ({failed_cmd})' for repo_name, succeeded, failed_cmd, err_text, elapsed in failed])}"
+    return (len(failed) == 0, detail)
+
+def restore_job(job: Jobs.Job, repo_dir: path):
+    """
+    Restores the dependencies of a repository as a background job.
+    param: job [Job] The job
+    param: repo_dir [path] Directory of the repository
+    returns: (succeeded, detail text)
+    """
+    repo_name, succeeded, failed_cmd, err_text, elapsed, changes = Restore.restore_repository(repo_dir, should_stop=job.cancelled, on_progress=job.set_progress)
+    if failed_cmd == "cancelled":
+        return (False, f"cancelled; {len(changes)} dependencies restored")
+    return (succeeded, f"{len(changes)} dependencies restored" if succeeded else f"{failed_cmd}: {err_text}")
+
+def update_job(job: Jobs.Job, repo_dir: path):
+    """
+    Updates the dependencies of a repository to their latest versions and pushes it as a background job.
+    param: job [Job] The job
+    param: repo_dir [path] Directory of the repository
+    returns: (succeeded, detail text)
+    """
+    with SharedFetch.session():
+        repo_name, status, detail, elapsed = Assembly.update_repository_dependencies(repo_dir, should_stop=job.cancelled, on_progress=job.set_progress)
+    if status == "cancelled":
+        return (False, f"cancelled; {detail}" if len(detail) > 0 else "cancelled before anything changed")
+    return (status in ("updated", "current"), status if status in ("updated", "current") else detail)
+
+def handle_jobs_panel():
+    """
+    Shows the background jobs and their progress, redrawn as they run. The selected job can be cancelled or retried,
+    and finished jobs cleared. This is for the main menu.
+    """
+    import readchar # only needed once the panel runs
+    panel = GUIMenu(title_text="Here are your background jobs.", subtitle_text=f"{Terminal.Text.YELLOW}c{Terminal.Text.CYAN} cancel, {Terminal.Text.YELLOW}r{Terminal.Text.CYAN} retry, {Terminal.Text.YELLOW}x{Terminal.Text.CYAN} clear finished, {Terminal.Text.YELLOW}q{Terminal.Text.CYAN} go back", auto_close=False)
+    separator = "=" * GUIMenu.MENU_WIDTH
+    margin = GUIMenu.MENU_ORIGIN[0]
+    selected = 0
+    while True:
+        jobs = Jobs.jobs()
+        selected = max(0, min(selected, len(jobs) - 1))
+        frame = [""] * (GUIMenu.MENU_ORIGIN[1] + 1) # offset to menu origin
+        frame.append(panel.format_line(line=separator, padding=0, margin=margin))
+        frame.append(panel.format_line(line=f"{Terminal.Text.BLUE}{Terminal.Text.BOLD}{panel.title_text}{Terminal.Text.RESET}", padding=GUIMenu.MENU_PADDING, margin=margin))
+        frame.append(panel.format_line(line=f"{Terminal.Text.CYAN}{panel.subtitle_text}{Terminal.Text.RESET}", padding=GUIMenu.MENU_PADDING, margin=margin))
+        frame.append(panel.format_line(line=separator, padding=0, margin=margin))
+        # rows of jobs, keeping the selected one on screen
+        height = panel.window_height(len(frame) + 1)
+        first = max(0, selected - height + 1)
+        for position in range(first, min(len(jobs), first + height)):
+            selector = f"{Terminal.Text.BOLD}{GUIMenu.MENU_ARROW}{Terminal.Text.RESET}" if position == selected else " "
+            frame.append(panel.format_line(line=f"{selector} {Jobs.format_job(jobs[position])}", padding=GUIMenu.MENU_PADDING, margin=margin))
+        if len(jobs) == 0:
+            frame.append(panel.format_line(line=f"{Terminal.Text.GREY}No jobs yet.{Terminal.Text.RESET}", padding=GUIMenu.MENU_PADDING, margin=margin))
+        # the selected job's result in full, since rows are cut off
+        detail = jobs[selected].detail or jobs[selected].progress if len(jobs) > 0 else ""
+        frame.append(panel.format_line(line=f"{Terminal.Text.GREY}{detail.splitlines()[-1] if len(detail) > 0 else ''}{Terminal.Text.RESET}", padding=GUIMenu.MENU_PADDING, margin=margin))
+        frame.append(panel.format_line(line=separator, padding=0, margin=margin))
+        panel.draw(frame)
+        # redraw the progress until a key is pressed
+        user_input = Terminal.read_key(0.5)
+        if user_input is None:
+            continue
+        if user_input == readchar.key.DOWN:
+            selected += 1
+        elif user_input == readchar.key.UP:
+            selected -= 1
+        elif user_input in ("c", "C") and len(jobs) > 0:
+            jobs[selected].cancel()
+        elif user_input in ("r", "R") and len(jobs) > 0:
+            if Jobs.retry(jobs[selected]) is not None:
+                selected = len(jobs) # the retried job is added at the bottom
+        elif user_input in ("x", "X"):
+            Jobs.clear_finished()
+        elif user_input in ("q", "Q", readchar.key.ESC, readchar.key.ENTER, readchar.key.CR):
+            break
+    # clear the screen once done with menu
+    Terminal.Screen.clear_screen()
 
 def handle_exit():
     margin = " " * GUIMenu.MENU_ORIGIN[0]
+    active = Jobs.active()
+    if len(active) > 0:
+        answer = input(f"\n{margin}{Terminal.Text.YELLOW}{len(active)} background jobs have not finished.{Terminal.Text.RESET} Cancel them and exit? (y/n) ").strip().lower()
+        if answer not in ("y", "yes"):
+            Terminal.Screen.clear_screen()
+            return
+        # jobs stop at their next step, once the commands they are running finish
+        Jobs.cancel_all()
+        print(f"{margin}Waiting for running jobs to finish their current step...")
     print(f"\n {margin}exiting program...")
     exit(0)
 
 def __main__():
+    # keep remotes fetched in the background while the menu is open, if turned on
+    Prefetch.start(Handler.handle_github_current_working_directory())
+    # keep repositories packed while the menu is idle, if turned on
+    Maintenance.start(Handler.handle_github_current_working_directory())
 
     # create the main menu
-    main_menu = GUIMenu(title_text="Welcome to GitCAD.", subtitle_text="What would you like to do? Use arrow keys to navigate.")
+    main_menu = GUIMenu(title_text="Welcome to GitCAD.", subtitle_text="What would you like to do? Use arrow keys to navigate.", status_handler=Jobs.status_line)
     main_menu.add_option("Clone a new repository from GitHub", handle_clone_repository, Handler.handle_github_current_working_directory)
     main_menu.add_option("Pull latest repository changes from GitHub", handle_pull_repository, Handler.handle_github_current_working_directory)
+    main_menu.add_option("Pull all repositories from GitHub at once", handle_pull_all_repositories, Handler.handle_github_current_working_directory)
     main_menu.add_option("Push repository changes back to GitHub", handle_push_repository, Handler.handle_github_current_working_directory)
+    main_menu.add_option("Push an assembly with its changed dependencies", handle_push_assembly, Handler.handle_github_current_working_directory)
     main_menu.add_option("Create a new dependency", handle_create_dependency, Handler.handle_github_current_working_directory)
     main_menu.add_option("Delete a dependency", handle_delete_dependency, Handler.handle_github_current_working_directory)
     main_menu.add_option("Retore dependencies to the current versions", handle_restore_dependencies, Handler.handle_github_current_working_directory)
+    main_menu.add_option("Preview which dependencies have newer versions", handle_update_preview, Handler.handle_github_current_working_directory)
     main_menu.add_option("Set dependencies latest versions available", handle_update_to_latest_dependencies, Handler.handle_github_current_working_directory)
+    main_menu.add_option("Set dependencies latest versions through a whole assembly", handle_update_assembly_dependencies, Handler.handle_github_current_working_directory)
+    main_menu.add_option("Open another version of a repository or dependency", handle_open_version, Handler.handle_github_current_working_directory)
+    main_menu.add_option("Clean up opened versions", handle_versions_cleanup, Handler.handle_github_current_working_directory)
+    main_menu.add_option("Export an assembly for an offline machine", handle_export_bundles, Handler.handle_github_current_working_directory)
+    main_menu.add_option("Import assemblies exported for this machine", handle_import_bundles, Handler.handle_github_current_working_directory)
+    main_menu.add_option("Clean up shared dependency objects", handle_shared_objects_cleanup, Handler.handle_github_current_working_directory)
+    main_menu.add_option("Run repository maintenance", handle_repository_maintenance, Handler.handle_github_current_working_directory)
+    main_menu.add_option("View slowest repositories and commands", handle_trace_summary, Handler.handle_github_current_working_directory)
+    main_menu.add_option("View disk usage and duplicate files", handle_disk_usage, Handler.handle_github_current_working_directory)
+    main_menu.add_option("View background jobs", handle_jobs_panel)
     main_menu.add_option(f"{Terminal.Text.YELLOW}<EXIT>{Terminal.Text.END}", handle_exit)
     # run the main menu
     main_menu.run()